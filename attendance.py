@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import argparse
+import csv
+import logging
+import logging.config
+import sys
+import time
+
+from datetime import datetime, timedelta
+
+from faceBase import getFaceBase
+
+# 考勤汇总：attendance_daily 表按（日期, 学号）记录当天首次、最后出现时间及识别次数
+# 识别事件写入时在同一事务中增量更新，报表查询只读汇总表，不扫描原始识别事件
+
+DAY_FORMAT = '%Y-%m-%d'
+
+
+# 时间戳所在的本地日期
+def dayOf(timestamp):
+    return time.strftime(DAY_FORMAT, time.localtime(timestamp))
+
+
+# 将一批识别事件合并为汇总增量，返回 {(day, stu_id): [first_seen, last_seen, count]}，陌生人脸不计入
+def aggregate(events):
+    rollups = {}
+    for event in events:
+        camera, track_id, face_id, stu_id, confidence, first_seen, last_seen, frames = event[:8]
+        if stu_id is None:
+            continue
+        key = (dayOf(first_seen), stu_id)
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollups[key] = [first_seen, last_seen, 1]
+        else:
+            rollup[0] = min(rollup[0], first_seen)
+            rollup[1] = max(rollup[1], last_seen)
+            rollup[2] += 1
+    return rollups
+
+
+# 在conn的当前事务中合并汇总增量
+def applyRollups(conn, rollups):
+    if not rollups:
+        return
+    conn.executemany('INSERT OR IGNORE INTO attendance_daily VALUES (?, ?, ?, ?, 0)',
+                     [(day, stu_id, first_seen, last_seen)
+                      for (day, stu_id), (first_seen, last_seen, count) in rollups.items()])
+    conn.executemany('''UPDATE attendance_daily SET first_seen=MIN(first_seen, ?), last_seen=MAX(last_seen, ?),
+                        count=count+? WHERE day=? AND stu_id=?''',
+                     [(first_seen, last_seen, count, day, stu_id)
+                      for (day, stu_id), (first_seen, last_seen, count) in rollups.items()])
+
+
+# 由原始识别事件重建汇总表（升级或汇总表损坏时使用），start、end为日期字符串，省略时重建全部
+# 识别事件按保留策略清理后汇总表是唯一的记录，省略start时从最早的识别事件的次日开始重建，不删除更早的汇总
+# （清理可能在一天中途截断，最早一天的识别事件不完整，其汇总保持不变）
+def rebuild(faceBase, start=None, end=None):
+    with faceBase.transaction() as conn:
+        if start is None:
+            earliest = conn.execute('SELECT MIN(first_seen) FROM recognition_events').fetchone()[0]
+            if earliest is None:
+                return 0
+            start = (datetime.strptime(dayOf(earliest), DAY_FORMAT) + timedelta(days=1)).strftime(DAY_FORMAT)
+        startTime = time.mktime(time.strptime(start, DAY_FORMAT))
+        endTime = time.mktime(time.strptime(end, DAY_FORMAT)) + 86400 if end else float('inf')
+        conn.execute('DELETE FROM attendance_daily WHERE day >= ? AND day <= ?', (start, end or '9999'))
+        conn.execute('''INSERT INTO attendance_daily
+                        SELECT date(first_seen, 'unixepoch', 'localtime') AS day, stu_id,
+                        MIN(first_seen), MAX(last_seen), Count(*) FROM recognition_events
+                        WHERE stu_id IS NOT NULL AND first_seen >= ? AND first_seen < ?
+                        GROUP BY day, stu_id''', (startTime, endTime))
+        return conn.execute('SELECT changes()').fetchone()[0]
+
+
+# 按日期范围（含首尾）查询考勤记录，按 (日期, 学号) 顺序分页
+# after为上一页最后一行的 (day, stu_id)，基于主键定位，翻页开销与页码无关
+def queryAttendance(faceBase, start, end, stu_id=None, after=None, limit=200):
+    sql = '''SELECT a.day, a.stu_id, u.cn_name, a.first_seen, a.last_seen, a.count
+             FROM attendance_daily a LEFT JOIN users u ON u.stu_id = a.stu_id
+             WHERE a.day >= ? AND a.day <= ?'''
+    params = [start, end]
+    if stu_id:
+        sql += ' AND a.stu_id = ?'
+        params.append(stu_id)
+    if after:
+        sql += ' AND (a.day > ? OR (a.day = ? AND a.stu_id > ?))'
+        params.extend((after[0], after[0], after[1]))
+    sql += ' ORDER BY a.day, a.stu_id LIMIT ?'
+    params.append(limit)
+    return faceBase.query(sql, params)
+
+
+# 日期范围内的记录数
+def countAttendance(faceBase, start, end, stu_id=None):
+    if stu_id:
+        return faceBase.queryOne('SELECT Count(*) FROM attendance_daily WHERE stu_id = ? AND day >= ? AND day <= ?',
+                                 (stu_id, start, end))[0]
+    return faceBase.queryOne('SELECT Count(*) FROM attendance_daily WHERE day >= ? AND day <= ?', (start, end))[0]
+
+
+# 每天出勤人数
+def dailySummary(faceBase, start, end):
+    return faceBase.query('''SELECT day, Count(*) FROM attendance_daily WHERE day >= ? AND day <= ?
+                             GROUP BY day ORDER BY day''', (start, end))
+
+
+def formatTime(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')
+
+
+# 导出考勤记录为CSV，逐页读取，返回导出的行数
+def exportCsv(faceBase, path, start, end, stu_id=None):
+    count = 0
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(('日期', '学号', '姓名', '首次出现', '最后出现', '识别次数'))
+        after = None
+        while True:
+            rows = queryAttendance(faceBase, start, end, stu_id, after, limit=5000)
+            if not rows:
+                break
+            writer.writerows((day, stu_id, cn_name or '', formatTime(first_seen), formatTime(last_seen), times)
+                             for day, stu_id, cn_name, first_seen, last_seen, times in rows)
+            count += len(rows)
+            after = rows[-1][:2]
+    return count
+
+
+if __name__ == '__main__':
+    today = time.strftime(DAY_FORMAT)
+    parser = argparse.ArgumentParser(description='考勤汇总查询与导出')
+    parser.add_argument('--database', default='./FaceBase.db')
+    subparsers = parser.add_subparsers(dest='command')
+
+    exportParser = subparsers.add_parser('export', help='导出考勤记录为CSV')
+    exportParser.add_argument('output')
+    exportParser.add_argument('--start', default=today, help='起始日期 YYYY-MM-DD，默认为今天')
+    exportParser.add_argument('--end', default=today, help='结束日期 YYYY-MM-DD，默认为今天')
+    exportParser.add_argument('--stu-id', default=None)
+
+    summaryParser = subparsers.add_parser('summary', help='每天出勤人数')
+    summaryParser.add_argument('--start', default=today)
+    summaryParser.add_argument('--end', default=today)
+
+    rebuildParser = subparsers.add_parser('rebuild', help='由识别事件重建考勤汇总')
+    rebuildParser.add_argument('--start', default=None, help='起始日期 YYYY-MM-DD，默认为最早的识别事件的次日')
+    rebuildParser.add_argument('--end', default=None)
+
+    args = parser.parse_args()
+    logging.config.fileConfig('./config/logging.cfg')
+    faceBase = getFaceBase(args.database)
+
+    if args.command == 'export':
+        count = exportCsv(faceBase, args.output, args.start, args.end, args.stu_id)
+        print('已导出{}条考勤记录到{}'.format(count, args.output))
+    elif args.command == 'summary':
+        for day, count in dailySummary(faceBase, args.start, args.end):
+            print('{}：{}人'.format(day, count))
+    elif args.command == 'rebuild':
+        print('已重建{}条考勤汇总'.format(rebuild(faceBase, args.start, args.end)))
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+from PyQt5.QtCore import QDate
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QDialog, QFileDialog
+from PyQt5.uic import loadUi
+
+import logging
+
+from attendance import dailySummary, exportCsv
+from attendanceTableModel import AttendanceTableModel
+
+
+# 考勤报表对话框
+class AttendanceDialog(QDialog):
+    def __init__(self, faceBase):
+        super(AttendanceDialog, self).__init__()
+        loadUi('./ui/AttendanceDialog.ui', self)
+        self.setWindowIcon(QIcon('./icons/icon.png'))
+        self.setFixedSize(721, 521)
+
+        self.faceBase = faceBase
+        self.startDateEdit.setDate(QDate.currentDate())
+        self.endDateEdit.setDate(QDate.currentDate())
+        self.attendanceTableModel = AttendanceTableModel(faceBase, self)
+        self.attendanceTableView.setModel(self.attendanceTableModel)
+
+        self.queryButton.clicked.connect(self.queryAttendance)
+        self.exportButton.clicked.connect(self.exportAttendance)
+
+    # 查询条件：起止日期、学号
+    def getQuery(self):
+        return (self.startDateEdit.date().toString('yyyy-MM-dd'), self.endDateEdit.date().toString('yyyy-MM-dd'),
+                self.stuIDLineEdit.text().strip() or None)
+
+    def queryAttendance(self):
+        start, end, stu_id = self.getQuery()
+        try:
+            self.attendanceTableModel.setQuery(start, end, stu_id)
+            days = dailySummary(self.faceBase, start, end) if not stu_id else []
+        except Exception as e:
+            logging.error('查询考勤记录失败：{}'.format(e))
+            self.summaryLabel.setText('<font color=red>Error：读取数据库异常，查询失败</font>')
+            return
+        summary = '共{}条记录'.format(self.attendanceTableModel.totalCount)
+        if days:
+            summary += '，日均出勤{:.1f}人'.format(sum(count for day, count in days) / len(days))
+        self.summaryLabel.setText(summary)
+        self.exportButton.setEnabled(self.attendanceTableModel.totalCount > 0)
+
+    def exportAttendance(self):
+        start, end, stu_id = self.getQuery()
+        path, _ = QFileDialog.getSaveFileName(self, '导出考勤记录', './attendance_{}_{}.csv'.format(start, end),
+                                              'CSV (*.csv)')
+        if not path:
+            return
+        try:
+            count = exportCsv(self.faceBase, path, start, end, stu_id)
+        except Exception as e:
+            logging.error('导出考勤记录失败：{}'.format(e))
+            self.summaryLabel.setText('<font color=red>Error：导出失败</font>')
+        else:
+            self.summaryLabel.setText('已导出{}条记录到{}'.format(count, path))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from attendance import countAttendance, formatTime, queryAttendance
+
+# 每次从数据库读取的行数
+PAGE_SIZE = 200
+
+
+# 考勤记录的数据模型：按 (日期, 学号) 主键顺序分页读取汇总表
+class AttendanceTableModel(QAbstractTableModel):
+    HEADERS = ('日期', '学号', '姓名', '首次出现', '最后出现', '识别次数')
+
+    def __init__(self, faceBase, parent=None):
+        super(AttendanceTableModel, self).__init__(parent)
+        self.faceBase = faceBase
+        self.rows = []
+        self.totalCount = 0
+        self.query = None
+
+    # 查询日期范围内的考勤记录
+    def setQuery(self, start, end, stu_id=None):
+        self.beginResetModel()
+        self.query = (start, end, stu_id or None)
+        self.rows = []
+        self.totalCount = countAttendance(self.faceBase, *self.query)
+        self.endResetModel()
+        if self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(AttendanceTableModel.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            value = self.rows[index.row()][index.column()]
+            if index.column() in (3, 4):
+                return formatTime(value)
+            return str(value) if value is not None else ''
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return AttendanceTableModel.HEADERS[section]
+        return super(AttendanceTableModel, self).headerData(section, orientation, role)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and len(self.rows) < self.totalCount
+
+    # 以上一页最后一行的主键定位下一页
+    def fetchMore(self, parent):
+        if parent.isValid() or self.query is None:
+            return
+        after = self.rows[-1][:2] if self.rows else None
+        page = queryAttendance(self.faceBase, *self.query, after=after, limit=PAGE_SIZE)
+        if not page:
+            self.totalCount = len(self.rows)
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
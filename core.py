@@ -4,9 +4,10 @@
 import telegram
 import cv2
 import dlib
+import numpy as np
 
 from PyQt5.QtCore import QTimer, QThread, pyqtSignal, QRegExp, Qt
-from PyQt5.QtGui import QImage, QPixmap, QIcon, QTextCursor, QRegExpValidator
+from PyQt5.QtGui import QIcon, QTextCursor, QRegExpValidator
 from PyQt5.QtWidgets import QDialog, QApplication, QMainWindow, QMessageBox
 from PyQt5.uic import loadUi
 
@@ -14,16 +15,28 @@ import os
 import webbrowser
 import logging
 import logging.config
-import sqlite3
 import sys
 import threading
 import queue
 import multiprocessing
+import time
 import winsound
 
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from datetime import datetime
 
+from faceBase import getFaceBase
+from faceDetector import loadDetector
+from frameDisplay import DISPLAY_FPS, FrameRenderer, LatestFrameSlot, renderInterval
+from framePool import readFrame
+from metrics import currentRss, formatBytes
+from motionGate import MotionGate
+from qosController import QosController
+from modelStore import loadRecognizer, resolveModelPath
+from recognitionEvents import RecognitionEventWriter, RecognitionTracker
+from unknownArchive import UnknownArchive
+
 
 # 找不到已训练的人脸数据文件
 class TrainingDataNotFoundError(FileNotFoundError):
@@ -36,11 +49,15 @@ class DatabaseNotFoundError(FileNotFoundError):
 
 
 class CoreUI(QMainWindow):
+    config = './config/core.cfg'
     database = './FaceBase.db'
-    trainingData = './recognizer/trainingData.yml'
+    trainingData = './recognizer/trainingData.lbph'  # 内存映射的二进制模型
+    trainingDataYaml = './recognizer/trainingData.yml'  # 兼容旧版YAML模型
+    trainingDataCheckInterval = 2  # 检查是否生成了新版本模型的间隔（秒）
     cap = cv2.VideoCapture()
-    captureQueue = queue.Queue()  # 图像队列
+    frameSlot = LatestFrameSlot()  # 最新一帧已标注的画面
     alarmQueue = queue.LifoQueue()  # 报警队列，后进先出
+    unknownArchive = None  # 陌生人脸存档，报警线程与识别事件写入线程共享同一实例
     logQueue = multiprocessing.Queue()  # 日志队列
     receiveLogSignal = pyqtSignal(str)  # LOG信号
 
@@ -61,6 +78,14 @@ class CoreUI(QMainWindow):
         self.initDbButton.setIcon(QIcon('./icons/warning.png'))
         self.initDbButton.clicked.connect(self.initDb)
 
+        # 画面显示：定时器按显示帧率（不超过屏幕刷新率）取出最新一帧
+        cfg = ConfigParser()
+        cfg.read(self.config, encoding='utf-8-sig')
+        self.displayFps = cfg.getint('display', 'fps', fallback=DISPLAY_FPS)
+        self.cameraWidth = cfg.getint('camera', 'width', fallback=640)
+        self.cameraHeight = cfg.getint('camera', 'height', fallback=480)
+        self.frameRenderer = FrameRenderer(self.realTimeCaptureLabel)
+        self.lastFrameSequence = 0
         self.timer = QTimer(self)  # 初始化一个定时器
         self.timer.timeout.connect(self.updateFrame)
 
@@ -77,6 +102,11 @@ class CoreUI(QMainWindow):
 
         # 调试模式
         self.debugCheckBox.stateChanged.connect(lambda: self.faceProcessingThread.enableDebug(self))
+        # 滑块初始值与配置文件一致
+        for slider, value in ((self.confidenceThresholdSlider, self.faceProcessingThread.confidenceThreshold),
+                              (self.autoAlarmThresholdSlider, self.faceProcessingThread.autoAlarmThreshold)):
+            slider.setRange(min(slider.minimum(), value), max(slider.maximum(), value))
+            slider.setValue(value)
         self.confidenceThresholdSlider.valueChanged.connect(
             lambda: self.faceProcessingThread.setConfidenceThreshold(self))
         self.autoAlarmThresholdSlider.valueChanged.connect(
@@ -84,6 +114,10 @@ class CoreUI(QMainWindow):
 
         # 报警系统
         self.alarmSignalThreshold = 10
+        try:
+            CoreUI.unknownArchive = UnknownArchive('./unknown')
+        except Exception as e:
+            logging.error('打开陌生人脸存档失败：{}'.format(e))
         self.panalarmThread = threading.Thread(target=self.recieveAlarm, daemon=True)
         self.isBellEnabled = True
         self.bellCheckBox.stateChanged.connect(lambda: self.enableBell(self.bellCheckBox))
@@ -107,14 +141,10 @@ class CoreUI(QMainWindow):
         try:
             if not os.path.isfile(self.database):
                 raise DatabaseNotFoundError
-            if not os.path.isfile(self.trainingData):
+            if not CoreUI.getTrainingDataPath():
                 raise TrainingDataNotFoundError
 
-            conn = sqlite3.connect(self.database)
-            cursor = conn.cursor()
-            cursor.execute('SELECT Count(*) FROM users')
-            result = cursor.fetchone()
-            dbUserCount = result[0]
+            dbUserCount = getFaceBase(self.database).countUsers()
         except DatabaseNotFoundError:
             logging.error('系统找不到数据库文件{}'.format(self.database))
             self.initDbButton.setIcon(QIcon('./icons/error.png'))
@@ -128,8 +158,6 @@ class CoreUI(QMainWindow):
             self.initDbButton.setIcon(QIcon('./icons/error.png'))
             self.logQueue.put('Error：读取数据库异常，初始化数据库失败')
         else:
-            cursor.close()
-            conn.close()
             if not dbUserCount > 0:
                 logging.warning('数据库为空')
                 self.logQueue.put('warning：数据库为空，人脸识别功能不可用')
@@ -141,6 +169,14 @@ class CoreUI(QMainWindow):
                 self.faceRecognizerCheckBox.setToolTip('须先开启人脸跟踪')
                 self.faceRecognizerCheckBox.setEnabled(True)
 
+    # 已训练的人脸数据文件，优先使用二进制模型的最新版本
+    @staticmethod
+    def getTrainingDataPath():
+        path = resolveModelPath(CoreUI.trainingData)
+        if path:
+            return path
+        return CoreUI.trainingDataYaml if os.path.isfile(CoreUI.trainingDataYaml) else None
+
     # 是否使用外接摄像头
     def useExternalCamera(self, useExternalCameraCheckBox):
         if useExternalCameraCheckBox.isChecked():
@@ -156,8 +192,8 @@ class CoreUI(QMainWindow):
             else:
                 camID = 0
             self.cap.open(camID)
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.cameraWidth)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.cameraHeight)
             ret, frame = self.cap.read()
             if not ret:
                 logging.error('无法调用电脑摄像头{}'.format(camID))
@@ -165,8 +201,9 @@ class CoreUI(QMainWindow):
                 self.cap.release()
                 self.startWebcamButton.setIcon(QIcon('./icons/error.png'))
             else:
+                self.faceProcessingThread.camera = 'camera{}'.format(camID)
                 self.faceProcessingThread.start()  # 启动OpenCV图像处理线程
-                self.timer.start(5)  # 启动定时器
+                self.timer.start(renderInterval(self.displayFps))  # 启动定时器
                 self.panalarmThread.start()  # 启动报警系统线程
                 self.startWebcamButton.setIcon(QIcon('./icons/success.png'))
                 self.startWebcamButton.setText('关闭摄像头')
@@ -183,6 +220,7 @@ class CoreUI(QMainWindow):
                     if self.timer.isActive():
                         self.timer.stop()
                     self.cap.release()
+                self.frameSlot.clear()
 
                 self.realTimeCaptureLabel.clear()
                 self.realTimeCaptureLabel.setText('<font color=red>摄像头未开启</font>')
@@ -190,43 +228,15 @@ class CoreUI(QMainWindow):
                 self.startWebcamButton.setEnabled(False)
                 self.startWebcamButton.setIcon(QIcon())
 
-    # 定时器，实时更新画面
+    # 定时器，显示最新一帧，没有新帧时不做任何处理
     def updateFrame(self):
         if self.cap.isOpened():
-            # ret, frame = self.cap.read()
-            # if ret:
-            #     self.showImg(frame, self.realTimeCaptureLabel)
-            if not self.captureQueue.empty():
-                captureData = self.captureQueue.get()
-                realTimeFrame = captureData.get('realTimeFrame')
-                self.displayImage(realTimeFrame, self.realTimeCaptureLabel)
-
-    # 显示图片
-    def displayImage(self, img, qlabel):
-        # BGR -> RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        # default：The image is stored using 8-bit indexes into a colormap， for example：a gray image
-        qformat = QImage.Format_Indexed8
-
-        if len(img.shape) == 3:  # rows[0], cols[1], channels[2]
-            if img.shape[2] == 4:
-                # The image is stored using a 32-bit byte-ordered RGBA format (8-8-8-8)
-                # A: alpha channel，不透明度参数。如果一个像素的alpha通道数值为0%，那它就是完全透明的
-                qformat = QImage.Format_RGBA8888
-            else:
-                qformat = QImage.Format_RGB888
-
-        # img.shape[1]：图像宽度width，img.shape[0]：图像高度height，img.shape[2]：图像通道数
-        # QImage.__init__ (self, bytes data, int width, int height, int bytesPerLine, Format format)
-        # 从内存缓冲流获取img数据构造QImage类
-        # img.strides[0]：每行的字节数（width*3）,rgb为3，rgba为4
-        # strides[0]为最外层(即一个二维数组所占的字节长度)，strides[1]为次外层（即一维数组所占字节长度），strides[2]为最内层（即一个元素所占字节长度）
-        # 从里往外看，strides[2]为1个字节长度（uint8），strides[1]为3*1个字节长度（3即rgb 3个通道）
-        # strides[0]为width*3个字节长度，width代表一行有几个像素
-
-        outImage = QImage(img, img.shape[1], img.shape[0], img.strides[0], qformat)
-        qlabel.setPixmap(QPixmap.fromImage(outImage))
-        qlabel.setScaledContents(True)  # 图片自适应大小
+            self.lastFrameSequence, frameBuffer = self.frameSlot.get(self.lastFrameSequence)
+            if frameBuffer is not None:
+                try:
+                    self.frameRenderer.render(frameBuffer.array)
+                finally:
+                    frameBuffer.release()
 
     # 报警系统：是否允许设备响铃
     def enableBell(self, bellCheckBox):
@@ -311,7 +321,7 @@ class CoreUI(QMainWindow):
 
             bot.send_message(chat_id=chat_id, text=message)
 
-            # 发送疑似陌生人脸截屏到Telegram
+            # 发送疑似陌生人脸人脸图像到Telegram
             if img:
                 bot.send_photo(chat_id=chat_id, photo=open(img, 'rb'), timeout=10)
         except Exception as e:
@@ -325,13 +335,17 @@ class CoreUI(QMainWindow):
             jobs = []
             # print(self.alarmQueue.qsize())
             if self.alarmQueue.qsize() > self.alarmSignalThreshold:  # 若报警信号触发超出既定计数，进行报警
-                if not os.path.isdir('./unknown'):
-                    os.makedirs('./unknown')
                 lastAlarmSignal = self.alarmQueue.get()
-                timestamp = lastAlarmSignal.get('timestamp')
-                img = lastAlarmSignal.get('img')
-                # 疑似陌生人脸，截屏存档
-                cv2.imwrite('./unknown/{}.jpg'.format(timestamp), img)
+                # 疑似陌生人脸，裁剪存档，同一陌生人的多次出现归为一组；该轨迹结束时识别事件沿用同一张人脸
+                facePath = None
+                if self.unknownArchive is not None:
+                    try:
+                        cluster_id, facePath = self.unknownArchive.add(lastAlarmSignal.get('face'),
+                                                                       key=lastAlarmSignal.get('track'))
+                    except Exception as e:
+                        logging.error('陌生人脸存档失败：{}'.format(e))
+                    else:
+                        logging.info('陌生人脸已存档，分组{}'.format(cluster_id))
                 logging.info('报警信号触发超出预设计数，自动报警系统已被激活')
                 self.logQueue.put('Info：报警信号触发超出预设计数，自动报警系统已被激活')
 
@@ -343,10 +357,7 @@ class CoreUI(QMainWindow):
 
                 # 是否进行TelegramBot推送
                 if self.isTelegramBotPushEnabled:
-                    if os.path.isfile('./unknown/{}.jpg'.format(timestamp)):
-                        img = './unknown/{}.jpg'.format(timestamp)
-                    else:
-                        img = None
+                    img = facePath if facePath and os.path.isfile(facePath) else None
                     p2 = multiprocessing.Process(target=CoreUI.telegramBotPushProcess, args=(self.logQueue, img))
                     p2.start()
                     jobs.append(p2)
@@ -481,11 +492,37 @@ class FaceProcessingThread(QThread):
         self.isPanalarmEnabled = True
 
         self.isDebugMode = False
-        self.confidenceThreshold = 50
-        self.autoAlarmThreshold = 65
 
         self.isEqualizeHistEnabled = False
 
+        # 识别事件：图像处理线程只在内存中聚合，由后台线程写入数据库
+        self.camera = 'camera0'
+        self.recognitionTracker = None
+        self.eventWriter = None
+
+        # 帧缓冲池，按摄像头实际分辨率创建
+        self.framePool = None
+
+        cfg = ConfigParser()
+        cfg.read(CoreUI.config, encoding='utf-8-sig')
+
+        # 置信度阈值、自动报警阈值的初始值，可由 paramTuner.py 调优后写入，调试模式下可通过滑块调整
+        self.confidenceThreshold = cfg.getint('recognition', 'confidence_threshold', fallback=50)
+        self.autoAlarmThreshold = cfg.getint('recognition', 'auto_alarm_threshold', fallback=65)
+
+        # 人脸检测器，后端及分块并行检测在 config/detector.cfg 中设置
+        self.faceDetector = loadDetector()
+
+        # 人脸跟踪器更新、人脸识别按人脸并行执行（dlib、OpenCV在本地代码中释放GIL），默认线程数为CPU核数
+        self.workerPool = ThreadPoolExecutor(
+            max_workers=cfg.getint('processing', 'workers', fallback=0) or os.cpu_count() or 1)
+
+        # 运动门控：画面静止时跳过检测与识别，长时间静止后降低帧率
+        self.motionGate = MotionGate.fromConfig(cfg) if cfg.getboolean('motion', 'enabled', fallback=True) else None
+
+        # 自适应服务质量控制：处理延迟超出目标时降低检测频率、检测分辨率、重新识别频率等
+        self.qos = QosController.fromConfig(cfg) if cfg.getboolean('qos', 'enabled', fallback=True) else None
+
     # 是否开启人脸跟踪
     def enableFaceTracker(self, coreUI):
         if coreUI.faceTrackerCheckBox.isChecked():
@@ -549,7 +586,6 @@ class FaceProcessingThread(QThread):
             coreUI.statusBar().showMessage('直方图均衡化：关闭')
 
     def run(self):
-        faceCascade = cv2.CascadeClassifier('./haarcascades/haarcascade_frontalface_default.xml')
 
         # 帧数、人脸ID初始化
         frameCounter = 0
@@ -558,56 +594,115 @@ class FaceProcessingThread(QThread):
         # 人脸跟踪器字典初始化
         faceTrackers = {}
 
-        isTrainingDataLoaded = False
+        trainingDataPath = None  # 已加载的模型文件
+        lastTrainingDataCheck = 0
         isDbConnected = False
+        self.recognitionTracker = RecognitionTracker(self.camera)
+
+        # 灰度图只在本帧内使用，预分配后逐帧复用
+        grayBuffer = equalizedBuffer = None
+        lastFrameTime = 0
+        detectionCounter = 0
+        processedFrames = 0  # 已处理的帧数，调试模式下按此间隔输出指标
+        previousFaces = ()  # 不执行检测的帧沿用上一次检测到的人脸
 
         while self.isRunning:
             if CoreUI.cap.isOpened():
-                ret, frame = CoreUI.cap.read()
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                # 空闲模式：按空闲帧率处理，其间的帧只抓取不解码，保证恢复时读到的是最新画面
+                if self.motionGate is not None and self.motionGate.isIdle():
+                    while self.isRunning and time.time() - lastFrameTime < 1 / self.motionGate.idleFps:
+                        CoreUI.cap.grab()
+                lastFrameTime = time.time()
+
+                # 降级时丢弃部分帧，避免处理过慢时摄像头缓冲区中积压旧画面
+                if self.qos is not None:
+                    for _ in range(self.qos.frameSkip):
+                        CoreUI.cap.grab()
+
+                # 读取到帧缓冲池的缓冲区中，不再逐帧分配图像数组
+                self.framePool, frameBuffer = readFrame(CoreUI.cap, self.framePool)
+                if frameBuffer is None:
+                    continue
+                frameStart = time.perf_counter()
+                processedFrames += 1
+                frame = frameBuffer.array
+                if grayBuffer is None or grayBuffer.shape != frame.shape[:2]:
+                    grayBuffer = np.empty(frame.shape[:2], np.uint8)
+                    equalizedBuffer = np.empty_like(grayBuffer)
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=grayBuffer)
                 # 是否执行直方图均衡化
                 if self.isEqualizeHistEnabled:
-                    gray = cv2.equalizeHist(gray)
-                faces = faceCascade.detectMultiScale(gray, 1.3, 5, minSize=(90, 90))
-
-                # 预加载数据文件
-                if not isTrainingDataLoaded and os.path.isfile(CoreUI.trainingData):
-                    recognizer = cv2.face.LBPHFaceRecognizer_create()
-                    recognizer.read(CoreUI.trainingData)
-                    isTrainingDataLoaded = True
+                    gray = cv2.equalizeHist(gray, dst=equalizedBuffer)
+
+                # 画面静止且没有正在跟踪的人脸时，跳过本帧的检测与识别
+                isGated = (self.motionGate is not None and not self.motionGate.update(gray) and not faceTrackers and
+                           not self.recognitionTracker.tracks)
+                detectionStart = time.perf_counter()
+                if isGated:
+                    faces = previousFaces = ()
+                    self.motionGate.recordSkipped()
+                elif self.qos is None:
+                    faces = self.faceDetector.detect(gray)
+                else:
+                    if detectionCounter % self.qos.detectionInterval == 0:
+                        previousFaces = self.faceDetector.detect(gray, self.qos.detectionScale)
+                    detectionCounter += 1
+                    # 每帧最多处理maxTracks张人脸，优先处理面积大的
+                    faces = sorted(previousFaces, key=lambda face: face[2] * face[3], reverse=True)[:self.qos.maxTracks]
+
+                # 预加载数据文件；训练或删除用户生成新版本的模型后重新加载，释放对旧版本的内存映射
+                if time.time() - lastTrainingDataCheck > CoreUI.trainingDataCheckInterval:
+                    lastTrainingDataCheck = time.time()
+                    path = CoreUI.getTrainingDataPath()
+                    if path and path != trainingDataPath:
+                        try:
+                            recognizer = loadRecognizer(path)
+                        except Exception as e:
+                            logging.error('加载人脸数据{}失败：{}'.format(path, e))
+                        else:
+                            if trainingDataPath is not None:
+                                logging.info('已重新加载人脸数据{}'.format(path))
+                                CoreUI.logQueue.put('Info：已重新加载人脸数据{}'.format(path))
+                            trainingDataPath = path
                 if not isDbConnected and os.path.isfile(CoreUI.database):
-                    conn = sqlite3.connect(CoreUI.database)
-                    cursor = conn.cursor()
+                    faceBase = getFaceBase(CoreUI.database)
                     isDbConnected = True
+                    self.eventWriter = RecognitionEventWriter(faceBase, archive=CoreUI.unknownArchive)
+                    self.eventWriter.start()
 
-                captureData = {}
-                realTimeFrame = frame.copy()
-                alarmSignal = {}
+                # 标注用的画面同样取自帧缓冲池，交给显示环节后由其释放
+                annotatedBuffer = self.framePool.acquire()
+                realTimeFrame = annotatedBuffer.array
+                np.copyto(realTimeFrame, frame)
+                recognitions = []  # 本帧的识别结果 (rect, face_id, stu_id, confidence)
+                predictions = []  # 与recognitions对应的识别器预测结果 (face_id, confidence)
+                alarmFaces = []  # 触发报警信号的人脸在recognitions中的下标
 
                 # 人脸跟踪
                 # Reference：https://github.com/gdiepen/face-recognition
                 if self.isFaceTrackerEnabled:
 
-                    # 要删除的人脸跟踪器列表初始化
-                    fidsToDelete = []
+                    # 实时跟踪，各人脸跟踪器并行更新，结果按跟踪器顺序返回
+                    fids = list(faceTrackers.keys())
+                    trackingQualities = self.mapOrdered(lambda fid: faceTrackers[fid].update(realTimeFrame), fids)
 
-                    for fid in faceTrackers.keys():
-                        # 实时跟踪
-                        trackingQuality = faceTrackers[fid].update(realTimeFrame)
-                        # 如果跟踪质量过低，删除该人脸跟踪器
-                        if trackingQuality < 7:
-                            fidsToDelete.append(fid)
+                    # 如果跟踪质量过低，删除该人脸跟踪器
+                    fidsToDelete = [fid for fid, trackingQuality in zip(fids, trackingQualities) if trackingQuality < 7]
 
                     # 删除跟踪质量过低的人脸跟踪器
                     for fid in fidsToDelete:
                         faceTrackers.pop(fid, None)
 
-                    for (_x, _y, _w, _h) in faces:
+                    # 各人脸并行识别，结果按人脸顺序返回，标注、报警仍按人脸顺序依次处理
+                    if self.isFaceRecognizerEnabled:
+                        predictions = self.mapOrdered(lambda face: self.predictFace(recognizer, gray, face), faces)
+
+                    for index, (_x, _y, _w, _h) in enumerate(faces):
                         isKnown = False
 
                         if self.isFaceRecognizerEnabled:
                             cv2.rectangle(realTimeFrame, (_x, _y), (_x + _w, _y + _h), (232, 138, 30), 2)
-                            face_id, confidence = recognizer.predict(gray[_y:_y + _h, _x:_x + _w])
+                            face_id, confidence = predictions[index]
                             logging.debug('face_id：{}，confidence：{}'.format(face_id, confidence))
 
                             if self.isDebugMode:
@@ -615,15 +710,16 @@ class FaceProcessingThread(QThread):
 
                             # 从数据库中获取识别人脸的身份信息
                             try:
-                                cursor.execute("SELECT * FROM users WHERE face_id=?", (face_id,))
-                                result = cursor.fetchall()
+                                result = faceBase.getUserByFaceId(face_id)
                                 if result:
-                                    en_name = result[0][3]
+                                    stu_id = result[0]
+                                    en_name = result[3]
                                 else:
                                     raise Exception
                             except Exception as e:
                                 logging.error('读取数据库异常，系统无法获取Face ID为{}的身份信息'.format(face_id))
                                 CoreUI.logQueue.put('Error：读取数据库异常，系统无法获取Face ID为{}的身份信息'.format(face_id))
+                                stu_id = None
                                 en_name = ''
 
                             # 若置信度评分小于置信度阈值，认为是可靠识别
@@ -639,10 +735,12 @@ class FaceProcessingThread(QThread):
                                 if confidence > self.autoAlarmThreshold:
                                     # 检测报警系统是否开启
                                     if self.isPanalarmEnabled:
-                                        alarmSignal['timestamp'] = datetime.now().strftime('%Y%m%d%H%M%S')
-                                        alarmSignal['img'] = realTimeFrame
-                                        CoreUI.alarmQueue.put(alarmSignal)
-                                        logging.info('系统发出了报警信号')
+                                        alarmFaces.append(len(recognitions))
+
+                            if isKnown:
+                                recognitions.append(((_x, _y, _w, _h), face_id, stu_id, confidence))
+                            else:
+                                recognitions.append(((_x, _y, _w, _h), None, None, confidence))
 
                         # 帧数自增
                         frameCounter += 1
@@ -708,18 +806,81 @@ class FaceProcessingThread(QThread):
                         cv2.putText(realTimeFrame, 'tracking...', (15, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 0, 255),
                                     2)
 
-                captureData['originFrame'] = frame
-                captureData['realTimeFrame'] = realTimeFrame
-                CoreUI.captureQueue.put(captureData)
+                # 聚合识别轨迹并更新各轨迹的最佳人脸，已结束的轨迹交给写入线程
+                tracks = self.recognitionTracker.update(recognitions, frame=frame, gray=gray)
+                for track, prediction in zip(tracks, predictions):
+                    track.prediction = prediction
+                if self.eventWriter is not None:
+                    self.recognitionTracker.flush(self.eventWriter)
+                else:
+                    self.recognitionTracker.pending.clear()
+
+                if self.motionGate is not None and not isGated:
+                    self.motionGate.recordDetection(time.perf_counter() - detectionStart)
+
+                # 报警信号只携带人脸所属轨迹的最佳人脸，而非当前帧的标注画面
+                # 触发报警的轨迹结束时，其最佳人脸随识别事件存入陌生人脸存档
+                for index in alarmFaces:
+                    tracks[index].isAlarmed = True
+                    alarmSignal = {
+                        'timestamp': datetime.now().strftime('%Y%m%d%H%M%S'),
+                        'face': tracks[index].bestShots.best(),
+                        'track': (self.recognitionTracker.camera, tracks[index].track_id),
+                    }
+                    CoreUI.alarmQueue.put(alarmSignal)
+                    logging.info('系统发出了报警信号')
+
+                # 只放入最新一帧，未被显示的帧由下一帧覆盖后归还缓冲池
+                CoreUI.frameSlot.put(annotatedBuffer)
+                frameBuffer.release()
+
+                # 按本帧从读取到交给显示环节的延迟调整处理强度
+                if self.qos is not None:
+                    self.qos.record(time.perf_counter() - frameStart)
+                    adjustment = self.qos.adjust()
+                    if adjustment:
+                        logging.info(adjustment)
+                        CoreUI.logQueue.put('Info：' + adjustment)
+
+                # 调试模式下每300帧输出一次内存及运动门控指标
+                if self.isDebugMode and processedFrames % 300 == 0:
+                    CoreUI.logQueue.put('Debug -> 帧缓冲池复用率：{:.1%}，常驻内存：{}'.format(
+                        self.framePool.hitRate(), formatBytes(currentRss())))
+                    if self.motionGate is not None:
+                        CoreUI.logQueue.put('Debug -> ' + self.motionGate.summary())
 
             else:
                 continue
 
-    # 停止OpenCV线程
+    # 在线程池中对每个元素执行func，按元素顺序返回结果；只有一个元素时直接执行
+    def mapOrdered(self, func, items):
+        if len(items) <= 1:
+            return [func(item) for item in items]
+        return list(self.workerPool.map(func, items))
+
+    # 识别一张人脸，返回 (face_id, confidence)
+    # 降级时已跟踪的人脸每隔recheckInterval帧才重新识别，其余帧沿用上次的预测结果
+    def predictFace(self, recognizer, gray, face):
+        x, y, w, h = face
+        track = self.recognitionTracker.match(face)
+        if (self.qos is not None and track is not None and track.prediction is not None and
+                track.frames % self.qos.recheckInterval):
+            return track.prediction
+        return recognizer.predict(gray[y:y + h, x:x + w])
+
+    # 停止OpenCV线程，写入尚未结束的识别事件
     def stop(self):
         self.isRunning = False
         self.quit()
         self.wait()
+        self.workerPool.shutdown()
+        if self.eventWriter is not None:
+            self.recognitionTracker.closeAll()
+            for event in self.recognitionTracker.pending:
+                self.eventWriter.buffer.put(event)
+            self.recognitionTracker.pending.clear()
+            self.eventWriter.stop()
+            self.eventWriter = None
 
 
 if __name__ == '__main__':
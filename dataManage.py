@@ -1,25 +1,30 @@
 #!/usr/bin/env python3
 # Author: winterssy <winterssy@foxmail.com>
 
-import cv2
-import numpy as np
-
-from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QIcon, QTextCursor
-from PyQt5.QtWidgets import QApplication, QWidget, QMessageBox, QTableWidgetItem, QAbstractItemView
+from PyQt5.QtWidgets import QApplication, QWidget, QMessageBox
 from PyQt5.uic import loadUi
 
 import logging
 import logging.config
 import os
+import queue
 import shutil
-import sqlite3
 import sys
 import threading
 import multiprocessing
 
 from datetime import datetime
 
+from attendanceDialog import AttendanceDialog
+from datasetStore import packPath
+from faceBase import getFaceBase
+from featureCache import FeatureCache
+from modelStore import resolveModelPath, updateModelFile
+from trainer import featureParams, formatReport, runTrainingProcess
+from userTableModel import UserTableModel
+
 
 # 自定义数据库记录不存在异常
 class RecordNotFound(Exception):
@@ -29,6 +34,7 @@ class RecordNotFound(Exception):
 class DataManageUI(QWidget):
     logQueue = multiprocessing.Queue()  # 日志队列
     receiveLogSignal = pyqtSignal(str)  # 日志信号
+    trainingEventSignal = pyqtSignal(object)  # 训练事件信号
 
     def __init__(self):
         super(DataManageUI, self).__init__()
@@ -36,26 +42,41 @@ class DataManageUI(QWidget):
         self.setWindowIcon(QIcon('./icons/icon.png'))
         self.setFixedSize(931, 577)
 
-        # 设置tableWidget只读，不允许修改
-        self.tableWidget.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # 用户表，按需分页读取数据库
+        self.userTableModel = UserTableModel(self)
+        self.userTableView.setModel(self.userTableModel)
+        self.userTableView.sortByColumn(0, Qt.AscendingOrder)
+        self.userTableView.clicked.connect(lambda index: self.showUser(self.userTableModel.user(index.row())))
 
         # 数据库
         self.database = './FaceBase.db'
         self.datasets = './datasets'
+        self.trainingData = './recognizer/trainingData.lbph'
+        self.featureCache = './recognizer/featureCache.db'
         self.isDbReady = False
         self.initDbButton.clicked.connect(self.initDb)
 
         # 用户管理
         self.queryUserButton.clicked.connect(self.queryUser)
+        self.queryUserLineEdit.returnPressed.connect(self.queryUser)
         self.deleteUserButton.clicked.connect(self.deleteUser)
 
+        # 考勤报表
+        self.attendanceButton.clicked.connect(self.showAttendance)
+
         # 直方图均衡化
         self.isEqualizeHistEnabled = False
         self.equalizeHistCheckBox.stateChanged.connect(
             lambda: self.enableEqualizeHist(self.equalizeHistCheckBox))
 
         # 训练人脸数据
+        self.isFullRetrainEnabled = False
+        self.fullRetrainCheckBox.stateChanged.connect(
+            lambda: self.enableFullRetrain(self.fullRetrainCheckBox))
         self.trainButton.clicked.connect(self.train)
+        self.trainingProcess = None
+        self.trainingCancelEvent = None
+        self.trainingEventSignal.connect(self.onTrainingEvent)
 
         # 系统日志
         self.receiveLogSignal.connect(lambda log: self.logOutput(log))
@@ -69,26 +90,25 @@ class DataManageUI(QWidget):
         else:
             self.isEqualizeHistEnabled = False
 
+    # 是否完全重新训练，否则仅增量更新有变动的用户
+    def enableFullRetrain(self, fullRetrainCheckBox):
+        if fullRetrainCheckBox.isChecked():
+            self.isFullRetrainEnabled = True
+        else:
+            self.isFullRetrainEnabled = False
+
     # 初始化/刷新数据库
     def initDb(self):
-        # 刷新前重置tableWidget
-        while self.tableWidget.rowCount() > 0:
-            self.tableWidget.removeRow(0)
         try:
             if not os.path.isfile(self.database):
                 raise FileNotFoundError
 
-            conn = sqlite3.connect(self.database)
-            cursor = conn.cursor()
-
-            res = cursor.execute('SELECT * FROM users')
-            for row_index, row_data in enumerate(res):
-                self.tableWidget.insertRow(row_index)
-                for col_index, col_data in enumerate(row_data):
-                    self.tableWidget.setItem(row_index, col_index, QTableWidgetItem(str(col_data)))
-            cursor.execute('SELECT Count(*) FROM users')
-            result = cursor.fetchone()
-            dbUserCount = result[0]
+            faceBase = getFaceBase(self.database)
+            if self.userTableModel.faceBase is faceBase:
+                self.userTableModel.refresh()
+            else:
+                self.userTableModel.setFaceBase(faceBase)
+            dbUserCount = faceBase.countUsers()
         except FileNotFoundError:
             logging.error('系统找不到数据库文件{}'.format(self.database))
             self.isDbReady = False
@@ -100,9 +120,6 @@ class DataManageUI(QWidget):
             self.initDbButton.setIcon(QIcon('./icons/error.png'))
             self.logQueue.put('Error：读取数据库异常，初始化/刷新数据库失败')
         else:
-            cursor.close()
-            conn.close()
-
             self.dbUserCountLcdNum.display(dbUserCount)
             if not self.isDbReady:
                 self.isDbReady = True
@@ -113,40 +130,45 @@ class DataManageUI(QWidget):
                 self.trainButton.setEnabled(True)
                 self.queryUserButton.setToolTip('')
                 self.queryUserButton.setEnabled(True)
+                self.attendanceButton.setToolTip('')
+                self.attendanceButton.setEnabled(True)
             else:
                 self.logQueue.put('Success：刷新数据库成功，发现用户数：{}'.format(dbUserCount))
 
-    # 查询用户
+    # 查询用户：按学号、姓名或汉语拼音前缀过滤用户表，学号完全匹配（直接按学号查询数据库）或仅有一个匹配用户时直接选中
     def queryUser(self):
-        stu_id = self.queryUserLineEdit.text().strip()
-        conn = sqlite3.connect(self.database)
-        cursor = conn.cursor()
+        keyword = self.queryUserLineEdit.text().strip()
 
         try:
-            cursor.execute('SELECT * FROM users WHERE stu_id=?', (stu_id,))
-            ret = cursor.fetchall()
-            if not ret:
+            self.userTableModel.setFilter(keyword)
+            if not self.userTableModel.totalCount:
                 raise RecordNotFound
-            face_id = ret[0][1]
-            cn_name = ret[0][2]
+            rows = self.userTableModel.rows
+            ret = self.userTableModel.faceBase.getUser(keyword) or (rows[0] if len(rows) == 1 else None)
         except RecordNotFound:
             self.queryUserButton.setIcon(QIcon('./icons/error.png'))
             self.queryResultLabel.setText('<font color=red>Error：此用户不存在</font>')
         except Exception as e:
-            logging.error('读取数据库异常，无法查询到{}的用户信息'.format(stu_id))
+            logging.error('读取数据库异常，无法查询到{}的用户信息'.format(keyword))
             self.queryResultLabel.clear()
             self.queryUserButton.setIcon(QIcon('./icons/error.png'))
             self.logQueue.put('Error：读取数据库异常，查询失败')
         else:
-            self.queryResultLabel.clear()
-            self.queryUserButton.setIcon(QIcon('./icons/success.png'))
-            self.stuIDLineEdit.setText(stu_id)
-            self.cnNameLineEdit.setText(cn_name)
-            self.faceIDLineEdit.setText(str(face_id))
-            self.deleteUserButton.setEnabled(True)
-        finally:
-            cursor.close()
-            conn.close()
+            if ret:
+                self.showUser(ret)
+            else:
+                self.queryUserButton.setIcon(QIcon())
+                self.queryResultLabel.setText('找到{}个匹配用户，请在列表中选择'.format(self.userTableModel.totalCount))
+
+    # 在查询结果中显示用户信息
+    def showUser(self, user):
+        stu_id, face_id, cn_name = user[0], user[1], user[2]
+        self.queryResultLabel.clear()
+        self.queryUserButton.setIcon(QIcon('./icons/success.png'))
+        self.stuIDLineEdit.setText(stu_id)
+        self.cnNameLineEdit.setText(cn_name)
+        self.faceIDLineEdit.setText(str(face_id))
+        self.deleteUserButton.setEnabled(True)
 
     # 删除用户
     def deleteUser(self):
@@ -156,29 +178,53 @@ class DataManageUI(QWidget):
                                       QMessageBox.No)
 
         if ret == QMessageBox.Yes:
+            if self.isTraining():
+                self.logQueue.put('Error：正在训练人脸数据，请等待训练结束后再删除用户')
+                return
             stu_id = self.stuIDLineEdit.text()
-            conn = sqlite3.connect(self.database)
-            cursor = conn.cursor()
+            face_id = self.faceIDLineEdit.text()
 
             try:
-                cursor.execute('DELETE FROM users WHERE stu_id=?', (stu_id,))
+                getFaceBase(self.database).deleteUser(stu_id)
             except Exception as e:
-                cursor.close()
                 logging.error('无法从数据库中删除{}'.format(stu_id))
                 self.deleteUserButton.setIcon(QIcon('./icons/error.png'))
                 self.logQueue.put('Error：读写数据库异常，删除失败')
             else:
-                cursor.close()
-                conn.commit()
                 if os.path.exists('{}/stu_{}'.format(self.datasets, stu_id)):
                     try:
                         shutil.rmtree('{}/stu_{}'.format(self.datasets, stu_id))
                     except Exception as e:
                         logging.error('系统无法删除删除{}/stu_{}'.format(self.datasets, stu_id))
                         self.logQueue.put('Error：删除人脸数据失败，请手动删除{}/stu_{}目录'.format(self.datasets, stu_id))
+                if os.path.exists(packPath(self.datasets, stu_id)):
+                    try:
+                        os.remove(packPath(self.datasets, stu_id))
+                    except Exception as e:
+                        logging.error('系统无法删除{}'.format(packPath(self.datasets, stu_id)))
+                        self.logQueue.put('Error：删除人脸数据失败，请手动删除{}'.format(packPath(self.datasets, stu_id)))
+
+                # 清除该用户的人脸特征缓存
+                if os.path.isfile(self.featureCache):
+                    try:
+                        cache = FeatureCache(self.featureCache, featureParams(self.isEqualizeHistEnabled))
+                        cache.evictDataset('{}/stu_{}'.format(self.datasets, stu_id))
+                        cache.evictDataset(packPath(self.datasets, stu_id))
+                        cache.close()
+                    except Exception as e:
+                        logging.error('无法清除{}/stu_{}的人脸特征缓存'.format(self.datasets, stu_id))
+
+                # 从已训练的模型中剔除该用户的人脸数据，无需重新训练
+                informativeText = '<b>已同步更新已训练的人脸数据。</b>'
+                if resolveModelPath(self.trainingData) and face_id.isdigit() and int(face_id) > 0:
+                    try:
+                        updateModelFile(self.trainingData, removeLabels=[int(face_id)])
+                    except Exception as e:
+                        logging.error('无法从{}中删除Face ID为{}的人脸数据'.format(self.trainingData, face_id))
+                        self.logQueue.put('Error：更新已训练的人脸数据失败，请重新训练')
+                        informativeText = '<b>请在右侧菜单重新训练人脸数据。</b>'
 
                 text = '你已成功删除学号为 <font color=blue>{}</font> 的用户记录。'.format(stu_id)
-                informativeText = '<b>请在右侧菜单重新训练人脸数据。</b>'
                 DataManageUI.callDialog(QMessageBox.Information, text, informativeText, QMessageBox.Ok)
 
                 self.stuIDLineEdit.clear()
@@ -188,100 +234,117 @@ class DataManageUI(QWidget):
                 self.deleteUserButton.setIcon(QIcon('./icons/success.png'))
                 self.deleteUserButton.setEnabled(False)
                 self.queryUserButton.setIcon(QIcon())
-            finally:
-                conn.close()
-
-    # 检测人脸
-    def detectFace(self, img):
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        if self.isEqualizeHistEnabled:
-            gray = cv2.equalizeHist(gray)
-        face_cascade = cv2.CascadeClassifier('./haarcascades/haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.3, minNeighbors=5, minSize=(90, 90))
-
-        if (len(faces) == 0):
-            return None, None
-        (x, y, w, h) = faces[0]
-        return gray[y:y + w, x:x + h], faces[0]
-
-    # 准备图片数据
-    def prepareTrainingData(self, data_folder_path):
-        dirs = os.listdir(data_folder_path)
-        faces = []
-        labels = []
-
-        face_id = 1
-        conn = sqlite3.connect(self.database)
-        cursor = conn.cursor()
-
-        # 遍历人脸库
-        for dir_name in dirs:
-            if not dir_name.startswith('stu_'):
-                continue
-            stu_id = dir_name.replace('stu_', '')
-            try:
-                cursor.execute('SELECT * FROM users WHERE stu_id=?', (stu_id,))
-                ret = cursor.fetchall()
-                if not ret:
-                    raise RecordNotFound
-                cursor.execute('UPDATE users SET face_id=? WHERE stu_id=?', (face_id, stu_id,))
-            except RecordNotFound:
-                logging.warning('数据库中找不到学号为{}的用户记录'.format(stu_id))
-                self.logQueue.put('发现学号为{}的人脸数据，但数据库中找不到相应记录，已忽略'.format(stu_id))
-                continue
-            subject_dir_path = data_folder_path + '/' + dir_name
-            subject_images_names = os.listdir(subject_dir_path)
-            for image_name in subject_images_names:
-                if image_name.startswith('.'):
-                    continue
-                image_path = subject_dir_path + '/' + image_name
-                image = cv2.imread(image_path)
-                face, rect = self.detectFace(image)
-                if face is not None:
-                    faces.append(face)
-                    labels.append(face_id)
-            face_id = face_id + 1
-
-        cursor.close()
-        conn.commit()
-        conn.close()
-
-        return faces, labels
-
-    # 训练人脸数据
+
+    # 考勤报表
+    def showAttendance(self):
+        self.attendanceDialog = AttendanceDialog(getFaceBase(self.database))
+        self.attendanceDialog.exec()
+
+    # 是否有训练任务正在进行
+    def isTraining(self):
+        return self.trainingProcess is not None and self.trainingProcess.is_alive()
+
+    # 训练人脸数据：在后台进程中运行，训练过程中界面保持响应，再次点击按钮可取消训练
     # Reference：https://github.com/informramiz/opencv-face-recognition-python
     def train(self):
-        try:
-            if not os.path.isdir(self.datasets):
-                raise FileNotFoundError
+        if self.isTraining():
+            self.trainingCancelEvent.set()
+            self.trainButton.setEnabled(False)
+            self.logQueue.put('Info：正在取消训练...')
+            return
 
-            text = '系统将开始训练人脸数据，界面会暂停响应一段时间，完成后会弹出提示。'
-            informativeText = '<b>训练过程请勿进行其它操作，是否继续？</b>'
-            ret = DataManageUI.callDialog(QMessageBox.Question, text, informativeText,
-                                          QMessageBox.Yes | QMessageBox.No,
-                                          QMessageBox.No)
-            if ret == QMessageBox.Yes:
-                face_recognizer = cv2.face.LBPHFaceRecognizer_create()
-                if not os.path.exists('./recognizer'):
-                    os.makedirs('./recognizer')
-            faces, labels = self.prepareTrainingData(self.datasets)
-            face_recognizer.train(faces, np.array(labels))
-            face_recognizer.save('./recognizer/trainingData.yml')
-        except FileNotFoundError:
+        if not os.path.isdir(self.datasets):
             logging.error('系统找不到人脸数据目录{}'.format(self.datasets))
             self.trainButton.setIcon(QIcon('./icons/error.png'))
             self.logQueue.put('未发现人脸数据目录{}，你可能未进行人脸采集'.format(self.datasets))
-        except Exception as e:
-            logging.error('遍历人脸库出现异常，训练人脸数据失败')
-            self.trainButton.setIcon(QIcon('./icons/error.png'))
-            self.logQueue.put('Error：遍历人脸库出现异常，训练失败')
+            return
+
+        text = '系统将在后台训练人脸数据，训练过程中可查看进度，完成后会弹出提示。'
+        informativeText = '<b>是否继续？</b>'
+        ret = DataManageUI.callDialog(QMessageBox.Question, text, informativeText,
+                                      QMessageBox.Yes | QMessageBox.No,
+                                      QMessageBox.No)
+        if ret != QMessageBox.Yes:
+            return
+
+        options = {
+            'database': self.database,
+            'datasets': self.datasets,
+            'trainingData': self.trainingData,
+            'featureCache': self.featureCache,
+            'equalizeHist': self.isEqualizeHistEnabled,
+            'fullRetrain': self.isFullRetrainEnabled,
+        }
+        eventQueue = multiprocessing.Queue()
+        self.trainingCancelEvent = multiprocessing.Event()
+        self.trainingProcess = multiprocessing.Process(target=runTrainingProcess,
+                                                       args=(options, eventQueue, self.trainingCancelEvent))
+        self.trainingProcess.start()
+        threading.Thread(target=self.receiveTrainingEvents, args=(eventQueue,), daemon=True).start()
+
+        self.trainProgressBar.setValue(0)
+        self.trainButton.setIcon(QIcon())
+        self.trainButton.setText('取消训练')
+        self.equalizeHistCheckBox.setEnabled(False)
+        self.fullRetrainCheckBox.setEnabled(False)
+        self.logQueue.put('Info：训练任务已启动')
+
+    # 接收训练进程事件，直至训练结束
+    def receiveTrainingEvents(self, eventQueue):
+        process = self.trainingProcess
+        while True:
+            try:
+                event = eventQueue.get(timeout=1)
+            except queue.Empty:
+                # 训练进程异常退出，未发出结束事件
+                if not process.is_alive():
+                    self.trainingEventSignal.emit({'type': 'failed', 'reason': 'error',
+                                                   'message': 'exitcode {}'.format(process.exitcode)})
+                    break
+                continue
+            self.trainingEventSignal.emit(event)
+            if event['type'] in ('finished', 'cancelled', 'failed'):
+                break
+        process.join()
+
+    # 处理训练事件
+    def onTrainingEvent(self, event):
+        eventType = event['type']
+        if eventType == 'log':
+            self.logQueue.put(event['message'])
+        elif eventType == 'stage':
+            self.logQueue.put('Info：训练阶段 {}'.format(event['stage']))
+        elif eventType == 'progress':
+            self.trainProgressBar.setMaximum(max(event['total'], 1))
+            self.trainProgressBar.setValue(event['processed'])
+            self.trainProgressBar.setFormat('%v/%m（人脸 {}）'.format(event['faces']))
         else:
-            text = '<font color=green><b>Success!</b></font> 系统已生成./recognizer/trainingData.yml'
-            informativeText = '<b>人脸数据训练完成！</b>'
-            DataManageUI.callDialog(QMessageBox.Information, text, informativeText, QMessageBox.Ok)
-            self.trainButton.setIcon(QIcon('./icons/success.png'))
-            self.logQueue.put('Success：人脸数据训练完成')
-            self.initDb()
+            self.trainButton.setText('开始训练')
+            self.trainButton.setEnabled(True)
+            self.equalizeHistCheckBox.setEnabled(True)
+            self.fullRetrainCheckBox.setEnabled(True)
+            if eventType == 'finished':
+                report = formatReport(event['report'])
+                for line in report.split('\n'):
+                    self.logQueue.put('Info：' + line)
+                text = '<font color=green><b>Success!</b></font> 系统已生成{}'.format(self.trainingData)
+                informativeText = '<b>人脸数据训练完成！</b>'
+                DataManageUI.callDialog(QMessageBox.Information, text, informativeText, QMessageBox.Ok)
+                self.trainButton.setIcon(QIcon('./icons/success.png'))
+                self.logQueue.put('Success：人脸数据训练完成')
+                self.initDb()
+            elif eventType == 'cancelled':
+                self.trainProgressBar.setValue(0)
+                self.trainButton.setIcon(QIcon('./icons/warning.png'))
+                self.logQueue.put('Warning：训练已取消，已训练的人脸数据未改动')
+            elif event.get('reason') == 'datasets':
+                logging.error('系统找不到人脸数据目录{}'.format(self.datasets))
+                self.trainButton.setIcon(QIcon('./icons/error.png'))
+                self.logQueue.put('未发现人脸数据目录{}，你可能未进行人脸采集'.format(self.datasets))
+            else:
+                logging.error('遍历人脸库出现异常，训练人脸数据失败：{}'.format(event.get('message')))
+                self.trainButton.setIcon(QIcon('./icons/error.png'))
+                self.logQueue.put('Error：遍历人脸库出现异常，训练失败')
 
     # 系统日志服务常驻，接收并处理系统日志
     def receiveLog(self):
@@ -315,6 +378,13 @@ class DataManageUI(QWidget):
             msg.setDefaultButton(defaultButton)
         return msg.exec()
 
+    # 窗口关闭事件，取消正在进行的训练任务
+    def closeEvent(self, event):
+        if self.isTraining():
+            self.trainingCancelEvent.set()
+            self.trainingProcess.join()
+        event.accept()
+
 
 if __name__ == '__main__':
     logging.config.fileConfig('./config/logging.cfg')
@@ -3,7 +3,7 @@
 
 import cv2
 
-from PyQt5.QtCore import QTimer, QRegExp, pyqtSignal
+from PyQt5.QtCore import QThread, QRegExp, pyqtSignal
 from PyQt5.QtGui import QImage, QPixmap, QIcon, QRegExpValidator, QTextCursor
 from PyQt5.QtWidgets import QDialog, QApplication, QWidget, QMessageBox
 from PyQt5.uic import loadUi
@@ -12,20 +12,23 @@ import logging
 import logging.config
 import queue
 import threading
-import sqlite3
 import os
 import sys
+import time
 
 from datetime import datetime
 
+from datasetStore import PackWriter, importDirectory, packPath
+from faceBase import getFaceBase
+from faceDetector import loadDetector
 
-# 用户取消了更新数据库操作
-class OperationCancel(Exception):
-    pass
+# 自动连续采集：每次采集的样本数、采集速率（张/秒）
+BURST_SIZE = 100
+BURST_RATE = 10
 
 
-# 采集过程中出现干扰
-class RecordDisturbance(Exception):
+# 用户取消了更新数据库操作
+class OperationCancel(Exception):
     pass
 
 
@@ -40,10 +43,20 @@ class DataRecordUI(QWidget):
 
         # OpenCV
         self.cap = cv2.VideoCapture()
-        self.faceCascade = cv2.CascadeClassifier('./haarcascades/haarcascade_frontalface_default.xml')
 
         self.logQueue = queue.Queue()  # 日志队列
 
+        # 图像捕获、人脸检测线程及人脸图像写入线程
+        self.sampleQueue = queue.Queue()
+        self.faceCaptureThread = FaceCaptureThread(self.cap, self.sampleQueue)
+        self.faceCaptureThread.frameReady.connect(self.displayImage)
+        self.faceCaptureThread.recordDisturbance.connect(self.onRecordDisturbance)
+        self.faceCaptureThread.burstFinished.connect(self.onBurstFinished)
+        self.sampleWriterThread = SampleWriterThread(self.sampleQueue)
+        self.sampleWriterThread.sampleSaved.connect(self.onSampleSaved)
+        self.sampleWriterThread.sampleFailed.connect(self.onSampleFailed)
+        self.sampleWriterThread.start()
+
         # 图像捕获
         self.isExternalCameraUsed = False
         self.useExternalCameraCheckBox.stateChanged.connect(
@@ -51,10 +64,6 @@ class DataRecordUI(QWidget):
         self.startWebcamButton.toggled.connect(self.startWebcam)
         self.startWebcamButton.setCheckable(True)
 
-        # 定时器
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.updateFrame)
-
         # 人脸检测
         self.isFaceDetectEnabled = False
         self.enableFaceDetectButton.toggled.connect(self.enableFaceDetect)
@@ -81,6 +90,9 @@ class DataRecordUI(QWidget):
         self.isFaceDataReady = False
         self.isFaceRecordEnabled = False
         self.enableFaceRecordButton.clicked.connect(self.enableFaceRecord)
+        self.autoFaceRecordButton.toggled.connect(self.enableAutoFaceRecord)
+        self.autoFaceRecordButton.setCheckable(True)
+        self.packWriter = None  # 当前用户的人脸数据集写入器
 
         # 日志系统
         self.receiveLogSignal.connect(lambda log: self.logOutput(log))
@@ -115,12 +127,11 @@ class DataRecordUI(QWidget):
             else:
                 self.startWebcamButton.setText('关闭摄像头')
                 self.enableFaceDetectButton.setEnabled(True)
-                self.timer.start(5)
+                self.faceCaptureThread.start()  # 启动图像捕获线程
                 self.startWebcamButton.setIcon(QIcon('./icons/success.png'))
         else:
             if self.cap.isOpened():
-                if self.timer.isActive():
-                    self.timer.stop()
+                self.faceCaptureThread.stop()
                 self.cap.release()
                 self.faceDetectCaptureLabel.clear()
                 self.faceDetectCaptureLabel.setText('<font color=red>摄像头未开启</font>')
@@ -137,21 +148,54 @@ class DataRecordUI(QWidget):
             else:
                 self.enableFaceDetectButton.setText('开启人脸检测')
                 self.isFaceDetectEnabled = False
+            self.faceCaptureThread.isFaceDetectEnabled = self.isFaceDetectEnabled
 
     # 采集当前捕获帧
     def enableFaceRecord(self):
         if not self.isFaceRecordEnabled:
             self.isFaceRecordEnabled = True
+            self.faceCaptureThread.requestFaceRecord(self.packWriter)
+
+    # 开启/关闭自动连续采集：人脸稳定时按固定速率采集，样本须通过清晰度、大小、亮度及差异度检查
+    def enableAutoFaceRecord(self, status):
+        if status:
+            self.autoFaceRecordButton.setText('停止自动采集')
+            self.enableFaceRecordButton.setEnabled(False)
+            self.faceCaptureThread.startBurst(self.packWriter, BURST_SIZE, BURST_RATE)
+            self.logQueue.put('Info：开始自动采集，请正对摄像头并缓慢转动头部')
+        else:
+            self.faceCaptureThread.stopBurst()
+            self.autoFaceRecordButton.setText('自动连续采集')
+            if self.packWriter is not None:
+                self.enableFaceRecordButton.setEnabled(True)
+
+    # 自动采集结束
+    def onBurstFinished(self, accepted, rejected):
+        if rejected:
+            reasons = '，'.join('{}{}次'.format(SampleQualityGate.REASONS[reason], count)
+                               for reason, count in sorted(rejected.items()))
+            self.logQueue.put('Info：自动采集结束，共采集{}帧，丢弃不合格样本：{}'.format(accepted, reasons))
+        else:
+            self.logQueue.put('Info：自动采集结束，共采集{}帧'.format(accepted))
+        self.autoFaceRecordButton.setChecked(False)
 
     # 开始/结束采集人脸数据
     def startFaceRecord(self, startFaceRecordButton):
         if startFaceRecordButton.text() == '开始采集人脸数据':
             if self.isFaceDetectEnabled:
                 if self.isUserInfoReady:
+                    try:
+                        self.openPackWriter()
+                    except Exception as e:
+                        logging.error('打开人脸数据集文件过程中发生异常')
+                        self.startFaceRecordButton.setIcon(QIcon('./icons/error.png'))
+                        self.logQueue.put('Error：无法打开人脸数据集文件，采集失败')
+                        return
                     self.addOrUpdateUserInfoButton.setEnabled(False)
                     if not self.enableFaceRecordButton.isEnabled():
                         self.enableFaceRecordButton.setEnabled(True)
                     self.enableFaceRecordButton.setIcon(QIcon())
+                    self.autoFaceRecordButton.setEnabled(True)
                     self.startFaceRecordButton.setIcon(QIcon('./icons/success.png'))
                     self.startFaceRecordButton.setText('结束当前人脸采集')
                 else:
@@ -175,69 +219,66 @@ class DataRecordUI(QWidget):
                                               QMessageBox.No)
 
                 if ret == QMessageBox.Yes:
-                    self.isFaceDataReady = True
+                    self.autoFaceRecordButton.setChecked(False)
                     if self.isFaceRecordEnabled:
                         self.isFaceRecordEnabled = False
+                        self.faceCaptureThread.cancelFaceRecord()
+                    self.closePackWriter()
+                    self.isFaceDataReady = True
                     self.enableFaceRecordButton.setEnabled(False)
+                    self.autoFaceRecordButton.setEnabled(False)
                     self.enableFaceRecordButton.setIcon(QIcon())
                     self.startFaceRecordButton.setText('开始采集人脸数据')
                     self.startFaceRecordButton.setEnabled(False)
                     self.startFaceRecordButton.setIcon(QIcon())
                     self.migrateToDbButton.setEnabled(True)
 
-    # 定时器，实时更新画面
-    def updateFrame(self):
-        ret, frame = self.cap.read()
-        # self.image = cv2.flip(self.image, 1)
-        if ret:
-            self.displayImage(frame)
-
-            if self.isFaceDetectEnabled:
-                detected_frame = self.detectFace(frame)
-                self.displayImage(detected_frame)
-            else:
-                self.displayImage(frame)
-
-    # 检测人脸
-    def detectFace(self, frame):
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.faceCascade.detectMultiScale(gray, 1.3, 5, minSize=(90, 90))
-
+    # 打开当前用户的人脸数据集，样本逐条追加写入 ./datasets/stu_{stu_id}.pack
+    # 若该用户只有旧版JPEG目录，先将其导入数据集
+    def openPackWriter(self):
+        if self.packWriter is not None:
+            return
+        if not os.path.isdir(self.datasets):
+            os.makedirs(self.datasets)
         stu_id = self.userInfo.get('stu_id')
+        path = packPath(self.datasets, stu_id)
+        legacyDir = '{}/stu_{}'.format(self.datasets, stu_id)
+        if not os.path.exists(path) and os.path.isdir(legacyDir):
+            count = importDirectory(legacyDir, path)
+            self.logQueue.put('Info：已将{}下的{}张人脸图像导入{}'.format(legacyDir, count, path))
+        self.packWriter = PackWriter(path)
+
+    # 关闭人脸数据集：先让图像捕获线程停止向该数据集提交人脸图像，再由写入线程写完已提交的图像后关闭
+    def closePackWriter(self):
+        if self.packWriter is not None:
+            self.faceCaptureThread.releaseTarget(self.packWriter)
+            self.sampleQueue.put((self.packWriter, None))
+            self.packWriter = None
+
+    # 检测到多张人脸或环境干扰，本次采集被丢弃
+    def onRecordDisturbance(self):
+        self.isFaceRecordEnabled = False
+        logging.error('检测到多张人脸或环境干扰')
+        self.logQueue.put('Warning：检测到多张人脸或环境干扰，请解决问题后继续')
+        self.enableFaceRecordButton.setIcon(QIcon('./icons/warning.png'))
+
+    # 人脸图像已写入
+    def onSampleSaved(self):
+        if not self.autoFaceRecordButton.isChecked():
+            self.isFaceRecordEnabled = False
+            self.enableFaceRecordButton.setIcon(QIcon('./icons/success.png'))
+        self.faceRecordCount = self.faceRecordCount + 1
+        self.faceRecordCountLcdNum.display(self.faceRecordCount)
+
+    # 人脸图像写入失败
+    def onSampleFailed(self):
+        self.isFaceRecordEnabled = False
+        logging.error('写入人脸图像文件到计算机过程中发生异常')
+        self.enableFaceRecordButton.setIcon(QIcon('./icons/error.png'))
+        self.logQueue.put('Error：无法保存人脸图像，采集当前捕获帧失败')
 
-        for (x, y, w, h) in faces:
-            if self.isFaceRecordEnabled:
-                try:
-                    if not os.path.exists('{}/stu_{}'.format(self.datasets, stu_id)):
-                        os.makedirs('{}/stu_{}'.format(self.datasets, stu_id))
-                    if len(faces) > 1:
-                        raise RecordDisturbance
-
-                    cv2.imwrite('{}/stu_{}/img.{}.jpg'.format(self.datasets, stu_id, self.faceRecordCount + 1),
-                                gray[y - 20:y + h + 20, x - 20:x + w + 20])
-                except RecordDisturbance:
-                    self.isFaceRecordEnabled = False
-                    logging.error('检测到多张人脸或环境干扰')
-                    self.logQueue.put('Warning：检测到多张人脸或环境干扰，请解决问题后继续')
-                    self.enableFaceRecordButton.setIcon(QIcon('./icons/warning.png'))
-                    continue
-                except Exception as e:
-                    logging.error('写入人脸图像文件到计算机过程中发生异常')
-                    self.enableFaceRecordButton.setIcon(QIcon('./icons/error.png'))
-                    self.logQueue.put('Error：无法保存人脸图像，采集当前捕获帧失败')
-                else:
-                    self.enableFaceRecordButton.setIcon(QIcon('./icons/success.png'))
-                    self.faceRecordCount = self.faceRecordCount + 1
-                    self.isFaceRecordEnabled = False
-                    self.faceRecordCountLcdNum.display(self.faceRecordCount)
-            cv2.rectangle(frame, (x - 5, y - 10), (x + w + 5, y + h + 10), (0, 0, 255), 2)
-
-        return frame
-
-    # 显示图像
+    # 显示图像，img为图像捕获线程已转换好的RGB图像
     def displayImage(self, img):
-        # BGR -> RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         # default：The image is stored using 8-bit indexes into a colormap， for example：a gray image
         qformat = QImage.Format_Indexed8
 
@@ -263,26 +304,14 @@ class DataRecordUI(QWidget):
 
     # 初始化数据库
     def initDb(self):
-        conn = sqlite3.connect(self.database)
-        cursor = conn.cursor()
         try:
             # 检测人脸数据目录是否存在，不存在则创建
             if not os.path.isdir(self.datasets):
                 os.makedirs(self.datasets)
 
-            # 查询数据表是否存在，不存在则创建
-            cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                              stu_id VARCHAR(12) PRIMARY KEY NOT NULL,
-                              face_id INTEGER DEFAULT -1,
-                              cn_name VARCHAR(10) NOT NULL,
-                              en_name VARCHAR(16) NOT NULL,
-                              created_time DATE DEFAULT (date('now','localtime'))
-                              )
-                          ''')
+            # 打开数据库，数据表不存在或结构版本过旧时自动创建、升级
             # 查询数据表记录数
-            cursor.execute('SELECT Count(*) FROM users')
-            result = cursor.fetchone()
-            dbUserCount = result[0]
+            dbUserCount = getFaceBase(self.database).countUsers()
         except Exception as e:
             logging.error('读取数据库异常，无法完成数据库初始化')
             self.isDbReady = False
@@ -295,10 +324,6 @@ class DataRecordUI(QWidget):
             self.initDbButton.setIcon(QIcon('./icons/success.png'))
             self.initDbButton.setEnabled(False)
             self.addOrUpdateUserInfoButton.setEnabled(True)
-        finally:
-            cursor.close()
-            conn.commit()
-            conn.close()
 
     # 增加/修改用户信息
     def addOrUpdateUserInfo(self):
@@ -345,12 +370,10 @@ class DataRecordUI(QWidget):
         if self.isFaceDataReady:
             stu_id, cn_name, en_name = self.userInfo.get('stu_id'), self.userInfo.get('cn_name'), self.userInfo.get(
                 'en_name')
-            conn = sqlite3.connect(self.database)
-            cursor = conn.cursor()
+            faceBase = getFaceBase(self.database)
 
             try:
-                cursor.execute('SELECT * FROM users WHERE stu_id=?', (stu_id,))
-                if cursor.fetchall():
+                if faceBase.getUser(stu_id):
                     text = '数据库已存在学号为 <font color=blue>{}</font> 的用户记录。'.format(stu_id)
                     informativeText = '<b>是否覆盖？</b>'
                     ret = DataRecordUI.callDialog(QMessageBox.Warning, text, informativeText,
@@ -358,18 +381,14 @@ class DataRecordUI(QWidget):
 
                     if ret == QMessageBox.Yes:
                         # 更新已有记录
-                        cursor.execute('UPDATE users SET cn_name=?, en_name=? WHERE stu_id=?',
-                                       (cn_name, en_name, stu_id,))
+                        faceBase.updateUser(stu_id, cn_name, en_name)
                     else:
                         raise OperationCancel  # 记录取消覆盖操作
                 else:
                     # 插入新记录
-                    cursor.execute('INSERT INTO users (stu_id, cn_name, en_name) VALUES (?, ?, ?)',
-                                   (stu_id, cn_name, en_name,))
+                    faceBase.insertUser(stu_id, cn_name, en_name)
 
-                cursor.execute('SELECT Count(*) FROM users')
-                result = cursor.fetchone()
-                dbUserCount = result[0]
+                dbUserCount = faceBase.countUsers()
             except OperationCancel:
                 pass
             except Exception as e:
@@ -400,11 +419,6 @@ class DataRecordUI(QWidget):
                 # 允许继续增加新用户
                 self.addOrUpdateUserInfoButton.setEnabled(True)
                 self.migrateToDbButton.setEnabled(False)
-
-            finally:
-                cursor.close()
-                conn.commit()
-                conn.close()
         else:
             self.logQueue.put('Error：操作失败，你尚未完成人脸数据采集')
             self.migrateToDbButton.setIcon(QIcon('./icons/error.png'))
@@ -442,15 +456,228 @@ class DataRecordUI(QWidget):
             msg.setDefaultButton(defaultButton)
         return msg.exec()
 
-    # 窗口关闭事件，关闭定时器、摄像头
+    # 窗口关闭事件，关闭图像捕获线程、摄像头、人脸数据集，等待写入线程写完已采集的人脸图像
     def closeEvent(self, event):
-        if self.timer.isActive():
-            self.timer.stop()
+        self.faceCaptureThread.stopBurst()
+        self.faceCaptureThread.stop()
+        self.closePackWriter()
+        self.sampleWriterThread.stop()
         if self.cap.isOpened():
             self.cap.release()
         event.accept()
 
 
+# 采集样本质量检查，全部基于缩小后的灰度人脸图，开销远小于人脸检测本身
+class SampleQualityGate:
+    REASONS = {'size': '人脸过小', 'blur': '图像模糊', 'brightness': '亮度异常', 'duplicate': '与上一帧过于相似'}
+
+    def __init__(self, minFaceSize=120, minSharpness=60.0, brightnessRange=(50, 200), minDifference=6.0):
+        self.minFaceSize = minFaceSize
+        self.minSharpness = minSharpness  # 拉普拉斯算子响应的方差
+        self.brightnessRange = brightnessRange
+        self.minDifference = minDifference  # 与上一张合格样本缩略图的平均绝对差
+        self.lastThumbnail = None
+
+    def reset(self):
+        self.lastThumbnail = None
+
+    # 检查人脸区域，通过返回None，否则返回不合格原因
+    def check(self, face, faceSize):
+        if faceSize < self.minFaceSize:
+            return 'size'
+        small = cv2.resize(face, (100, 100), interpolation=cv2.INTER_AREA)
+        if cv2.Laplacian(small, cv2.CV_64F).var() < self.minSharpness:
+            return 'blur'
+        brightness = small.mean()
+        if not self.brightnessRange[0] <= brightness <= self.brightnessRange[1]:
+            return 'brightness'
+        thumbnail = cv2.resize(small, (32, 32), interpolation=cv2.INTER_AREA)
+        if self.lastThumbnail is not None and cv2.absdiff(thumbnail, self.lastThumbnail).mean() < self.minDifference:
+            return 'duplicate'
+        self.lastThumbnail = thumbnail
+        return None
+
+
+# 图像捕获线程：摄像头读取、人脸检测都在此线程完成，待保存的人脸图像交给写入线程，
+# 界面线程只按显示帧率接收已转换为RGB的图像
+class FaceCaptureThread(QThread):
+    frameReady = pyqtSignal(object)  # 待显示的RGB图像
+    recordDisturbance = pyqtSignal()  # 采集时检测到多张人脸
+    burstFinished = pyqtSignal(int, object)  # 自动采集结束：合格样本数、各原因的不合格次数
+
+    def __init__(self, cap, sampleQueue, displayFps=30):
+        super(FaceCaptureThread, self).__init__()
+        self.cap = cap
+        self.sampleQueue = sampleQueue
+        self.displayInterval = 1.0 / displayFps
+        self.isRunning = False
+
+        self.isFaceDetectEnabled = False
+        self.recordTarget = None  # 不为None时，采集下一帧中的人脸并写入该数据集
+        # 读取采集目标并提交人脸图像时持有，释放目标后不会再有该数据集的人脸图像进入写入队列
+        self.targetLock = threading.Lock()
+
+        # 自动连续采集
+        self.burstTarget = None
+        self.burstRemaining = 0
+        self.burstInterval = 0
+        self.lastBurstTime = 0
+        self.burstAccepted = 0
+        self.burstRejected = {}
+        self.stableFrames = 0  # 连续检测到单张且位置稳定人脸的帧数
+        self.lastFace = None
+        self.qualityGate = SampleQualityGate()
+
+    # 请求采集下一帧中的人脸
+    def requestFaceRecord(self, packWriter):
+        with self.targetLock:
+            self.recordTarget = packWriter
+
+    def cancelFaceRecord(self):
+        with self.targetLock:
+            self.recordTarget = None
+
+    # 停止向packWriter提交人脸图像（关闭数据集前调用），返回后不会再有该数据集的人脸图像进入写入队列
+    def releaseTarget(self, packWriter):
+        with self.targetLock:
+            if self.recordTarget is packWriter:
+                self.recordTarget = None
+            if self.burstTarget is packWriter:
+                self.burstTarget = None
+
+    # 开始自动采集count张样本，每秒最多rate张
+    def startBurst(self, packWriter, count, rate):
+        self.burstAccepted = 0
+        self.burstRejected = {}
+        self.burstRemaining = count
+        self.burstInterval = 1.0 / rate
+        self.lastBurstTime = 0
+        self.stableFrames = 0
+        self.qualityGate.reset()
+        with self.targetLock:
+            self.burstTarget = packWriter
+
+    def stopBurst(self):
+        with self.targetLock:
+            if self.burstTarget is None:
+                return
+            self.burstTarget = None
+        self.burstFinished.emit(self.burstAccepted, dict(self.burstRejected))
+
+    # 自动采集：人脸需连续数帧稳定，且样本通过质量检查
+    def burstRecord(self, gray, faces):
+        if len(faces) != 1:
+            self.stableFrames = 0
+            self.lastFace = None
+            return
+        (x, y, w, h) = faces[0]
+        if self.lastFace is not None and abs(x - self.lastFace[0]) + abs(y - self.lastFace[1]) < 0.15 * w:
+            self.stableFrames += 1
+        else:
+            self.stableFrames = 0
+        self.lastFace = (x, y)
+
+        now = time.perf_counter()
+        if self.stableFrames < 3 or now - self.lastBurstTime < self.burstInterval:
+            return
+        self.lastBurstTime = now
+        face = gray[max(y - 20, 0):y + h + 20, max(x - 20, 0):x + w + 20]
+        reason = self.qualityGate.check(gray[y:y + h, x:x + w], w)
+        if reason:
+            self.burstRejected[reason] = self.burstRejected.get(reason, 0) + 1
+            return
+        with self.targetLock:
+            if self.burstTarget is None:
+                return
+            self.sampleQueue.put((self.burstTarget, face))
+        self.burstAccepted += 1
+        self.burstRemaining -= 1
+        if self.burstRemaining <= 0:
+            self.stopBurst()
+
+    def run(self):
+        faceDetector = loadDetector(allowTiled=False)
+        lastDisplayTime = 0
+        while self.isRunning:
+            ret, frame = self.cap.read()
+            if not ret:
+                self.msleep(5)
+                continue
+            if self.isFaceDetectEnabled:
+                self.detectFace(faceDetector, frame)
+
+            # 只有需要显示的帧才转换颜色空间并交给界面线程
+            now = time.perf_counter()
+            if now - lastDisplayTime >= self.displayInterval:
+                lastDisplayTime = now
+                self.frameReady.emit(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+    # 检测人脸
+    def detectFace(self, faceDetector, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces = faceDetector.detect(gray)
+
+        if self.burstTarget is not None:
+            self.burstRecord(gray, faces)
+
+        if self.recordTarget is not None and len(faces):
+            with self.targetLock:
+                packWriter, self.recordTarget = self.recordTarget, None
+                if packWriter is not None and len(faces) == 1:
+                    (x, y, w, h) = faces[0]
+                    self.sampleQueue.put((packWriter, gray[max(y - 20, 0):y + h + 20, max(x - 20, 0):x + w + 20]))
+            if packWriter is not None and len(faces) > 1:
+                self.recordDisturbance.emit()
+
+        for (x, y, w, h) in faces:
+            cv2.rectangle(frame, (x - 5, y - 10), (x + w + 5, y + h + 10), (0, 0, 255), 2)
+
+    def start(self):
+        self.isRunning = True
+        super(FaceCaptureThread, self).start()
+
+    # 停止图像捕获线程
+    def stop(self):
+        self.isRunning = False
+        self.wait()
+
+
+# 人脸图像写入线程，磁盘写入较慢时不影响图像捕获与界面刷新
+# 队列中的 (packWriter, None) 表示该数据集已采集完毕，写完之前的人脸图像后关闭；None表示退出线程
+class SampleWriterThread(QThread):
+    sampleSaved = pyqtSignal()
+    sampleFailed = pyqtSignal()
+
+    def __init__(self, sampleQueue):
+        super(SampleWriterThread, self).__init__()
+        self.sampleQueue = sampleQueue
+
+    def run(self):
+        while True:
+            item = self.sampleQueue.get()
+            if item is None:
+                break
+            packWriter, face = item
+            if face is None:
+                try:
+                    packWriter.close()
+                except Exception as e:
+                    logging.error(e)
+                continue
+            try:
+                packWriter.append(face)
+            except Exception as e:
+                logging.error(e)
+                self.sampleFailed.emit()
+            else:
+                self.sampleSaved.emit()
+
+    # 写完队列中已有的人脸图像后停止写入线程
+    def stop(self):
+        self.sampleQueue.put(None)
+        self.wait()
+
+
 # 用户信息填写对话框
 class UserInfoDialog(QDialog):
     def __init__(self):
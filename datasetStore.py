@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+import numpy as np
+
+import argparse
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+
+# 打包的人脸数据集：每个用户一个只追加的 ./datasets/stu_{stu_id}.pack 文件，替代大量零散的JPEG小文件
+#   [0, 64)   文件头：魔数 b'FACEPACK'、版本号、图像宽、高（uint32）
+#   [64, ...) 定长记录：采集时间 float64、序号 uint32、像素CRC32 uint32、width*height 字节灰度图
+# 记录定长，序号即索引，训练时整个文件以结构化数组内存映射读取；
+# 采集过程中逐条追加写入，异常中断留下的不完整尾记录在读取时被忽略
+MAGIC = b'FACEPACK'
+VERSION = 1
+HEADER_SIZE = 64
+RECORD_HEADER_SIZE = 16
+
+# 默认存储尺寸，采集的人脸（含边距）统一缩放到该尺寸
+DEFAULT_FACE_SIZE = (200, 200)
+
+PACK_SUFFIX = '.pack'
+
+
+# 数据集文件格式错误
+class DatasetFormatError(Exception):
+    pass
+
+
+# 记录的结构化数据类型
+def recordDtype(width, height):
+    return np.dtype([('timestamp', '<f8'), ('seq', '<u4'), ('checksum', '<u4'), ('pixels', 'u1', (height, width))])
+
+
+# 用户对应的打包文件路径
+def packPath(datasets, stu_id):
+    return '{}/stu_{}{}'.format(datasets, stu_id, PACK_SUFFIX)
+
+
+# 从打包文件名中解析学号，不是打包文件时返回None
+def parseStuId(file_name):
+    match = re.match(r'^stu_(.+)\.pack$', file_name)
+    return match.group(1) if match else None
+
+
+# 读取文件头，返回 (width, height)
+def readHeader(file):
+    header = file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[:8] != MAGIC:
+        raise DatasetFormatError('不是有效的人脸数据集文件')
+    version, width, height = struct.unpack('<III', header[8:20])
+    if version != VERSION:
+        raise DatasetFormatError('不支持的人脸数据集文件版本：{}'.format(version))
+    return width, height
+
+
+# 人脸数据集写入器，采集过程中逐条追加
+class PackWriter:
+    def __init__(self, path, size=DEFAULT_FACE_SIZE):
+        if os.path.isfile(path) and os.path.getsize(path) >= HEADER_SIZE:
+            with open(path, 'rb') as file:
+                self.width, self.height = readHeader(file)
+            self.dtype = recordDtype(self.width, self.height)
+            dataSize = os.path.getsize(path) - HEADER_SIZE
+            self.count = dataSize // self.dtype.itemsize
+            self.file = open(path, 'r+b')
+            # 丢弃异常中断留下的不完整尾记录
+            self.file.truncate(HEADER_SIZE + self.count * self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.width, self.height = size
+            self.dtype = recordDtype(self.width, self.height)
+            self.count = 0
+            self.file = open(path, 'wb')
+            self.file.write(struct.pack('<8sIII', MAGIC, VERSION, self.width, self.height).ljust(HEADER_SIZE, b'\0'))
+            self.file.flush()
+        self.path = path
+
+    def __len__(self):
+        return self.count
+
+    # 追加一张灰度人脸图，返回其序号
+    def append(self, face, timestamp=None):
+        if face.ndim == 3:
+            face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+        if face.shape != (self.height, self.width):
+            face = cv2.resize(face, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        pixels = np.ascontiguousarray(face, dtype=np.uint8).tobytes()
+        seq = self.count
+        self.file.write(struct.pack('<dII', timestamp if timestamp is not None else time.time(), seq,
+                                    zlib.crc32(pixels) & 0xffffffff))
+        self.file.write(pixels)
+        self.file.flush()
+        self.count += 1
+        return seq
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# 人脸数据集读取器，以内存映射方式读取全部记录
+class PackReader:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.width, self.height = readHeader(file)
+        self.path = path
+        self.dtype = recordDtype(self.width, self.height)
+        count = (os.path.getsize(path) - HEADER_SIZE) // self.dtype.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    # 第index张灰度人脸图
+    def __getitem__(self, index):
+        return self.records['pixels'][index]
+
+    # 第index条记录的采集时间与CRC32
+    def meta(self, index):
+        record = self.records[index]
+        return float(record['timestamp']), int(record['checksum'])
+
+    # 校验第index条记录
+    def verify(self, index):
+        return zlib.crc32(self[index].tobytes()) & 0xffffffff == int(self.records[index]['checksum'])
+
+
+# 将JPEG目录（stu_{stu_id}/img.{n}.jpg）导入为打包文件，返回导入的图片数
+def importDirectory(subject_dir_path, path, size=DEFAULT_FACE_SIZE):
+    count = 0
+    with PackWriter(path, size) as writer:
+        for entry in sorted(os.scandir(subject_dir_path), key=lambda e: e.name):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            image = cv2.imread(entry.path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                continue
+            writer.append(image, entry.stat().st_mtime)
+            count += 1
+    return count
+
+
+# 将打包文件导出为JPEG目录，返回导出的图片数
+def exportDirectory(path, subject_dir_path):
+    if not os.path.isdir(subject_dir_path):
+        os.makedirs(subject_dir_path)
+    reader = PackReader(path)
+    for index in range(len(reader)):
+        cv2.imwrite('{}/img.{}.jpg'.format(subject_dir_path, index + 1), np.asarray(reader[index]))
+    return len(reader)
+
+
+# 对比目录遍历读取JPEG与读取打包文件的耗时
+def benchmark(datasets):
+    start = time.perf_counter()
+    jpegCount = 0
+    for dir_name in os.listdir(datasets):
+        subject_dir_path = '{}/{}'.format(datasets, dir_name)
+        if not dir_name.startswith('stu_') or not os.path.isdir(subject_dir_path):
+            continue
+        for image_name in os.listdir(subject_dir_path):
+            if image_name.startswith('.'):
+                continue
+            if cv2.imread('{}/{}'.format(subject_dir_path, image_name)) is not None:
+                jpegCount += 1
+    jpegTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    packCount = 0
+    checksum = 0
+    for file_name in os.listdir(datasets):
+        if parseStuId(file_name) is None:
+            continue
+        reader = PackReader('{}/{}'.format(datasets, file_name))
+        for index in range(len(reader)):
+            checksum += int(reader[index][0, 0])
+            packCount += 1
+    packTime = time.perf_counter() - start
+    return (jpegCount, jpegTime), (packCount, packTime)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='打包的人脸数据集导入、导出与基准测试')
+    subparsers = parser.add_subparsers(dest='command')
+
+    importParser = subparsers.add_parser('import', help='JPEG目录 -> 打包文件')
+    importParser.add_argument('datasets', nargs='?', default='./datasets')
+    importParser.add_argument('--size', type=int, nargs=2, default=DEFAULT_FACE_SIZE, metavar=('WIDTH', 'HEIGHT'))
+
+    exportParser = subparsers.add_parser('export', help='打包文件 -> JPEG目录')
+    exportParser.add_argument('datasets', nargs='?', default='./datasets')
+
+    benchmarkParser = subparsers.add_parser('benchmark', help='对比目录遍历与打包文件的读取耗时')
+    benchmarkParser.add_argument('datasets', nargs='?', default='./datasets')
+
+    args = parser.parse_args()
+    if args.command == 'import':
+        for dir_name in sorted(os.listdir(args.datasets)):
+            subject_dir_path = '{}/{}'.format(args.datasets, dir_name)
+            if not dir_name.startswith('stu_') or not os.path.isdir(subject_dir_path):
+                continue
+            path = packPath(args.datasets, dir_name.replace('stu_', '', 1))
+            if os.path.exists(path):
+                print('{}已存在，跳过'.format(path))
+                continue
+            count = importDirectory(subject_dir_path, path, tuple(args.size))
+            print('{} -> {}：{}张'.format(subject_dir_path, path, count))
+    elif args.command == 'export':
+        for file_name in sorted(os.listdir(args.datasets)):
+            stu_id = parseStuId(file_name)
+            if stu_id is None:
+                continue
+            subject_dir_path = '{}/stu_{}'.format(args.datasets, stu_id)
+            if os.path.exists(subject_dir_path):
+                print('{}已存在，跳过'.format(subject_dir_path))
+                continue
+            count = exportDirectory('{}/{}'.format(args.datasets, file_name), subject_dir_path)
+            print('{}/{} -> {}：{}张'.format(args.datasets, file_name, subject_dir_path, count))
+    elif args.command == 'benchmark':
+        (jpegCount, jpegTime), (packCount, packTime) = benchmark(args.datasets)
+        print('JPEG目录：{}张，{:.3f}s'.format(jpegCount, jpegTime))
+        print('打包文件：{}张，{:.3f}s'.format(packCount, packTime))
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import numpy as np
+
+import argparse
+import json
+import logging
+import logging.config
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from configparser import ConfigParser
+
+from faceDetector import DETECTOR_CONFIG
+from modelStore import loadRecognizer, resolveModelPath
+from trainer import TRAINER_CONFIG, TrainingJob, detectFace, listDatasets, listSources, loadSource
+
+# 识别效果评估：将人脸库按用户划分为已注册用户与陌生人，已注册用户的样本按留出法或k折交叉验证划分训练集与测试集，
+# 以与数据管理系统相同的训练流程（TrainingJob）训练模型，再按核心框架的方式逐张人脸检测、识别，统计：
+#   准确率、误识率（FAR）、拒识率（FRR）随置信度阈值的变化
+#   每张人脸的识别耗时、模型文件大小及加载耗时
+# 可指定多个人脸库规模（已注册用户数），分别训练评估，观察用户增多时准确率与耗时的变化
+# 不依赖GUI，可在部署前用命令行检查模型效果是否退化
+
+TEST_RATIO = 0.3
+STRANGER_RATIO = 0.2
+THRESHOLDS = tuple(range(20, 121, 10))
+CORE_CONFIG = './config/core.cfg'
+
+
+# 评估用的训练任务：训练样本由调用方指定，不读取数据库，模型与特征缓存写入临时目录
+class EvaluationJob(TrainingJob):
+    def __init__(self, tasks, datasets, trainingData, featureCache, **kwargs):
+        super(EvaluationJob, self).__init__(datasets=datasets, trainingData=trainingData, featureCache=featureCache,
+                                            fullRetrain=True, **kwargs)
+        self.tasks = tasks
+
+    def scan(self, model=None):
+        self.report['users'] = len({label for label, source in self.tasks})
+        self.report['images'] = len(self.tasks)
+        return list(self.tasks), {str(label): 'evaluation' for label, source in self.tasks}
+
+    # 各折、各规模训练共用特征缓存，不清除其它用户的缓存
+    def extract(self, tasks, retainDatasets=None):
+        return super(EvaluationJob, self).extract(tasks)
+
+
+# 划分用户：随机留出strangerRatio的用户作为陌生人（至少1名），返回 ([(label, [source])], [source])
+def splitUsers(datasets, strangerRatio=STRANGER_RATIO, seed=0):
+    datasetPaths = listDatasets(datasets)
+    if len(datasetPaths) < 2:
+        raise ValueError('人脸库中至少需要2名用户')
+    rng = random.Random(seed)
+    stu_ids = list(datasetPaths)
+    rng.shuffle(stu_ids)
+    strangerCount = min(max(int(round(len(stu_ids) * strangerRatio)), 1), len(stu_ids) - 1)
+    users = [(label, listSources(datasetPaths[stu_id])) for label, stu_id in enumerate(stu_ids[strangerCount:], 1)]
+    strangers = [source for stu_id in stu_ids[:strangerCount] for source in listSources(datasetPaths[stu_id])]
+    return users, strangers
+
+
+# 划分训练集与测试集，逐折产出 (train, test)，均为 [(label, source)]
+# folds大于1时为k折交叉验证（每位用户的样本分别均分为k份），否则按testRatio留出
+def splitFolds(users, folds=0, testRatio=TEST_RATIO, seed=0):
+    rng = random.Random(seed)
+    shuffled = []
+    for label, sources in users:
+        sources = list(sources)
+        rng.shuffle(sources)
+        shuffled.append((label, sources))
+    if folds <= 1:
+        train, test = [], []
+        for label, sources in shuffled:
+            testCount = int(len(sources) * testRatio)
+            test.extend((label, source) for source in sources[:testCount])
+            train.extend((label, source) for source in sources[testCount:])
+        yield train, test
+        return
+    for fold in range(folds):
+        train, test = [], []
+        for label, sources in shuffled:
+            for index, source in enumerate(sources):
+                (test if index % folds == fold else train).append((label, source))
+        yield train, test
+
+
+# 训练一折并逐张识别测试集与陌生人的人脸，返回该折的原始结果
+def evaluateFold(train, test, strangers, datasets, workDir, equalizeHist=False, workers=None,
+                 detectorConfig=DETECTOR_CONFIG, trainerConfig=TRAINER_CONFIG):
+    modelPath = os.path.join(workDir, 'model.lbph')
+    job = EvaluationJob(train, datasets, modelPath, os.path.join(workDir, 'featureCache.db'),
+                        equalizeHist=equalizeHist, workers=workers, detectorConfig=detectorConfig,
+                        trainerConfig=trainerConfig)
+    report = job.run()
+    modelPath = resolveModelPath(modelPath)
+    result = {'trainTime': report['total'], 'trainFaces': report.get('faces', 0),
+              'modelSize': os.path.getsize(modelPath), 'latencies': [], 'genuine': [], 'strangers': [],
+              'undetected': 0}
+
+    start = time.perf_counter()
+    recognizer = loadRecognizer(modelPath)
+    result['loadTime'] = time.perf_counter() - start
+
+    # 与核心框架相同：检测到的人脸区域直接交给识别器
+    for label, source in test + [(None, source) for source in strangers]:
+        image = loadSource(source)
+        face = detectFace(image, job.faceDetector, equalizeHist)[0] if image is not None else None
+        if face is None:
+            result['undetected'] += 1
+            continue
+        start = time.perf_counter()
+        predicted, confidence = recognizer.predict(face)
+        result['latencies'].append(time.perf_counter() - start)
+        if label is None:
+            result['strangers'].append(confidence)
+        else:
+            result['genuine'].append((label, predicted, confidence))
+    # 释放模型文件的内存映射后再删除
+    del recognizer
+    os.remove(modelPath)
+    return result
+
+
+# 各阈值下的指标，置信度评分小于阈值视为识别为对应用户
+#   accuracy           已注册用户被正确识别、陌生人被拒绝的比例
+#   far                陌生人被误认为已注册用户的比例
+#   frr                已注册用户未被正确识别的比例（被拒绝或被识别为他人）
+#   misidentification  已注册用户被识别为他人的比例
+def thresholdReport(genuine, strangers, thresholds=THRESHOLDS):
+    rows = []
+    for threshold in thresholds:
+        accepted = [(label, predicted) for label, predicted, confidence in genuine if confidence < threshold]
+        correct = sum(label == predicted for label, predicted in accepted)
+        strangerAccepted = sum(confidence < threshold for confidence in strangers)
+        total = len(genuine) + len(strangers)
+        rows.append({
+            'threshold': threshold,
+            'accuracy': (correct + len(strangers) - strangerAccepted) / total if total else None,
+            'far': strangerAccepted / len(strangers) if strangers else None,
+            'frr': (len(genuine) - correct) / len(genuine) if genuine else None,
+            'misidentification': (len(accepted) - correct) / len(genuine) if genuine else None,
+        })
+    return rows
+
+
+# 汇总同一人脸库规模下各折的结果
+def summarize(gallerySize, foldResults, thresholds):
+    genuine = [item for result in foldResults for item in result['genuine']]
+    strangers = [item for result in foldResults for item in result['strangers']]
+    latencies = np.array([item for result in foldResults for item in result['latencies']]) * 1000
+    return {
+        'gallerySize': gallerySize,
+        'folds': len(foldResults),
+        'genuineProbes': len(genuine),
+        'strangerProbes': len(strangers),
+        'undetected': sum(result['undetected'] for result in foldResults),
+        'rank1': sum(label == predicted for label, predicted, confidence in genuine) / len(genuine)
+        if genuine else None,
+        'latencyMs': {'mean': float(latencies.mean()), 'p50': float(np.percentile(latencies, 50)),
+                      'p95': float(np.percentile(latencies, 95))} if len(latencies) else None,
+        'modelSize': int(np.mean([result['modelSize'] for result in foldResults])),
+        'loadTimeMs': float(np.mean([result['loadTime'] for result in foldResults])) * 1000,
+        'trainTime': float(np.mean([result['trainTime'] for result in foldResults])),
+        'thresholds': thresholdReport(genuine, strangers, thresholds),
+    }
+
+
+# 评估全部人脸库规模，gallerySizes为空时只评估全部已注册用户；progress为进度输出回调
+def evaluate(datasets, folds=0, testRatio=TEST_RATIO, strangerRatio=STRANGER_RATIO, gallerySizes=(),
+             thresholds=THRESHOLDS, equalizeHist=False, workers=None, seed=0, detectorConfig=DETECTOR_CONFIG,
+             trainerConfig=TRAINER_CONFIG, progress=print):
+    users, strangers = splitUsers(datasets, strangerRatio, seed)
+    sizes = sorted({size for size in gallerySizes if 0 < size < len(users)} | {len(users)})
+    progress('已注册用户{}名，陌生人样本{}张，评估规模：{}'.format(
+        len(users), len(strangers), '、'.join(str(size) for size in sizes)))
+    workDir = tempfile.mkdtemp(prefix='evaluation-')
+    summaries = []
+    try:
+        for size in sizes:
+            foldResults = []
+            for fold, (train, test) in enumerate(splitFolds(users[:size], folds, testRatio, seed), 1):
+                if not test:
+                    raise ValueError('测试集为空，请增加样本数或test_ratio')
+                result = evaluateFold(train, test, strangers, datasets, workDir, equalizeHist, workers,
+                                      detectorConfig, trainerConfig)
+                progress('规模{} 第{}折：训练{}张（{}张人脸，{:.1f}s），识别{}张，未检测到人脸{}张'.format(
+                    size, fold, len(train), result['trainFaces'], result['trainTime'],
+                    len(result['genuine']) + len(result['strangers']), result['undetected']))
+                foldResults.append(result)
+            summaries.append(summarize(size, foldResults, thresholds))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    return summaries
+
+
+def formatRatio(value):
+    return '{:6.1%}'.format(value) if value is not None else '     -'
+
+
+# 格式化评估报告，operatingThreshold为核心框架当前使用的置信度阈值
+def formatReport(summaries, operatingThreshold):
+    lines = []
+    for summary in summaries:
+        latency = summary['latencyMs'] or {'mean': 0.0, 'p50': 0.0, 'p95': 0.0}
+        lines.append('人脸库规模：{}名用户（{}折），已注册用户识别{}次，陌生人识别{}次，未检测到人脸{}张'.format(
+            summary['gallerySize'], summary['folds'], summary['genuineProbes'], summary['strangerProbes'],
+            summary['undetected']))
+        lines.append('  Rank-1准确率{}，识别耗时 平均{:.2f}ms / P50 {:.2f}ms / P95 {:.2f}ms'.format(
+            formatRatio(summary['rank1']).strip(), latency['mean'], latency['p50'], latency['p95']))
+        lines.append('  模型{:.1f}KB，加载{:.1f}ms，训练{:.2f}s'.format(
+            summary['modelSize'] / 1024, summary['loadTimeMs'], summary['trainTime']))
+        lines.append('  阈值   准确率    FAR    FRR  误识为他人')
+        for row in summary['thresholds']:
+            lines.append('  {:>4}  {}  {} {}     {}{}'.format(
+                row['threshold'], formatRatio(row['accuracy']), formatRatio(row['far']), formatRatio(row['frr']),
+                formatRatio(row['misidentification']), '  <- 当前阈值' if row['threshold'] == operatingThreshold else ''))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='评估人脸识别模型的准确率与耗时')
+    parser.add_argument('--datasets', default='./datasets')
+    parser.add_argument('--folds', type=int, default=0, help='k折交叉验证的折数，默认按test_ratio留出')
+    parser.add_argument('--test-ratio', type=float, default=TEST_RATIO)
+    parser.add_argument('--stranger-ratio', type=float, default=STRANGER_RATIO, help='作为陌生人留出的用户比例')
+    parser.add_argument('--gallery-sizes', type=int, nargs='*', default=[],
+                        help='另外评估的人脸库规模（已注册用户数），全部已注册用户总会评估')
+    parser.add_argument('--thresholds', type=int, nargs='+', default=None,
+                        help='评估的置信度阈值，默认20~120及core.cfg中的阈值')
+    parser.add_argument('--equalize-hist', action='store_true', help='执行直方图均衡化')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数，默认为CPU核心数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--detector-config', default=DETECTOR_CONFIG)
+    parser.add_argument('--trainer-config', default=TRAINER_CONFIG)
+    parser.add_argument('--output', help='将评估结果写入JSON文件')
+    parser.add_argument('--min-accuracy', type=float, default=None,
+                        help='全部用户规模下当前阈值的准确率低于该值时以状态码2退出，用于部署前检查')
+    args = parser.parse_args()
+
+    logging.config.fileConfig('./config/logging.cfg')
+
+    cfg = ConfigParser()
+    cfg.read(CORE_CONFIG, encoding='utf-8-sig')
+    operatingThreshold = cfg.getint('recognition', 'confidence_threshold', fallback=50)
+    thresholds = sorted(set(args.thresholds or THRESHOLDS) | {operatingThreshold})
+
+    try:
+        summaries = evaluate(args.datasets, args.folds, args.test_ratio, args.stranger_ratio, args.gallery_sizes,
+                             thresholds, args.equalize_hist, args.workers, args.seed, args.detector_config,
+                             args.trainer_config)
+    except KeyboardInterrupt:
+        print('评估已取消')
+        sys.exit(130)
+    except Exception as e:
+        logging.error('评估失败：{}'.format(e))
+        print('评估失败：{}'.format(e))
+        sys.exit(1)
+
+    print(formatReport(summaries, operatingThreshold))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'operatingThreshold': operatingThreshold, 'summaries': summaries}, f, ensure_ascii=False,
+                      indent=2)
+
+    if args.min_accuracy is not None:
+        row = next(row for row in summaries[-1]['thresholds'] if row['threshold'] == operatingThreshold)
+        if row['accuracy'] is None or row['accuracy'] < args.min_accuracy:
+            print('准确率{}低于要求的{:.1%}'.format(formatRatio(row['accuracy']).strip(), args.min_accuracy))
+            sys.exit(2)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+
+from collections import OrderedDict
+
+# 人脸库数据库访问层：DataRecord、DataManage、Core及训练进程共用
+# 每个进程每个数据库文件只保留一个连接池，连接长期复用（sqlite3按连接缓存已编译的语句），
+# 数据库以WAL模式运行，读写互不阻塞，Core与DataManage可以同时打开同一数据库
+
+POOL_SIZE = 4
+BUSY_TIMEOUT = 5.0  # 等待写锁的最长时间（秒）
+CACHED_STATEMENTS = 64
+
+# 数据库结构迁移脚本，第n条脚本执行后 PRAGMA user_version 为n
+# 已有数据库中的表使用 IF NOT EXISTS，旧版本创建的数据库可以直接升级
+MIGRATIONS = [
+    '''CREATE TABLE IF NOT EXISTS users (
+       stu_id VARCHAR(12) PRIMARY KEY NOT NULL,
+       face_id INTEGER DEFAULT -1,
+       cn_name VARCHAR(10) NOT NULL,
+       en_name VARCHAR(16) NOT NULL,
+       created_time DATE DEFAULT (date('now','localtime'))
+       );
+    ''',
+    '''CREATE INDEX IF NOT EXISTS users_face_id ON users (face_id);
+    ''',
+    '''CREATE TABLE IF NOT EXISTS face_id_sequence (last_id INTEGER NOT NULL);
+    ''',
+    '''CREATE INDEX IF NOT EXISTS users_cn_name ON users (cn_name);
+       CREATE INDEX IF NOT EXISTS users_en_name ON users (en_name);
+    ''',
+    '''CREATE TABLE IF NOT EXISTS recognition_events (
+       id INTEGER PRIMARY KEY,
+       camera TEXT NOT NULL,
+       track_id INTEGER NOT NULL,
+       face_id INTEGER,
+       stu_id VARCHAR(12),
+       confidence REAL NOT NULL,
+       first_seen REAL NOT NULL,
+       last_seen REAL NOT NULL,
+       frames INTEGER NOT NULL
+       );
+       CREATE INDEX IF NOT EXISTS recognition_events_first_seen ON recognition_events (first_seen);
+       CREATE INDEX IF NOT EXISTS recognition_events_stu_id ON recognition_events (stu_id, first_seen);
+    ''',
+    '''CREATE TABLE IF NOT EXISTS attendance_daily (
+       day TEXT NOT NULL,
+       stu_id VARCHAR(12) NOT NULL,
+       first_seen REAL NOT NULL,
+       last_seen REAL NOT NULL,
+       count INTEGER NOT NULL,
+       PRIMARY KEY (day, stu_id)
+       ) WITHOUT ROWID;
+       CREATE INDEX IF NOT EXISTS attendance_daily_stu_id ON attendance_daily (stu_id, day);
+    ''',
+    '''ALTER TABLE recognition_events ADD COLUMN snapshot TEXT;
+    ''',
+]
+
+# 用户表的列，顺序与users表一致；分页查询只允许按这些列排序
+USER_COLUMNS = ('stu_id', 'face_id', 'cn_name', 'en_name', 'created_time')
+
+# 常用语句，写成常量以便在各连接的语句缓存中复用
+SQL_COUNT_USERS = 'SELECT Count(*) FROM users'
+SQL_SELECT_USERS = 'SELECT {} FROM users'.format(', '.join(USER_COLUMNS))
+SQL_SELECT_USER = SQL_SELECT_USERS + ' WHERE stu_id=?'
+SQL_SELECT_USER_BY_FACE_ID = SQL_SELECT_USERS + ' WHERE face_id=?'
+SQL_INSERT_USER = 'INSERT INTO users (stu_id, cn_name, en_name) VALUES (?, ?, ?)'
+SQL_UPDATE_USER = 'UPDATE users SET cn_name=?, en_name=? WHERE stu_id=?'
+SQL_DELETE_USER = 'DELETE FROM users WHERE stu_id=?'
+SQL_UPDATE_FACE_ID = 'UPDATE users SET face_id=? WHERE stu_id=?'
+
+pools = {}
+poolsLock = threading.Lock()
+
+
+# 线程安全的连接池，连接在借出期间只被一个线程使用
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        # isolation_level=None：不隐式开启事务，只读查询不会长期占用锁，写操作显式使用transaction()
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                try:
+                    return self.connect()
+                except Exception:
+                    self.created -= 1
+                    raise
+        return self.idle.get()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.created -= 1
+
+
+class FaceBase:
+    def __init__(self, path, poolSize=POOL_SIZE):
+        self.path = path
+        self.pool = ConnectionPool(path, poolSize)
+        self.migrate()
+
+    # 借出一个连接，用完自动归还
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.pool.acquire()
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    # 写事务：BEGIN IMMEDIATE 立即获取写锁，避免读事务升级为写事务时的死锁，异常时回滚
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    def query(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def queryOne(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def execute(self, sql, params=()):
+        with self.transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    # 批量写入，全部语句在同一事务中提交
+    def executemany(self, sql, seq_of_params):
+        with self.transaction() as conn:
+            return conn.executemany(sql, seq_of_params).rowcount
+
+    # 执行尚未执行的迁移脚本
+    def migrate(self):
+        with self.transaction() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for index in range(version, len(MIGRATIONS)):
+                for statement in MIGRATIONS[index].split(';'):
+                    if statement.strip():
+                        conn.execute(statement)
+            if version < len(MIGRATIONS):
+                conn.execute('PRAGMA user_version={}'.format(len(MIGRATIONS)))
+
+    def countUsers(self):
+        return self.queryOne(SQL_COUNT_USERS)[0]
+
+    def listUsers(self):
+        return self.query(SQL_SELECT_USERS)
+
+    def getUser(self, stu_id):
+        return self.queryOne(SQL_SELECT_USER, (stu_id,))
+
+    def getUserByFaceId(self, face_id):
+        return self.queryOne(SQL_SELECT_USER_BY_FACE_ID, (face_id,))
+
+    # 学号、姓名或汉语拼音前缀匹配的查询条件
+    # 使用区间比较而非LIKE，三个条件都能走索引（SQLite会对OR的各分支分别使用索引）
+    @staticmethod
+    def prefixFilter(prefix):
+        if not prefix:
+            return '', ()
+        upper = prefix + '\U0010ffff'
+        return (' WHERE (stu_id >= ? AND stu_id < ?) OR (cn_name >= ? AND cn_name < ?)'
+                ' OR (en_name >= ? AND en_name < ?)', (prefix, upper) * 3)
+
+    # 前缀匹配的用户数
+    def countMatchedUsers(self, prefix=None):
+        where, params = FaceBase.prefixFilter(prefix)
+        return self.queryOne(SQL_COUNT_USERS + where, params)[0]
+
+    # 分页查询用户，按orderBy排序（相同时按学号），prefix为学号、姓名或汉语拼音前缀
+    def searchUsers(self, prefix=None, orderBy='stu_id', descending=False, limit=-1, offset=0):
+        if orderBy not in USER_COLUMNS:
+            raise ValueError('不支持的排序列：{}'.format(orderBy))
+        where, params = FaceBase.prefixFilter(prefix)
+        order = ' DESC' if descending else ''
+        orderBy = ', '.join('{}{}'.format(column, order) for column in OrderedDict.fromkeys((orderBy, 'stu_id')))
+        return self.query(SQL_SELECT_USERS + where + ' ORDER BY ' + orderBy + ' LIMIT ? OFFSET ?',
+                          params + (limit, offset))
+
+    def insertUser(self, stu_id, cn_name, en_name):
+        self.execute(SQL_INSERT_USER, (stu_id, cn_name, en_name))
+
+    def updateUser(self, stu_id, cn_name, en_name):
+        self.execute(SQL_UPDATE_USER, (cn_name, en_name, stu_id))
+
+    def deleteUser(self, stu_id):
+        return self.execute(SQL_DELETE_USER, (stu_id,))
+
+    # 已存在于数据库中的学号，分批查询以免超出SQLite的参数个数限制
+    def existingStuIds(self, stu_ids, batchSize=500):
+        stu_ids = list(stu_ids)
+        existing = set()
+        for start in range(0, len(stu_ids), batchSize):
+            batch = stu_ids[start:start + batchSize]
+            sql = 'SELECT stu_id FROM users WHERE stu_id IN ({})'.format(', '.join('?' * len(batch)))
+            existing.update(row[0] for row in self.query(sql, batch))
+        return existing
+
+    # 批量新增或更新用户，users为 (stu_id, cn_name, en_name) 列表，全部在同一事务中提交
+    # 已存在的用户只更新姓名，face_id与注册时间不变
+    def upsertUsers(self, users):
+        with self.transaction() as conn:
+            conn.executemany('INSERT OR IGNORE INTO users (stu_id, cn_name, en_name) VALUES (?, ?, ?)', users)
+            conn.executemany(SQL_UPDATE_USER, [(cn_name, en_name, stu_id) for stu_id, cn_name, en_name in users])
+
+    # 为尚未分配face_id的用户批量分配face_id，返回 {stu_id: face_id}
+    # 已分配的face_id不会被重新编号，已删除用户的face_id也不会被复用
+    def allocateFaceIds(self, stu_ids):
+        if not stu_ids:
+            return {}
+        with self.transaction() as conn:
+            ret = conn.execute('SELECT last_id FROM face_id_sequence').fetchone()
+            lastId = ret[0] if ret else 0
+            lastId = max(lastId, conn.execute('SELECT MAX(face_id) FROM users').fetchone()[0] or 0)
+            faceIds = {stu_id: lastId + index + 1 for index, stu_id in enumerate(stu_ids)}
+            conn.executemany(SQL_UPDATE_FACE_ID, [(face_id, stu_id) for stu_id, face_id in faceIds.items()])
+            lastId += len(stu_ids)
+            if ret:
+                conn.execute('UPDATE face_id_sequence SET last_id=?', (lastId,))
+            else:
+                conn.execute('INSERT INTO face_id_sequence (last_id) VALUES (?)', (lastId,))
+        return faceIds
+
+    def close(self):
+        self.pool.close()
+
+
+# 获取数据库的共享实例，同一进程内同一数据库文件只创建一次
+# 以进程号区分，训练子进程不会复用父进程fork时继承下来的连接
+def getFaceBase(path):
+    key = (os.getpid(), os.path.abspath(path))
+    with poolsLock:
+        faceBase = pools.get(key)
+        if faceBase is None:
+            faceBase = FaceBase(path)
+            pools[key] = faceBase
+        return faceBase
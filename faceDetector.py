@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+import numpy as np
+
+import argparse
+import csv
+import logging
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+
+# 人脸检测：可替换的检测后端及高分辨率画面的分块并行检测
+# 各后端实现相同的接口 detect(gray, scale) -> [(x, y, w, h)]，由 config/detector.cfg 选择，core、dataRecord、trainer共用：
+#   haar  Haar级联分类器（默认），速度快，对侧脸、光照敏感
+#   lbp   LBP级联分类器，比Haar更快，误检略多
+#   hog   dlib HOG + 线性SVM，对正脸召回率高，速度较慢，最小人脸约80像素
+#   dnn   OpenCV DNN加载的SSD（ResNet-10）模型，召回率最高，对侧脸、遮挡更稳健，CPU开销最大
+# 配置的后端无法加载（缺少dlib或模型文件）时，loadDetector记录错误并改用默认的Haar检测器
+# 分块检测将画面切分为相互重叠的小块，重叠宽度不小于最大人脸尺寸，保证每张人脸至少完整地落在一个小块中；
+# 各小块在线程池中并行检测（OpenCV检测期间释放GIL），跨越小块边界的重复结果用非极大值抑制合并
+
+DETECTOR_CONFIG = './config/detector.cfg'
+BACKENDS = ('haar', 'lbp', 'hog', 'dnn')
+BACKEND = 'haar'
+
+CASCADE = './haarcascades/haarcascade_frontalface_default.xml'
+LBP_CASCADE = './lbpcascades/lbpcascade_frontalface.xml'
+SCALE_FACTOR = 1.3
+MIN_NEIGHBORS = 5
+HOG_UPSAMPLE = 0  # 检测前将图像放大的次数，每放大一次可检出的最小人脸缩小一半，耗时约增至4倍
+DNN_PROTOTXT = './models/deploy.prototxt'
+DNN_MODEL = './models/res10_300x300_ssd_iter_140000.caffemodel'
+DNN_INPUT_SIZE = 300
+DNN_CONFIDENCE = 0.5
+MIN_FACE = 90
+MAX_FACE = 0  # 0表示不限
+TILE_SIZE = 960
+TILE_MAX_FACE = 240  # 未设置最大人脸尺寸时小块间的重叠宽度，只影响分块，不过滤检测结果
+WORKERS = 4
+NMS_THRESHOLD = 0.3
+
+
+# 检测后端基类：负责缩放及人脸尺寸过滤，子类实现detectFaces及loadModel
+# 模型按线程延迟加载，每个线程使用各自的实例；序列化时不包含已加载的模型，可作为参数传给工作进程
+class FaceDetectorBase:
+    name = None
+
+    def __init__(self, minFace=MIN_FACE, maxFace=MAX_FACE):
+        self.minFace = minFace
+        self.maxFace = maxFace
+        self.local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def model(self):
+        model = getattr(self.local, 'model', None)
+        if model is None:
+            model = self.local.model = self.loadModel()
+        return model
+
+    # 检测灰度图中的人脸，返回 [(x, y, w, h)]；scale小于1时先缩小再检测，结果换算回原图坐标
+    def detect(self, gray, scale=1.0):
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        minSize = max(int(self.minFace * scale), 1)
+        maxSize = int(self.maxFace * scale) if self.maxFace else 0
+        faces = [face for face in self.detectFaces(gray, minSize, maxSize)
+                 if min(face[2], face[3]) >= minSize and (not maxSize or max(face[2], face[3]) <= maxSize)]
+        if scale < 1.0:
+            return [tuple(int(value / scale) for value in face) for face in faces]
+        return [tuple(int(value) for value in face) for face in faces]
+
+    # 影响检测结果的全部参数，用作特征缓存键的一部分
+    def describe(self):
+        params = {'backend': self.name, 'minSize': (self.minFace, self.minFace)}
+        if self.maxFace:
+            params['maxSize'] = (self.maxFace, self.maxFace)
+        return params
+
+    # 在当前线程加载一次模型，无法加载时抛出IOError、ImportError或cv2.error
+    def check(self):
+        self.loadModel()
+
+    def close(self):
+        pass
+
+
+# 级联分类器（Haar、LBP）
+class CascadeDetector(FaceDetectorBase):
+    def __init__(self, cascade=CASCADE, scaleFactor=SCALE_FACTOR, minNeighbors=MIN_NEIGHBORS, minFace=MIN_FACE,
+                 maxFace=MAX_FACE, name='haar'):
+        super(CascadeDetector, self).__init__(minFace, maxFace)
+        self.name = name
+        self.cascade = cascade
+        self.scaleFactor = scaleFactor
+        self.minNeighbors = minNeighbors
+
+    def loadModel(self):
+        classifier = cv2.CascadeClassifier(self.cascade)
+        if classifier.empty():
+            raise IOError('无法加载级联分类器{}'.format(self.cascade))
+        return classifier
+
+    def detectFaces(self, gray, minSize, maxSize):
+        return self.model().detectMultiScale(gray, self.scaleFactor, self.minNeighbors,
+                                             minSize=(minSize, minSize), maxSize=(maxSize, maxSize))
+
+    # Haar后端的参数格式与早期版本的特征缓存键一致，默认配置下已有缓存继续有效
+    def describe(self):
+        detect = {'scaleFactor': self.scaleFactor, 'minNeighbors': self.minNeighbors,
+                  'minSize': (self.minFace, self.minFace)}
+        if self.maxFace:
+            detect['maxSize'] = (self.maxFace, self.maxFace)
+        params = {'cascade': os.path.basename(self.cascade), 'detect': detect}
+        if self.name != 'haar':
+            params['backend'] = self.name
+        return params
+
+
+# dlib HOG检测器，dlib在首次使用时导入
+class HogDetector(FaceDetectorBase):
+    name = 'hog'
+
+    def __init__(self, upsample=HOG_UPSAMPLE, minFace=MIN_FACE, maxFace=MAX_FACE):
+        super(HogDetector, self).__init__(minFace, maxFace)
+        self.upsample = upsample
+
+    def loadModel(self):
+        import dlib
+        return dlib.get_frontal_face_detector()
+
+    def detectFaces(self, gray, minSize, maxSize):
+        height, width = gray.shape[:2]
+        faces = []
+        for rect in self.model()(gray, self.upsample):
+            left, top = max(rect.left(), 0), max(rect.top(), 0)
+            right, bottom = min(rect.right(), width), min(rect.bottom(), height)
+            if right > left and bottom > top:
+                faces.append((left, top, right - left, bottom - top))
+        return faces
+
+    def describe(self):
+        params = super(HogDetector, self).describe()
+        params['upsample'] = self.upsample
+        return params
+
+
+# OpenCV DNN检测器（Caffe格式的SSD模型），输入为BGR图像，灰度图先转换
+class DnnDetector(FaceDetectorBase):
+    name = 'dnn'
+
+    def __init__(self, prototxt=DNN_PROTOTXT, model=DNN_MODEL, confidence=DNN_CONFIDENCE,
+                 inputSize=DNN_INPUT_SIZE, minFace=MIN_FACE, maxFace=MAX_FACE):
+        super(DnnDetector, self).__init__(minFace, maxFace)
+        self.prototxt = prototxt
+        self.modelPath = model
+        self.confidence = confidence
+        self.inputSize = inputSize
+
+    def loadModel(self):
+        for path in (self.prototxt, self.modelPath):
+            if not os.path.isfile(path):
+                raise IOError('找不到DNN模型文件{}'.format(path))
+        return cv2.dnn.readNetFromCaffe(self.prototxt, self.modelPath)
+
+    def detectFaces(self, gray, minSize, maxSize):
+        height, width = gray.shape[:2]
+        image = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR) if gray.ndim == 2 else gray
+        net = self.model()
+        net.setInput(cv2.dnn.blobFromImage(image, 1.0, (self.inputSize, self.inputSize), (104.0, 177.0, 123.0)))
+        detections = net.forward().reshape(-1, 7)
+        faces = []
+        for confidence, left, top, right, bottom in detections[:, 2:7]:
+            if confidence < self.confidence:
+                continue
+            left, top = max(int(left * width), 0), max(int(top * height), 0)
+            right, bottom = min(int(right * width), width), min(int(bottom * height), height)
+            if right > left and bottom > top:
+                faces.append((left, top, right - left, bottom - top))
+        return faces
+
+    def describe(self):
+        params = super(DnnDetector, self).describe()
+        params.update({'model': os.path.basename(self.modelPath), 'confidence': self.confidence,
+                       'inputSize': self.inputSize})
+        return params
+
+
+# 切分小块，返回 [(x, y, w, h)]；每行、列的小块数取覆盖画面所需的最小值，再均分为等宽的小块，相邻小块重叠overlap像素
+def tileLayout(width, height, tileSize, overlap):
+    if tileSize <= overlap:
+        raise ValueError('小块尺寸{}须大于重叠宽度（最大人脸尺寸）{}'.format(tileSize, overlap))
+
+    def spans(length):
+        if length <= tileSize:
+            return [(0, length)]
+        count = -(-(length - overlap) // (tileSize - overlap))
+        size = -(-(length + (count - 1) * overlap) // count)
+        return [(min(index * (size - overlap), length - size), size) for index in range(count)]
+
+    return [(x, y, w, h) for y, h in spans(height) for x, w in spans(width)]
+
+
+# 非极大值抑制：按面积从大到小保留，与已保留结果的IoU超过threshold，或大部分落在已保留结果内的予以合并
+def nonMaxSuppression(faces, threshold=NMS_THRESHOLD):
+    kept = []
+    for face in sorted(faces, key=lambda face: face[2] * face[3], reverse=True):
+        x, y, w, h = face
+        isDuplicate = False
+        for k_x, k_y, k_w, k_h in kept:
+            i_w = min(x + w, k_x + k_w) - max(x, k_x)
+            i_h = min(y + h, k_y + k_h) - max(y, k_y)
+            if i_w <= 0 or i_h <= 0:
+                continue
+            intersection = i_w * i_h
+            if (intersection / (w * h + k_w * k_h - intersection) > threshold or
+                    intersection / min(w * h, k_w * k_h) > 0.7):
+                isDuplicate = True
+                break
+        if not isDuplicate:
+            kept.append(face)
+    return kept
+
+
+# 分块并行检测，画面不超过一个小块时直接检测
+# 重叠宽度取检测器的最大人脸尺寸，未设置时取TILE_MAX_FACE；更大的人脸只要不跨越小块边界仍可检出
+class TiledDetector:
+    def __init__(self, detector, tileSize=TILE_SIZE, workers=WORKERS):
+        self.overlap = detector.maxFace or TILE_MAX_FACE
+        tileLayout(tileSize, tileSize, tileSize, self.overlap)  # 检查参数
+        self.detector = detector
+        self.tileSize = tileSize
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.layout = None
+        self.layoutShape = None
+
+    def detectTile(self, gray, tile, scale):
+        x, y, w, h = tile
+        return [(f_x + x, f_y + y, f_w, f_h) for f_x, f_y, f_w, f_h in
+                self.detector.detect(gray[y:y + h, x:x + w], scale)]
+
+    def detect(self, gray, scale=1.0):
+        height, width = gray.shape[:2]
+        if width <= self.tileSize and height <= self.tileSize:
+            return self.detector.detect(gray, scale)
+        if self.layoutShape != (height, width):
+            self.layout = tileLayout(width, height, self.tileSize, self.overlap)
+            self.layoutShape = (height, width)
+        faces = []
+        for result in self.executor.map(lambda tile: self.detectTile(gray, tile, scale), self.layout):
+            faces.extend(result)
+        return nonMaxSuppression(faces)
+
+    def describe(self):
+        return self.detector.describe()
+
+    def check(self):
+        self.detector.check()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+# 按配置创建人脸检测器，读取 [detection] 段；allowTiled为False时忽略分块检测设置（如训练时的小图）
+def createDetector(cfg, section='detection', allowTiled=True):
+    backend = cfg.get(section, 'backend', fallback=BACKEND).strip().lower()
+    minFace = cfg.getint(section, 'min_face', fallback=MIN_FACE)
+    maxFace = cfg.getint(section, 'max_face', fallback=MAX_FACE)
+    if backend in ('haar', 'lbp'):
+        detector = CascadeDetector(cfg.get(section, backend + '_cascade',
+                                           fallback=CASCADE if backend == 'haar' else LBP_CASCADE),
+                                   cfg.getfloat(section, 'scale_factor', fallback=SCALE_FACTOR),
+                                   cfg.getint(section, 'min_neighbors', fallback=MIN_NEIGHBORS),
+                                   minFace, maxFace, backend)
+    elif backend == 'hog':
+        detector = HogDetector(cfg.getint(section, 'hog_upsample', fallback=HOG_UPSAMPLE), minFace, maxFace)
+    elif backend == 'dnn':
+        detector = DnnDetector(cfg.get(section, 'dnn_prototxt', fallback=DNN_PROTOTXT),
+                               cfg.get(section, 'dnn_model', fallback=DNN_MODEL),
+                               cfg.getfloat(section, 'dnn_confidence', fallback=DNN_CONFIDENCE),
+                               cfg.getint(section, 'dnn_input_size', fallback=DNN_INPUT_SIZE), minFace, maxFace)
+    else:
+        raise ValueError('未知的人脸检测后端{}，可选：{}'.format(backend, '、'.join(BACKENDS)))
+    if allowTiled and cfg.getboolean(section, 'tiled', fallback=False):
+        return TiledDetector(detector, cfg.getint(section, 'tile_size', fallback=TILE_SIZE),
+                             cfg.getint(section, 'workers', fallback=WORKERS))
+    return detector
+
+
+# 读取检测器配置文件创建人脸检测器，配置文件不存在时使用默认的Haar检测器
+# 配置的后端无法加载时记录错误并改用默认的Haar检测器，其余参数（人脸尺寸、分块检测）保持不变
+def loadDetector(path=DETECTOR_CONFIG, allowTiled=True):
+    cfg = ConfigParser()
+    cfg.read(path, encoding='utf-8-sig')
+    detector = createDetector(cfg, allowTiled=allowTiled)
+    try:
+        detector.check()
+    except (IOError, ImportError, cv2.error) as e:
+        logging.error('人脸检测后端{}不可用，改用默认的Haar检测器：{}'.format(
+            cfg.get('detection', 'backend', fallback=BACKEND), e))
+        cfg.read_dict({'detection': {'backend': BACKEND, 'haar_cascade': CASCADE}})
+        detector = createDetector(cfg, allowTiled=allowTiled)
+    return detector
+
+
+# 以默认参数创建指定后端的检测器
+def createBackend(backend, minFace=MIN_FACE, maxFace=MAX_FACE):
+    cfg = ConfigParser()
+    cfg.read_dict({'detection': {'backend': backend, 'min_face': str(minFace), 'max_face': str(maxFace)}})
+    return createDetector(cfg, allowTiled=False)
+
+
+# 交并比
+def intersectionOverUnion(a, b):
+    i_w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    i_h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if i_w <= 0 or i_h <= 0:
+        return 0.0
+    intersection = i_w * i_h
+    return intersection / (a[2] * a[3] + b[2] * b[3] - intersection)
+
+
+# 读取标注的测试集：目录下的labels.csv，每行 文件名,x,y,w,h，一张图片有多张人脸时写多行，坐标留空表示无人脸
+# 返回 [(图片路径, [(x, y, w, h)])]
+def loadFixtures(fixtureDir):
+    labels = {}
+    with open(os.path.join(fixtureDir, 'labels.csv'), newline='', encoding='utf-8-sig') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#') or row[0] == 'file':
+                continue
+            boxes = labels.setdefault(os.path.join(fixtureDir, row[0]), [])
+            if len(row) >= 5 and all(value.strip() for value in row[1:5]):
+                boxes.append(tuple(int(value) for value in row[1:5]))
+    return sorted(labels.items())
+
+
+# 在标注测试集上评估检测后端：每帧耗时、召回率（标注人脸被IoU不低于iouThreshold的结果命中的比例）与精确率
+def evaluateBackend(detector, fixtures, iouThreshold=0.5):
+    elapsed = 0.0
+    truePositives = detections = groundTruth = 0
+    for path, boxes in fixtures:
+        image = cv2.imread(path)
+        if image is None:
+            raise IOError('无法读取图片{}'.format(path))
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        start = time.perf_counter()
+        faces = detector.detect(gray)
+        elapsed += time.perf_counter() - start
+        unmatched = list(faces)
+        for box in boxes:
+            best = max(unmatched, key=lambda face: intersectionOverUnion(box, face), default=None)
+            if best is not None and intersectionOverUnion(box, best) >= iouThreshold:
+                unmatched.remove(best)
+                truePositives += 1
+        detections += len(faces)
+        groundTruth += len(boxes)
+    return {'ms': elapsed / max(len(fixtures), 1) * 1000,
+            'recall': truePositives / groundTruth if groundTruth else None,
+            'precision': truePositives / detections if detections else None,
+            'faces': groundTruth, 'detections': detections}
+
+
+# 依次评估各后端，无法加载的后端（缺少dlib或模型文件）返回 (backend, None, 原因)
+def benchmarkBackends(fixtures, backends=BACKENDS, minFace=MIN_FACE, iouThreshold=0.5):
+    results = []
+    for backend in backends:
+        detector = createBackend(backend, minFace)
+        try:
+            # 预热，加载模型
+            detector.detect(cv2.cvtColor(cv2.imread(fixtures[0][0]), cv2.COLOR_BGR2GRAY))
+        except (IOError, ImportError, cv2.error) as e:
+            results.append((backend, None, str(e)))
+            continue
+        results.append((backend, evaluateBackend(detector, fixtures, iouThreshold), None))
+    return results
+
+
+# 基准测试：在各分辨率下比较单次检测与分块并行检测的吞吐量，两者使用相同的人脸尺寸范围
+def benchmark(image, resolutions, repeat, tileSize, workers, maxFace, backend=BACKEND):
+    results = []
+    for width, height in resolutions:
+        # 平铺测试图像而非缩放，人脸尺寸在各分辨率下保持不变
+        rows = -(-height // image.shape[0])
+        cols = -(-width // image.shape[1])
+        gray = cv2.cvtColor(np.ascontiguousarray(np.tile(image, (rows, cols, 1))[:height, :width]),
+                            cv2.COLOR_BGR2GRAY)
+        single = createBackend(backend, maxFace=maxFace)
+        tiled = TiledDetector(createBackend(backend, maxFace=maxFace), tileSize, workers)
+        row = [(width, height)]
+        for detector in (single, tiled):
+            detector.detect(gray)  # 预热，加载模型
+            start = time.perf_counter()
+            for _ in range(repeat):
+                faces = detector.detect(gray)
+            elapsed = (time.perf_counter() - start) / repeat
+            row.append((elapsed, len(faces)))
+        tiled.close()
+        results.append(row)
+    return results
+
+
+def formatRatio(value):
+    return '{:.1%}'.format(value) if value is not None else '-'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='人脸检测基准测试')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    backendsParser = subparsers.add_parser('backends', help='在标注测试集上比较各检测后端的速度与召回率')
+    backendsParser.add_argument('fixtures', help='测试集目录，包含图片及labels.csv（文件名,x,y,w,h）')
+    backendsParser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    backendsParser.add_argument('--min-face', type=int, default=MIN_FACE)
+    backendsParser.add_argument('--iou', type=float, default=0.5, help='判定命中的最小交并比')
+
+    tilesParser = subparsers.add_parser('tiles', help='比较单次检测与分块并行检测的吞吐量')
+    tilesParser.add_argument('image', help='测试图像，平铺到各分辨率后检测')
+    tilesParser.add_argument('--backend', choices=BACKENDS, default=BACKEND)
+    tilesParser.add_argument('--resolutions', nargs='+', default=['640x480', '1280x720', '1920x1080', '3840x2160'])
+    tilesParser.add_argument('--repeat', type=int, default=5)
+    tilesParser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    tilesParser.add_argument('--workers', type=int, default=WORKERS)
+    tilesParser.add_argument('--max-face', type=int, default=TILE_MAX_FACE)
+    args = parser.parse_args()
+
+    if args.command == 'backends':
+        try:
+            fixtures = loadFixtures(args.fixtures)
+        except (OSError, ValueError) as e:
+            print('无法读取测试集：{}'.format(e))
+            sys.exit(1)
+        if not fixtures:
+            print('测试集为空')
+            sys.exit(1)
+        print('测试集：{}张图片，{}张标注人脸'.format(len(fixtures), sum(len(boxes) for path, boxes in fixtures)))
+        for backend, result, reason in benchmarkBackends(fixtures, args.backends, args.min_face, args.iou):
+            if result is None:
+                print('{:<5} 跳过：{}'.format(backend, reason))
+                continue
+            print('{:<5} {:7.1f}ms/帧（{:6.1f}fps），召回率{}，精确率{}（检出{}，标注{}）'.format(
+                backend, result['ms'], 1000 / result['ms'] if result['ms'] else 0.0, formatRatio(result['recall']),
+                formatRatio(result['precision']), result['detections'], result['faces']))
+
+    elif args.command == 'tiles':
+        image = cv2.imread(args.image)
+        if image is None:
+            print('无法读取图像{}'.format(args.image))
+            sys.exit(1)
+        try:
+            resolutions = [tuple(int(value) for value in resolution.lower().split('x'))
+                           for resolution in args.resolutions]
+        except ValueError:
+            print('分辨率格式应为 宽x高')
+            sys.exit(1)
+        print('检测后端：{}，OpenCV线程数：{}，分块检测线程数：{}，小块尺寸：{}，最大人脸：{}'.format(
+            args.backend, cv2.getNumThreads(), args.workers, args.tile_size, args.max_face))
+        try:
+            results = benchmark(image, resolutions, args.repeat, args.tile_size, args.workers, args.max_face,
+                                args.backend)
+        except (IOError, ImportError) as e:
+            print('无法加载检测后端{}：{}'.format(args.backend, e))
+            sys.exit(1)
+        for (width, height), (singleTime, singleFaces), (tiledTime, tiledFaces) in results:
+            print('{}x{}：单次检测{:.1f}ms（{:.1f}fps，{}张人脸），分块检测{:.1f}ms（{:.1f}fps，{}张人脸），加速{:.2f}倍'.format(
+                width, height, singleTime * 1000, 1 / singleTime, singleFaces, tiledTime * 1000, 1 / tiledTime,
+                tiledFaces, singleTime / tiledTime))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import numpy as np
+
+import json
+import os
+import sqlite3
+
+# 人脸特征缓存：以图片路径、文件大小、修改时间及预处理参数为键，缓存提取出的LBPH直方图
+# 重新训练时只有新增或变动的图片才需要重新检测人脸、提取特征
+
+# 每累积多少条写入提交一次事务
+FLUSH_BATCH_SIZE = 500
+
+
+class FeatureCache:
+    def __init__(self, path, params):
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.paramsKey = json.dumps(params, sort_keys=True)
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS features (
+                             path TEXT NOT NULL,
+                             params TEXT NOT NULL,
+                             dataset TEXT NOT NULL,
+                             size INTEGER NOT NULL,
+                             mtime_ns INTEGER NOT NULL,
+                             histogram BLOB,
+                             PRIMARY KEY (path, params)
+                             )
+                          ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS features_dataset ON features (dataset)')
+        self.conn.commit()
+
+    # 缓存键统一使用规范化路径
+    # 打包数据集中的记录以 {打包文件路径}#{序号} 为键
+    @staticmethod
+    def normalize(path):
+        if '#' in path:
+            packPath, index = path.rsplit('#', 1)
+            return '{}#{}'.format(os.path.normpath(packPath), index)
+        return os.path.normpath(path)
+
+    # 缓存条目所属的人脸数据（用户目录或打包文件），用于按用户清除缓存
+    @staticmethod
+    def datasetOf(path):
+        if '#' in path:
+            return path.rsplit('#', 1)[0]
+        return os.path.dirname(path)
+
+    # 查询缓存，返回 (isHit, histogram, stat)
+    # 命中时histogram为None表示该图片中未检测到人脸；stat用于在put时写回本次查询到的文件状态
+    # 未传入stat时读取image_path的文件状态，stat只需提供st_size与st_mtime_ns
+    def get(self, image_path, stat=None):
+        if stat is None:
+            stat = os.stat(image_path)
+        row = self.conn.execute('SELECT size, mtime_ns, histogram FROM features WHERE path=? AND params=?',
+                                (FeatureCache.normalize(image_path), self.paramsKey)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            self.hits += 1
+            histogram = np.frombuffer(row[2], dtype=np.float32) if row[2] is not None else None
+            return True, histogram, stat
+        self.misses += 1
+        return False, None, stat
+
+    # 写入缓存，histogram为None表示未检测到人脸
+    def put(self, image_path, stat, histogram):
+        path = FeatureCache.normalize(image_path)
+        blob = np.asarray(histogram, dtype=np.float32).tobytes() if histogram is not None else None
+        self.pending.append((path, self.paramsKey, FeatureCache.datasetOf(path), stat.st_size, stat.st_mtime_ns,
+                             blob))
+        if len(self.pending) >= FLUSH_BATCH_SIZE:
+            self.flush()
+
+    # 批量提交写入
+    def flush(self):
+        if self.pending:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+            self.pending = []
+
+    # 删除某个用户人脸数据目录（或打包文件）的全部缓存
+    def evictDataset(self, subject_dir_path):
+        self.flush()
+        with self.conn:
+            self.conn.execute('DELETE FROM features WHERE dataset=?', (FeatureCache.normalize(subject_dir_path),))
+
+    # 仅保留指定人脸数据目录（或打包文件）的缓存，其余（已删除用户、其它预处理参数）全部清除
+    def retainDatasets(self, subject_dir_paths):
+        self.flush()
+        keep = {FeatureCache.normalize(path) for path in subject_dir_paths}
+        stale = [(dataset,) for (dataset,) in self.conn.execute('SELECT DISTINCT dataset FROM features')
+                 if dataset not in keep]
+        with self.conn:
+            self.conn.executemany('DELETE FROM features WHERE dataset=?', stale)
+            self.conn.execute('DELETE FROM features WHERE params<>?', (self.paramsKey,))
+
+    def close(self):
+        self.flush()
+        self.conn.close()
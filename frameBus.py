@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import numpy as np
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+from multiprocessing import shared_memory
+
+from metrics import formatBytes
+
+# 共享内存帧总线：进程间传递图像时只写入/读取共享内存，不经过pickle
+# 一块共享内存中包含头部、每个槽位的元数据及图像数据，组成环形缓冲区，一个写入者，任意多个读取者
+#   头部：魔数、槽位数、图像高、宽、通道数、最新帧序号
+#   槽位元数据：帧序号（写入中为-1）、时间戳、附加信息长度及附加信息（JSON，不超过META_SIZE字节）
+# 读取者按帧序号读取，槽位中的帧序号与期望不符时说明已被覆盖（读取过慢），由读取者自行跳帧
+
+MAGIC = 0x46524D42  # 'FRMB'
+SLOTS = 8
+META_SIZE = 240
+HEADER_FIELDS = 6  # magic, slots, height, width, channels, head
+SLOT_FIELDS = 3  # sequence, timestamp, metaLength
+WRITING = -1
+
+
+# 帧被覆盖或读取期间被改写
+class FrameOverwrittenError(Exception):
+    pass
+
+
+def layout(slots, shape):
+    frameSize = int(np.prod(shape))
+    headerSize = HEADER_FIELDS * 8
+    slotMetaSize = SLOT_FIELDS * 8 + META_SIZE
+    return headerSize, slotMetaSize, frameSize, headerSize + slots * (slotMetaSize + frameSize)
+
+
+class FrameBusBase:
+    def attach(self, shm, slots, shape):
+        self.shm = shm
+        self.slots = slots
+        self.shape = tuple(shape)
+        headerSize, slotMetaSize, frameSize, totalSize = layout(slots, shape)
+        self.header = np.ndarray((HEADER_FIELDS,), np.int64, shm.buf, 0)
+        self.sequences = []
+        self.timestamps = []
+        self.metaLengths = []
+        self.metas = []
+        self.frames = []
+        metaBase = headerSize
+        frameBase = headerSize + slots * slotMetaSize
+        for index in range(slots):
+            offset = metaBase + index * slotMetaSize
+            fields = np.ndarray((SLOT_FIELDS,), np.int64, shm.buf, offset)
+            self.sequences.append(fields[0:1])
+            self.timestamps.append(np.ndarray((1,), np.float64, shm.buf, offset + 8))
+            self.metaLengths.append(fields[2:3])
+            self.metas.append(shm.buf[offset + SLOT_FIELDS * 8:offset + slotMetaSize])
+            self.frames.append(np.ndarray(self.shape, np.uint8, shm.buf, frameBase + index * frameSize))
+
+    @property
+    def head(self):
+        return int(self.header[5])
+
+    def close(self):
+        # 先释放对共享内存的全部引用，否则无法关闭
+        self.header = self.sequences = self.timestamps = self.metaLengths = self.metas = self.frames = None
+        self.shm.close()
+
+
+# 写入者：创建共享内存，关闭时删除
+class FrameBusWriter(FrameBusBase):
+    def __init__(self, name, shape, slots=SLOTS):
+        shm = shared_memory.SharedMemory(name=name, create=True, size=layout(slots, shape)[3])
+        self.attach(shm, slots, shape)
+        self.header[:] = (MAGIC, slots) + tuple(self.shape) + (1,) * (3 - len(self.shape)) + (0,)
+        for sequence in self.sequences:
+            sequence[0] = 0
+        self.name = shm.name
+
+    # 取得下一个槽位的图像数组，由调用方直接写入（如 cap.read(image=...)），写完后调用commit
+    # 读取者在此期间读到该槽位的数据视为无效
+    def acquire(self):
+        sequence = self.head + 1
+        index = sequence % self.slots
+        self.sequences[index][0] = WRITING
+        return sequence, self.frames[index]
+
+    # 发布acquire取得的帧；meta为可JSON序列化的附加信息，如摄像头编号、检测结果
+    def commit(self, sequence, meta=None, timestamp=None):
+        index = sequence % self.slots
+        data = json.dumps(meta).encode('utf-8') if meta is not None else b''
+        if len(data) > META_SIZE:
+            raise ValueError('附加信息超过{}字节'.format(META_SIZE))
+        self.metas[index][:len(data)] = data
+        self.metaLengths[index][0] = len(data)
+        self.timestamps[index][0] = time.time() if timestamp is None else timestamp
+        self.sequences[index][0] = sequence
+        self.header[5] = sequence
+
+    # 复制一帧写入，返回帧序号
+    def write(self, frame, meta=None, timestamp=None):
+        sequence, slot = self.acquire()
+        np.copyto(slot, frame.reshape(self.shape))
+        self.commit(sequence, meta, timestamp)
+        return sequence
+
+    def close(self):
+        super(FrameBusWriter, self).close()
+        self.shm.unlink()
+
+
+# 读取者：按名称连接已有的帧总线，图像尺寸从头部读取
+class FrameBusReader(FrameBusBase):
+    def __init__(self, name):
+        # 读取者不负责删除共享内存；Python 3.13以前无法关闭跟踪，读取进程应由写入者所在进程以multiprocessing启动，
+        # 与其共用resource_tracker，否则退出时共享内存会被删除（bpo-39959）
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        header = np.ndarray((HEADER_FIELDS,), np.int64, shm.buf, 0)
+        if header[0] != MAGIC:
+            shm.close()
+            raise ValueError('{}不是帧总线'.format(name))
+        slots, height, width, channels = (int(value) for value in header[1:5])
+        del header
+        self.attach(shm, slots, (height, width, channels) if channels > 1 else (height, width))
+        self.dropped = 0
+
+    # 下一帧的帧序号：读取过慢、期望的帧已被覆盖时跳到最早的可用帧，跳过的帧计入dropped
+    def nextSequence(self, lastSequence):
+        head = self.head
+        if head <= lastSequence:
+            return None
+        oldest = max(head - self.slots + 2, 1)  # 留出一个槽位给正在写入的帧
+        if lastSequence + 1 < oldest:
+            self.dropped += oldest - lastSequence - 1
+            return oldest
+        return lastSequence + 1
+
+    # 不复制，返回 (frame视图, meta, timestamp)；使用完毕后须调用isValid确认期间未被覆盖
+    def view(self, sequence):
+        index = sequence % self.slots
+        if self.sequences[index][0] != sequence:
+            raise FrameOverwrittenError(sequence)
+        length = int(self.metaLengths[index][0])
+        meta = json.loads(bytes(self.metas[index][:length]).decode('utf-8')) if length else None
+        timestamp = float(self.timestamps[index][0])
+        return self.frames[index], meta, timestamp
+
+    def isValid(self, sequence):
+        return self.sequences[sequence % self.slots][0] == sequence
+
+    # 复制到out（省略时新分配），返回 (frame, meta, timestamp)；复制期间被覆盖时抛出FrameOverwrittenError
+    def read(self, sequence, out=None):
+        frame, meta, timestamp = self.view(sequence)
+        if out is None:
+            out = frame.copy()
+        else:
+            np.copyto(out, frame)
+        if not self.isValid(sequence):
+            raise FrameOverwrittenError(sequence)
+        return out, meta, timestamp
+
+
+# 基准测试读取进程：复制读取每一帧，统计读取数、跳帧数及写入到读取完成的延迟
+def benchmarkReader(name, count, results):
+    reader = FrameBusReader(name)
+    out = np.empty(reader.shape, np.uint8)
+    sequence = 0
+    received = overwritten = 0
+    latency = 0.0
+    while sequence < count:
+        nextSequence = reader.nextSequence(sequence)
+        if nextSequence is None:
+            continue
+        sequence = nextSequence
+        try:
+            frame, meta, timestamp = reader.read(sequence, out)
+        except FrameOverwrittenError:
+            overwritten += 1
+            continue
+        received += 1
+        latency += time.time() - timestamp
+    results.put((received, reader.dropped + overwritten, latency / max(received, 1)))
+    reader.close()
+
+
+# 基准测试：比较共享内存帧总线与multiprocessing.Queue（pickle）传递同一尺寸图像的开销
+# fps大于0时按该帧率写入，模拟摄像头；为0时不限速
+def benchmark(shape, count, readers, fps=0):
+    frame = np.random.randint(0, 255, shape, np.uint8)
+    results = multiprocessing.Queue()
+    writer = FrameBusWriter(None, shape)
+    processes = [multiprocessing.Process(target=benchmarkReader, args=(writer.name, count, results))
+                 for _ in range(readers)]
+    for p in processes:
+        p.start()
+    time.sleep(0.5)  # 等待读取进程连接
+    writeTime = 0.0
+    for index in range(count):
+        start = time.perf_counter()
+        writer.write(frame, {'camera': 0})
+        writeTime += time.perf_counter() - start
+        if fps:
+            time.sleep(max(1.0 / fps - (time.perf_counter() - start), 0))
+    writeTime /= count
+    readerResults = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+
+    # 生产者直接写入槽位时，发布一帧只需更新元数据
+    start = time.perf_counter()
+    for index in range(count):
+        sequence, slot = writer.acquire()
+        writer.commit(sequence, {'camera': 0})
+    commitTime = (time.perf_counter() - start) / count
+    writer.close()
+
+    queue = multiprocessing.Queue(maxsize=4)
+    consumer = multiprocessing.Process(target=queueConsumer, args=(queue, count))
+    consumer.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        queue.put((frame, {'camera': 0}))
+    consumer.join()
+    queueTime = (time.perf_counter() - start) / count
+    return writeTime, commitTime, readerResults, queueTime
+
+
+def queueConsumer(queue, count):
+    for _ in range(count):
+        queue.get()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='共享内存帧总线基准测试')
+    parser.add_argument('--resolutions', nargs='+', default=['640x480', '1920x1080'])
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--fps', type=int, default=0, help='写入帧率，默认不限速')
+    args = parser.parse_args()
+
+    for resolution in args.resolutions:
+        try:
+            width, height = (int(value) for value in resolution.lower().split('x'))
+        except ValueError:
+            print('分辨率格式应为 宽x高：{}'.format(resolution))
+            sys.exit(1)
+        shape = (height, width, 3)
+        writeTime, commitTime, readerResults, queueTime = benchmark(shape, args.frames, args.readers, args.fps)
+        print('{}（{}/帧）：帧总线复制写入{:.1f}us/帧，原地写入发布{:.1f}us/帧，multiprocessing.Queue {:.1f}us/帧'.format(
+            resolution, formatBytes(int(np.prod(shape))), writeTime * 1e6, commitTime * 1e6, queueTime * 1e6))
+        for index, (received, dropped, latency) in enumerate(readerResults):
+            print('  读取进程{}：收到{}帧，跳过{}帧，平均延迟{:.1f}us'.format(index, received, dropped, latency * 1e6))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+
+from PyQt5.QtGui import QGuiApplication, QImage, QPixmap
+
+import threading
+
+# 画面显示：图像处理线程只把最新一帧放入单一槽位，界面按固定帧率取出显示
+# 未被显示的帧直接被下一帧覆盖并归还帧缓冲池，不做任何复制或颜色转换
+
+DISPLAY_FPS = 30
+
+
+# 最新帧槽位：保存最新一帧的帧缓冲区（framePool.FrameBuffer），放入后生产者不得再修改该帧
+class LatestFrameSlot:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frameBuffer = None
+        self.sequence = 0
+
+    # 放入一帧，槽位接管调用方的引用，被覆盖的帧释放
+    def put(self, frameBuffer):
+        with self.lock:
+            previous = self.frameBuffer
+            self.frameBuffer = frameBuffer
+            self.sequence += 1
+        if previous is not None:
+            previous.release()
+
+    # 取出比lastSequence更新的帧，返回 (sequence, frameBuffer)；没有新帧时frameBuffer为None
+    # 取出的帧增加了一个引用，调用方用完后须调用release()
+    def get(self, lastSequence):
+        with self.lock:
+            if self.sequence == lastSequence or self.frameBuffer is None:
+                return lastSequence, None
+            return self.sequence, self.frameBuffer.retain()
+
+    def clear(self):
+        with self.lock:
+            previous = self.frameBuffer
+            self.frameBuffer = None
+        if previous is not None:
+            previous.release()
+
+
+# 将BGR图像显示到QLabel
+# Qt 5.14及以上直接以Format_BGR888包装图像内存，无需颜色转换；
+# 旧版本转换到预分配的RGB缓冲区，QImage在尺寸不变时一直复用该缓冲区
+class FrameRenderer:
+    def __init__(self, qlabel):
+        self.qlabel = qlabel
+        self.qlabel.setScaledContents(True)  # 图片自适应大小
+        self.isBGR888Supported = hasattr(QImage, 'Format_BGR888')
+        self.buffer = None
+        self.image = None
+
+    def render(self, frame):
+        if self.isBGR888Supported:
+            # 不复制，QPixmap.fromImage返回前frame必须保持有效
+            image = QImage(frame.data, frame.shape[1], frame.shape[0], frame.strides[0], QImage.Format_BGR888)
+        else:
+            if self.buffer is None or self.buffer.shape != frame.shape:
+                self.buffer = frame.copy()
+                self.image = QImage(self.buffer.data, frame.shape[1], frame.shape[0], self.buffer.strides[0],
+                                    QImage.Format_RGB888)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.buffer)
+            image = self.image
+        self.qlabel.setPixmap(QPixmap.fromImage(image))
+
+
+# 显示帧率不超过屏幕刷新率，返回定时器间隔（毫秒）
+def renderInterval(fps=DISPLAY_FPS):
+    screen = QGuiApplication.primaryScreen()
+    if screen is not None and screen.refreshRate() > 0:
+        fps = min(fps, screen.refreshRate())
+    return max(int(1000 / fps), 1)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+import numpy as np
+
+import argparse
+import sys
+import threading
+import time
+
+from collections import deque
+
+from metrics import currentRss, formatBytes
+
+# 帧缓冲池：预分配固定尺寸的图像数组，摄像头读取、颜色转换直接写入其中，循环复用
+# 缓冲区带引用计数，显示、报警等环节可以直接持有同一帧而不必复制，最后一个持有者释放后归还缓冲池
+
+POOL_SIZE = 4  # 空闲缓冲区上限，超出的缓冲区释放后直接丢弃
+
+
+class FrameBuffer:
+    def __init__(self, pool, array):
+        self.pool = pool
+        self.array = array
+        self.refs = 1
+
+    # 增加一个持有者，返回自身
+    def retain(self):
+        with self.pool.lock:
+            self.refs += 1
+        return self
+
+    # 减少一个持有者，没有持有者时归还缓冲池
+    def release(self):
+        with self.pool.lock:
+            self.refs -= 1
+            if self.refs == 0:
+                self.pool.recycle(self.array)
+            elif self.refs < 0:
+                raise RuntimeError('帧缓冲区重复释放')
+
+
+class FramePool:
+    def __init__(self, shape, dtype=np.uint8, size=POOL_SIZE):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.size = size
+        self.free = deque()
+        self.lock = threading.Lock()
+        self.allocations = 0  # 新分配的缓冲区数
+        self.acquisitions = 0  # 借出次数
+
+    # 借出一个缓冲区，引用计数为1；没有空闲缓冲区时新分配，不会阻塞
+    def acquire(self):
+        with self.lock:
+            self.acquisitions += 1
+            if self.free:
+                array = self.free.pop()
+            else:
+                self.allocations += 1
+                array = np.empty(self.shape, self.dtype)
+        return FrameBuffer(self, array)
+
+    # 由FrameBuffer.release调用，调用方已持有锁
+    def recycle(self, array):
+        if len(self.free) < self.size:
+            self.free.append(array)
+
+    # 复用率：借出次数中使用已有缓冲区的比例
+    def hitRate(self):
+        return 1 - self.allocations / self.acquisitions if self.acquisitions else 0.0
+
+
+# 从摄像头读取一帧到缓冲池的缓冲区中，pool为None或图像尺寸改变时按实际尺寸重建缓冲池
+# 返回 (pool, frameBuffer)，读取失败时frameBuffer为None
+def readFrame(cap, pool):
+    if pool is None:
+        ret, frame = cap.read()
+        if not ret:
+            return pool, None
+        pool = FramePool(frame.shape, frame.dtype)
+        frameBuffer = pool.acquire()
+        np.copyto(frameBuffer.array, frame)
+        return pool, frameBuffer
+
+    frameBuffer = pool.acquire()
+    ret, frame = cap.read(image=frameBuffer.array)
+    if not ret:
+        frameBuffer.release()
+        return pool, None
+    if frame is not frameBuffer.array:
+        # 分辨率改变，cap.read另行分配了数组
+        frameBuffer.release()
+        pool = FramePool(frame.shape, frame.dtype)
+        frameBuffer = pool.acquire()
+        np.copyto(frameBuffer.array, frame)
+    return pool, frameBuffer
+
+
+# 基准测试：模拟图像处理线程每帧的内存操作（读取、灰度、直方图均衡化、复制一帧用于标注、交给显示环节）
+# pooled为False时按原有方式每帧分配新数组，为True时使用缓冲池；统计新分配图像数组的字节数
+def benchmark(source, frames, pooled):
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError('无法打开视频源{}'.format(source))
+    pool = None
+    gray = equalized = None
+    displayed = None  # 显示环节持有的最新一帧
+    allocated = 0
+
+    rssBefore = currentRss()
+    start = time.perf_counter()
+    count = 0
+    while count < frames:
+        if pooled:
+            pool, frameBuffer = readFrame(cap, pool)
+            if frameBuffer is None:
+                break
+            frame = frameBuffer.array
+            if gray is None or gray.shape != frame.shape[:2]:
+                gray = np.empty(frame.shape[:2], np.uint8)
+                equalized = np.empty_like(gray)
+                allocated += gray.nbytes + equalized.nbytes
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+            cv2.equalizeHist(gray, dst=equalized)
+            annotated = pool.acquire()
+            np.copyto(annotated.array, frame)
+            if displayed is not None:
+                displayed.release()
+            displayed = annotated
+            frameBuffer.release()
+        else:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            equalized = cv2.equalizeHist(gray)
+            displayed = {'originFrame': frame, 'realTimeFrame': frame.copy()}
+            allocated += 2 * frame.nbytes + gray.nbytes + equalized.nbytes
+        count += 1
+    elapsed = time.perf_counter() - start
+    cap.release()
+
+    if pool is not None:
+        allocated += pool.allocations * int(np.prod(pool.shape)) * pool.dtype.itemsize
+    return {
+        'frames': count,
+        'fps': count / elapsed if elapsed else 0.0,
+        'allocatedRate': allocated / elapsed if elapsed else 0.0,
+        'hitRate': pool.hitRate() if pool else 0.0,
+        'rssBefore': rssBefore,
+        'rssAfter': currentRss(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='帧缓冲池基准测试')
+    parser.add_argument('source', help='摄像头编号或视频文件')
+    parser.add_argument('--frames', type=int, default=300)
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    try:
+        for pooled in (False, True):
+            result = benchmark(source, args.frames, pooled)
+            print('{}：{}帧，{:.1f}fps，图像内存分配{}/s，缓冲区复用率{:.1%}，常驻内存 {} -> {}'.format(
+                '缓冲池' if pooled else '逐帧分配', result['frames'], result['fps'],
+                formatBytes(result['allocatedRate']), result['hitRate'], formatBytes(result['rssBefore']),
+                formatBytes(result['rssAfter'])))
+    except IOError as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import os
+import sys
+
+# 运行指标：进程内存占用，供图像处理线程在调试模式下输出及各基准测试使用
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# 当前进程的常驻内存（字节），无法获取时返回None
+# 优先使用psutil；未安装时，Linux读取/proc/self/statm，Windows调用GetProcessMemoryInfo
+def currentRss():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if os.path.isfile('/proc/self/statm'):
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+def formatBytes(size):
+    if size is None:
+        return '未知'
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return '{:.1f}{}'.format(size, unit)
+        size /= 1024
+    return '{:.1f}GB'.format(size)
@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+import numpy as np
+
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import time
+
+from metrics import currentRss
+
+# 二进制模型文件格式：
+#   [0, 8)    魔数 b'LBPHMODL'
+#   [8, 12)   版本号 uint32
+#   [12, 16)  JSON头长度 uint32
+#   [16, ...) JSON头（参数、数据类型、各数组偏移量）
+#   之后依次为按页对齐的 labels(int32)、scales(float32，仅uint8量化时存在)、histograms 矩阵
+# 数组部分以只读方式内存映射，多个进程打开同一模型文件时共享操作系统页缓存
+# 模型按版本保存为 trainingData.{版本号}.lbph，每次写入都生成新版本，不替换已有文件：
+# Windows下被内存映射的文件无法替换或删除，核心程序发现新版本后重新加载，旧版本在之后的写入中清理
+MAGIC = b'LBPHMODL'
+VERSION = 1
+PAGE_SIZE = 4096
+DBL_MAX = sys.float_info.max
+FLT_EPSILON = np.finfo(np.float32).eps
+
+# 支持的直方图存储精度
+SUPPORTED_DTYPES = ('float32', 'float16', 'uint8')
+
+# 预测时每批参与比对的直方图行数，用于限制反量化产生的临时内存
+PREDICT_CHUNK_ROWS = 512
+
+
+# 模型文件格式错误
+class ModelFormatError(Exception):
+    pass
+
+
+# 模型的某一版本对应的文件
+def versionPath(path, version):
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, version, ext)
+
+
+# 模型的全部版本，按版本号升序返回 [(版本号, 文件路径)]
+def modelVersions(path):
+    root, ext = os.path.splitext(path)
+    prefix = os.path.basename(root) + '.'
+    directory = os.path.dirname(path)
+    versions = []
+    if os.path.isdir(directory or '.'):
+        for name in os.listdir(directory or '.'):
+            if not name.startswith(prefix) or not name.endswith(ext):
+                continue
+            version = name[len(prefix):len(name) - len(ext)]
+            if version.isdigit():
+                versions.append((int(version), os.path.join(directory, name)))
+    return sorted(versions)
+
+
+# 模型的最新版本文件；没有版本文件时兼容旧版直接保存的文件，都不存在时返回None
+def resolveModelPath(path):
+    versions = modelVersions(path)
+    if versions:
+        return versions[-1][1]
+    return path if os.path.isfile(path) else None
+
+
+# 删除最新版本以外的模型文件，仍被其它进程映射而无法删除的留待下次清理
+def removeStaleModels(path):
+    latest = resolveModelPath(path)
+    for stale in [filePath for version, filePath in modelVersions(path)] + [path]:
+        if stale != latest and os.path.isfile(stale):
+            try:
+                os.remove(stale)
+            except OSError as e:
+                logging.debug('暂时无法删除旧模型文件{}：{}'.format(stale, e))
+
+
+# 按页对齐
+def alignOffset(offset, alignment=PAGE_SIZE):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+# LBPH模型，与cv2.face.LBPHFaceRecognizer的特征提取及预测保持一致
+# Reference：opencv_contrib/modules/face/src/lbph_faces.cpp
+class LBPHModel:
+    def __init__(self, histograms, labels, radius=1, neighbors=8, gridX=8, gridY=8, threshold=DBL_MAX, scales=None,
+                 meta=None):
+        self.histograms = histograms
+        self.labels = np.asarray(labels, dtype=np.int32).reshape(-1)
+        self.scales = scales
+        self.radius = int(radius)
+        self.neighbors = int(neighbors)
+        self.gridX = int(gridX)
+        self.gridY = int(gridY)
+        self.threshold = float(threshold)
+        # 附加信息，如各用户人脸数据签名、预处理参数，随模型一同保存
+        self.meta = meta if meta is not None else {}
+
+    @property
+    def dtype(self):
+        return np.dtype(self.histograms.dtype).name
+
+    def __len__(self):
+        return len(self.labels)
+
+    # 扩展LBP算子（圆形邻域，双线性插值）
+    def elbp(self, src):
+        src = np.asarray(src, dtype=np.float32)
+        radius, neighbors = self.radius, self.neighbors
+        rows, cols = src.shape
+        center = src[radius:rows - radius, radius:cols - radius]
+        dst = np.zeros(center.shape, dtype=np.int32)
+        for n in range(neighbors):
+            x = np.float32(radius * np.cos(2.0 * np.pi * n / neighbors))
+            y = np.float32(-radius * np.sin(2.0 * np.pi * n / neighbors))
+            fx, fy = int(np.floor(x)), int(np.floor(y))
+            cx, cy = int(np.ceil(x)), int(np.ceil(y))
+            ty, tx = y - fy, x - fx
+            w1 = (1 - tx) * (1 - ty)
+            w2 = tx * (1 - ty)
+            w3 = (1 - tx) * ty
+            w4 = tx * ty
+            t = (w1 * src[radius + fy:rows - radius + fy, radius + fx:cols - radius + fx] +
+                 w2 * src[radius + fy:rows - radius + fy, radius + cx:cols - radius + cx] +
+                 w3 * src[radius + cy:rows - radius + cy, radius + fx:cols - radius + fx] +
+                 w4 * src[radius + cy:rows - radius + cy, radius + cx:cols - radius + cx])
+            dst += (((t > center) | (np.abs(t - center) < FLT_EPSILON)).astype(np.int32) << n)
+        return dst
+
+    # 计算单张人脸灰度图的空间直方图
+    def computeHistogram(self, face):
+        lbp = self.elbp(face)
+        numPatterns = 2 ** self.neighbors
+        width = lbp.shape[1] // self.gridX
+        height = lbp.shape[0] // self.gridY
+        result = np.zeros((self.gridX * self.gridY, numPatterns), dtype=np.float32)
+        if width == 0 or height == 0:
+            return result.reshape(-1)
+        index = 0
+        for i in range(self.gridY):
+            for j in range(self.gridX):
+                cell = lbp[i * height:(i + 1) * height, j * width:(j + 1) * width]
+                hist = np.bincount(cell.reshape(-1), minlength=numPatterns)[:numPatterns]
+                result[index] = hist / np.float32(cell.size)
+                index += 1
+        return result.reshape(-1)
+
+    # 反量化指定行区间的直方图，指定out时写入out（预测时复用同一缓冲区）
+    def denseRows(self, start, stop, out=None):
+        rows = self.histograms[start:stop]
+        if self.scales is not None:
+            return np.multiply(rows, np.asarray(self.scales[start:stop])[:, None], out=out, dtype=np.float32)
+        if out is None:
+            return np.asarray(rows, dtype=np.float32)
+        if rows.dtype == np.float16:
+            # numpy的半精度转换较慢，由OpenCV转换
+            return cv2.add(np.asarray(rows), 0.0, dst=out, dtype=cv2.CV_32F)
+        np.copyto(out, rows)
+        return out
+
+    # 卡方距离（HISTCMP_CHISQR_ALT），与cv2.face.LBPHFaceRecognizer相同，逐行调用cv2.compareHist
+    # float32模型直接比对内存映射中的行，不产生副本；其它精度逐批反量化为float32以限制内存
+    def distances(self, query):
+        query = np.ascontiguousarray(query, dtype=np.float32).reshape(-1)
+        result = np.empty(len(self.labels), dtype=np.float64)
+        buffer = None
+        if self.dtype != 'float32' and len(self.labels):
+            buffer = np.empty((min(PREDICT_CHUNK_ROWS, len(self.labels)), self.histograms.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.labels), PREDICT_CHUNK_ROWS):
+            stop = min(start + PREDICT_CHUNK_ROWS, len(self.labels))
+            rows = self.denseRows(start, stop, buffer[:stop - start] if buffer is not None else None)
+            for index, row in enumerate(rows, start):
+                result[index] = cv2.compareHist(row, query, cv2.HISTCMP_CHISQR_ALT)
+        return result
+
+    # 预测，返回 (label, confidence)，与cv2.face.LBPHFaceRecognizer.predict一致
+    def predict(self, face):
+        if not len(self.labels):
+            return -1, DBL_MAX
+        dists = self.distances(self.computeHistogram(face))
+        index = int(np.argmin(dists))
+        if not dists[index] < self.threshold:
+            return -1, DBL_MAX
+        return int(self.labels[index]), float(dists[index])
+
+    # 按指定精度量化一批直方图，返回 (histograms, scales)
+    @staticmethod
+    def quantizeRows(dense, dtype):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError('不支持的数据类型：{}'.format(dtype))
+        dense = np.asarray(dense, dtype=np.float32)
+        if dtype == 'uint8':
+            rowMax = dense.max(axis=1) if dense.size else np.zeros(len(dense), dtype=np.float32)
+            scales = np.where(rowMax > 0, rowMax / 255.0, 1.0).astype(np.float32)
+            return np.rint(dense / scales[:, None]).astype(np.uint8), scales
+        return dense.astype(dtype), None
+
+    # 转换直方图存储精度
+    def quantize(self, dtype):
+        histograms, scales = LBPHModel.quantizeRows(self.denseRows(0, len(self.labels)), dtype)
+        return LBPHModel(histograms, self.labels, self.radius, self.neighbors, self.gridX, self.gridY,
+                         self.threshold, scales, dict(self.meta))
+
+    # 按目标精度逐批输出指定行的直方图，精度相同时直接复用已存储的数据
+    def iterRows(self, indices, dtype):
+        for start in range(0, len(indices), PREDICT_CHUNK_ROWS):
+            chunk = indices[start:start + PREDICT_CHUNK_ROWS]
+            if dtype == self.dtype:
+                rows = np.asarray(self.histograms[chunk])
+                scales = np.asarray(self.scales[chunk]) if self.scales is not None else None
+                yield rows, scales
+            else:
+                dense = np.asarray(self.histograms[chunk], dtype=np.float32)
+                if self.scales is not None:
+                    dense = dense * np.asarray(self.scales[chunk], dtype=np.float32)[:, None]
+                yield LBPHModel.quantizeRows(dense, dtype)
+
+    # 保存为二进制模型文件的新版本，返回实际写入的文件路径
+    def save(self, path, dtype=None):
+        dtype = dtype or self.dtype
+        cols = self.histograms.shape[1] if np.ndim(self.histograms) == 2 else 0
+        return writeModelFile(path, self, dtype, self.labels, cols,
+                              self.iterRows(np.arange(len(self.labels)), dtype))
+
+    # 以内存映射方式加载二进制模型文件的最新版本
+    @classmethod
+    def load(cls, path):
+        path = resolveModelPath(path) or path
+        with open(path, 'rb') as file:
+            magic = file.read(8)
+            if magic != MAGIC:
+                raise ModelFormatError('{}不是有效的模型文件'.format(path))
+            version, headerLen = struct.unpack('<II', file.read(8))
+            if version != VERSION:
+                raise ModelFormatError('不支持的模型文件版本：{}'.format(version))
+            header = json.loads(file.read(headerLen).decode('utf-8'))
+
+        rows, cols = header['rows'], header['cols']
+        if rows:
+            labels = np.memmap(path, dtype=np.int32, mode='r', offset=header['labels_offset'], shape=(rows,))
+            histograms = np.memmap(path, dtype=header['dtype'], mode='r', offset=header['histograms_offset'],
+                                   shape=(rows, cols))
+        else:
+            labels = np.zeros(0, dtype=np.int32)
+            histograms = np.zeros((0, cols), dtype=header['dtype'])
+        scales = None
+        if header['scales_offset'] and rows:
+            scales = np.memmap(path, dtype=np.float32, mode='r', offset=header['scales_offset'], shape=(rows,))
+        return cls(histograms, labels, header['radius'], header['neighbors'], header['grid_x'], header['grid_y'],
+                   header['threshold'], scales, header.get('meta', {}))
+
+    # 从已训练的cv2.face.LBPHFaceRecognizer导入
+    @classmethod
+    def fromRecognizer(cls, recognizer):
+        histograms = recognizer.getHistograms()
+        if histograms:
+            histograms = np.vstack([np.asarray(h, dtype=np.float32).reshape(1, -1) for h in histograms])
+        else:
+            histograms = np.zeros((0, 0), dtype=np.float32)
+        labels = np.asarray(recognizer.getLabels(), dtype=np.int32).reshape(-1)
+        return cls(histograms, labels, recognizer.getRadius(), recognizer.getNeighbors(), recognizer.getGridX(),
+                   recognizer.getGridY(), recognizer.getThreshold())
+
+    # 导入YAML格式模型
+    @classmethod
+    def readYaml(cls, path):
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        recognizer.read(path)
+        return cls.fromRecognizer(recognizer)
+
+    # 导出为YAML格式模型，可由cv2.face.LBPHFaceRecognizer.read直接读取
+    def writeYaml(self, path):
+        with open(path, 'w') as file:
+            file.write('%YAML:1.0\n')
+            file.write('opencv_lbphfaces:\n')
+            file.write('   threshold: {}\n'.format(repr(self.threshold)))
+            file.write('   radius: {}\n'.format(self.radius))
+            file.write('   neighbors: {}\n'.format(self.neighbors))
+            file.write('   grid_x: {}\n'.format(self.gridX))
+            file.write('   grid_y: {}\n'.format(self.gridY))
+            if len(self.labels):
+                file.write('   histograms:\n')
+                for start in range(0, len(self.labels), PREDICT_CHUNK_ROWS):
+                    for row in self.denseRows(start, min(start + PREDICT_CHUNK_ROWS, len(self.labels))):
+                        file.write('      - !!opencv-matrix\n')
+                        file.write('         rows: 1\n')
+                        file.write('         cols: {}\n'.format(len(row)))
+                        file.write('         dt: f\n')
+                        file.write('         data: [ {} ]\n'.format(', '.join('{:.9g}'.format(v) for v in row)))
+            else:
+                file.write('   histograms: []\n')
+            file.write('   labels: !!opencv-matrix\n')
+            file.write('      rows: {}\n'.format(len(self.labels)))
+            file.write('      cols: 1\n')
+            file.write('      dt: i\n')
+            file.write('      data: [ {} ]\n'.format(', '.join(str(int(v)) for v in self.labels)))
+            file.write('   labelsInfo: []\n')
+
+
+# 写入二进制模型文件的新版本：先写入临时文件，完成后重命名，读取方不会看到写了一半的模型
+# chunks 依次产出已按dtype量化的 (histograms, scales) 批次，行数合计须与labels一致，返回新版本的文件路径
+def writeModelFile(path, model, dtype, labels, cols, chunks):
+    labels = np.ascontiguousarray(labels, dtype=np.int32)
+    rows = len(labels)
+    itemSize = np.dtype(dtype).itemsize
+
+    header = {
+        'radius': model.radius,
+        'neighbors': model.neighbors,
+        'grid_x': model.gridX,
+        'grid_y': model.gridY,
+        'threshold': model.threshold,
+        'dtype': dtype,
+        'rows': rows,
+        'cols': cols,
+        'meta': model.meta,
+    }
+    # 偏移量的位数会影响JSON头长度，先预留足够空间再回填
+    header['labels_offset'] = header['scales_offset'] = header['histograms_offset'] = 0
+    reserved = len(json.dumps(header).encode('utf-8')) + 64
+    offset = alignOffset(16 + reserved)
+    header['labels_offset'] = offset
+    offset = alignOffset(offset + labels.nbytes)
+    if dtype == 'uint8':
+        header['scales_offset'] = offset
+        offset = alignOffset(offset + rows * 4)
+    header['histograms_offset'] = offset
+    encoded = json.dumps(header).encode('utf-8')
+    encoded += b' ' * (reserved - len(encoded))
+
+    versions = modelVersions(path)
+    target = versionPath(path, versions[-1][0] + 1 if versions else 1)
+    tmpPath = target + '.tmp'
+    written = 0
+    with open(tmpPath, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<II', VERSION, len(encoded)))
+        file.write(encoded)
+        file.seek(header['labels_offset'])
+        file.write(labels.tobytes())
+        for histograms, scales in chunks:
+            if not len(histograms):
+                continue
+            if header['scales_offset']:
+                file.seek(header['scales_offset'] + written * 4)
+                file.write(np.ascontiguousarray(scales, dtype=np.float32).tobytes())
+            file.seek(header['histograms_offset'] + written * cols * itemSize)
+            file.write(np.ascontiguousarray(histograms, dtype=dtype).tobytes())
+            written += len(histograms)
+        if written != rows:
+            raise ModelFormatError('直方图行数（{}）与标签数（{}）不一致'.format(written, rows))
+        file.truncate(header['histograms_offset'] + rows * cols * itemSize)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmpPath, target)
+    removeStaleModels(path)
+    return target
+
+
+# 流式构建模型文件：直方图逐行追加到临时文件，提交时再一次性写入正式模型文件
+# 训练过程中内存占用与人脸库规模无关
+class ModelBuilder:
+    def __init__(self, path, radius=1, neighbors=8, gridX=8, gridY=8, threshold=DBL_MAX, dtype='float32'):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError('不支持的数据类型：{}'.format(dtype))
+        self.path = path
+        self.params = (radius, neighbors, gridX, gridY, threshold)
+        self.dtype = dtype
+        self.cols = None
+        self.labels = []
+        self.rowsPath = path + '.rows'
+        self.rowsFile = open(self.rowsPath, 'wb')
+
+    def __len__(self):
+        return len(self.labels)
+
+    # 追加一个样本
+    def append(self, histogram, label):
+        histogram = np.asarray(histogram, dtype=np.float32).reshape(-1)
+        if self.cols is None:
+            self.cols = len(histogram)
+        elif len(histogram) != self.cols:
+            raise ModelFormatError('直方图维度（{}）与已有样本（{}）不一致'.format(len(histogram), self.cols))
+        self.rowsFile.write(histogram.tobytes())
+        self.labels.append(int(label))
+
+    # 写入正式模型文件，返回新版本的文件路径
+    def commit(self, meta=None):
+        self.rowsFile.close()
+        try:
+            rows, cols = len(self.labels), self.cols or 0
+            if rows:
+                dense = np.memmap(self.rowsPath, dtype=np.float32, mode='r', shape=(rows, cols))
+            else:
+                dense = np.zeros((0, cols), dtype=np.float32)
+            radius, neighbors, gridX, gridY, threshold = self.params
+            target = LBPHModel(dense, self.labels, radius, neighbors, gridX, gridY, threshold, meta=meta).save(
+                self.path, self.dtype)
+            del dense
+        finally:
+            os.remove(self.rowsPath)
+        return target
+
+    # 放弃构建
+    def discard(self):
+        self.rowsFile.close()
+        if os.path.isfile(self.rowsPath):
+            os.remove(self.rowsPath)
+
+
+# 增量更新模型文件：删除removeLabels对应的全部样本，追加新样本，无需重新训练整个人脸库
+# 已有样本逐批从内存映射中复制，内存占用与人脸库规模无关
+# meta为None时保留原附加信息，并移除已删除标签的数据签名
+def updateModelFile(path, removeLabels=(), histograms=None, labels=None, meta=None):
+    target = writeUpdatedModel(path, removeLabels, histograms, labels, meta)
+    # 旧版本的内存映射已随writeUpdatedModel返回而释放，此时再清理一次（Windows下被映射的文件无法删除）
+    removeStaleModels(path)
+    return target
+
+
+# 依次产生保留的已有样本和量化后的新样本
+def updatedRows(model, keep, newHistograms):
+    for chunk in model.iterRows(keep, model.dtype):
+        yield chunk
+    for start in range(0, len(newHistograms), PREDICT_CHUNK_ROWS):
+        yield LBPHModel.quantizeRows(newHistograms[start:start + PREDICT_CHUNK_ROWS], model.dtype)
+
+
+# 将更新后的样本写为新版本的模型文件，旧版本的内存映射只在本函数内使用
+def writeUpdatedModel(path, removeLabels, histograms, labels, meta):
+    model = LBPHModel.load(path)
+    removeLabels = np.asarray(sorted(set(int(label) for label in removeLabels)), dtype=np.int32)
+    keep = np.flatnonzero(~np.isin(np.asarray(model.labels), removeLabels))
+    newLabels = np.asarray(labels if labels is not None else [], dtype=np.int32).reshape(-1)
+    if histograms is not None and len(histograms):
+        newHistograms = np.vstack([np.asarray(h, dtype=np.float32).reshape(1, -1) for h in histograms])
+    else:
+        newHistograms = np.zeros((0, model.histograms.shape[1]), dtype=np.float32)
+    if len(newHistograms) != len(newLabels):
+        raise ValueError('新样本直方图数（{}）与标签数（{}）不一致'.format(len(newHistograms), len(newLabels)))
+
+    cols = model.histograms.shape[1] if len(model.labels) else newHistograms.shape[1]
+    if len(newHistograms) and newHistograms.shape[1] != cols:
+        raise ModelFormatError('新样本直方图维度（{}）与模型（{}）不一致'.format(newHistograms.shape[1], cols))
+
+    if meta is None:
+        meta = dict(model.meta)
+        sources = dict(meta.get('sources', {}))
+        for label in removeLabels:
+            sources.pop(str(label), None)
+        meta['sources'] = sources
+    model.meta = meta
+
+    allLabels = np.concatenate([np.asarray(model.labels)[keep], newLabels])
+    return writeModelFile(path, model, model.dtype, allLabels, cols, updatedRows(model, keep, newHistograms))
+
+
+# 按扩展名加载识别器：.lbph使用内存映射的二进制格式（最新版本），其余按OpenCV YAML格式读取
+def loadRecognizer(path):
+    if path.endswith('.lbph'):
+        return LBPHModel.load(path)
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    recognizer.read(path)
+    return recognizer
+
+
+# 子进程中加载模型并回报耗时与内存占用
+def benchmarkLoad(path, resultQueue):
+    rssBefore = currentRss()
+    start = time.perf_counter()
+    model = loadRecognizer(path)
+    loadTime = time.perf_counter() - start
+    # 内存映射只在访问时才载入页面，完整预测一次以统计实际工作集
+    probe = np.random.RandomState(0).randint(0, 256, (100, 100)).astype(np.uint8)
+    start = time.perf_counter()
+    model.predict(probe)
+    predictTime = time.perf_counter() - start
+    rssAfter = currentRss()
+    rssDelta = rssAfter - rssBefore if rssBefore is not None and rssAfter is not None else None
+    resultQueue.put((loadTime, predictTime, rssDelta))
+
+
+# 对比YAML与二进制格式的加载耗时及内存占用
+def benchmark(ymlPath, dtypes=SUPPORTED_DTYPES):
+    import multiprocessing
+    import tempfile
+
+    model = LBPHModel.readYaml(ymlPath)
+    candidates = [('yaml', ymlPath)]
+    tmpDir = tempfile.mkdtemp()
+    for dtype in dtypes:
+        path = model.save(os.path.join(tmpDir, 'trainingData.{}.lbph'.format(dtype)), dtype)
+        candidates.append((dtype, path))
+
+    results = []
+    for name, path in candidates:
+        resultQueue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=benchmarkLoad, args=(path, resultQueue))
+        p.start()
+        loadTime, predictTime, rssDelta = resultQueue.get()
+        p.join()
+        results.append((name, os.path.getsize(path), loadTime, predictTime, rssDelta))
+
+    for _, path in candidates[1:]:
+        os.remove(path)
+    os.rmdir(tmpDir)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='LBPH模型格式转换与基准测试')
+    subparsers = parser.add_subparsers(dest='command')
+
+    importParser = subparsers.add_parser('import', help='YAML -> 二进制模型')
+    importParser.add_argument('src', nargs='?', default='./recognizer/trainingData.yml')
+    importParser.add_argument('dst', nargs='?', default='./recognizer/trainingData.lbph')
+    importParser.add_argument('--dtype', choices=SUPPORTED_DTYPES, default='float32')
+
+    exportParser = subparsers.add_parser('export', help='二进制模型 -> YAML')
+    exportParser.add_argument('src', nargs='?', default='./recognizer/trainingData.lbph')
+    exportParser.add_argument('dst', nargs='?', default='./recognizer/trainingData.yml')
+
+    benchmarkParser = subparsers.add_parser('benchmark', help='对比YAML与二进制模型的加载耗时及内存占用')
+    benchmarkParser.add_argument('src', nargs='?', default='./recognizer/trainingData.yml')
+
+    args = parser.parse_args()
+    if args.command == 'import':
+        print('已生成{}'.format(LBPHModel.readYaml(args.src).save(args.dst, args.dtype)))
+    elif args.command == 'export':
+        LBPHModel.load(args.src).writeYaml(args.dst)
+        print('已生成{}'.format(args.dst))
+    elif args.command == 'benchmark':
+        print('{:<10}{:>14}{:>12}{:>14}{:>12}'.format('format', 'size(MB)', 'load(s)', 'predict(ms)', 'RSS(MB)'))
+        for name, size, loadTime, predictTime, rssDelta in benchmark(args.src):
+            rss = '{:.1f}'.format(rssDelta / 2 ** 20) if rssDelta is not None else 'n/a'
+            print('{:<10}{:>14.1f}{:>12.3f}{:>14.2f}{:>12}'.format(name, size / 2 ** 20, loadTime,
+                                                                   predictTime * 1000, rss))
+    else:
+        parser.print_help()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+import numpy as np
+
+import argparse
+import sys
+import time
+
+from faceDetector import loadDetector
+
+# 运动门控：画面无变化时跳过人脸检测与识别，持续静止一段时间后进入低帧率空闲模式，出现运动立即恢复
+# 在缩小的灰度图上与滑动平均的背景模型做差分，变化像素占比超过阈值即认为有运动
+
+GATE_WIDTH = 160  # 差分前将图像缩小到的宽度
+DIFF_THRESHOLD = 25  # 像素灰度变化超过该值视为变化
+MIN_AREA = 0.002  # 变化像素占比超过该值视为有运动
+LEARNING_RATE = 0.05  # 背景模型的更新速度，光照缓慢变化会被背景吸收
+QUIET_SECONDS = 10  # 持续静止该时间（秒）后进入空闲模式
+IDLE_FPS = 5  # 空闲模式下的处理帧率
+
+ACTIVE = 'active'  # 有运动，正常检测
+QUIET = 'quiet'  # 无运动，跳过检测
+IDLE = 'idle'  # 长时间无运动，跳过检测并降低帧率
+
+
+class MotionGate:
+    def __init__(self, width=GATE_WIDTH, threshold=DIFF_THRESHOLD, minArea=MIN_AREA, learningRate=LEARNING_RATE,
+                 quietSeconds=QUIET_SECONDS, idleFps=IDLE_FPS):
+        self.width = width
+        self.threshold = threshold
+        self.minArea = minArea
+        self.learningRate = learningRate
+        self.quietSeconds = quietSeconds
+        self.idleFps = idleFps
+        self.background = None
+        self.small = self.diff = self.mask = None
+        self.lastMotionTime = None
+        self.state = ACTIVE
+
+        # 指标：各状态的帧数、门控自身耗时、被跳过的帧按检测平均耗时估算节省的CPU时间
+        self.frames = {ACTIVE: 0, QUIET: 0, IDLE: 0}
+        self.gateTime = 0.0
+        self.detectionTime = 0.0  # 检测与识别的平均耗时（指数滑动平均）
+        self.savedTime = 0.0
+
+    @staticmethod
+    def fromConfig(cfg, section='motion'):
+        return MotionGate(cfg.getint(section, 'width', fallback=GATE_WIDTH),
+                          cfg.getint(section, 'threshold', fallback=DIFF_THRESHOLD),
+                          cfg.getfloat(section, 'min_area', fallback=MIN_AREA),
+                          cfg.getfloat(section, 'learning_rate', fallback=LEARNING_RATE),
+                          cfg.getfloat(section, 'quiet_seconds', fallback=QUIET_SECONDS),
+                          cfg.getfloat(section, 'idle_fps', fallback=IDLE_FPS))
+
+    # 输入一帧灰度图，返回画面是否有运动；缩小、差分所用的数组预分配后复用
+    def update(self, gray, now=None):
+        start = time.perf_counter()
+        now = time.time() if now is None else now
+        height = max(int(gray.shape[0] * self.width / gray.shape[1]), 1)
+        if self.small is None or self.small.shape != (height, self.width):
+            self.small = np.empty((height, self.width), np.uint8)
+            self.diff = np.empty_like(self.small)
+            self.mask = np.empty_like(self.small)
+            self.background = None
+        cv2.resize(gray, (self.width, height), dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.GaussianBlur(self.small, (5, 5), 0, dst=self.small)
+
+        if self.background is None:
+            self.background = self.small.astype(np.float32)
+            isMotion = True
+        else:
+            cv2.absdiff(self.small, cv2.convertScaleAbs(self.background), dst=self.diff)
+            cv2.threshold(self.diff, self.threshold, 255, cv2.THRESH_BINARY, dst=self.mask)
+            isMotion = cv2.countNonZero(self.mask) > self.minArea * self.mask.size
+            cv2.accumulateWeighted(self.small, self.background, self.learningRate)
+
+        if isMotion:
+            self.lastMotionTime = now
+            self.state = ACTIVE
+        elif now - self.lastMotionTime > self.quietSeconds:
+            self.state = IDLE
+        else:
+            self.state = QUIET
+        self.frames[self.state] += 1
+        self.gateTime += time.perf_counter() - start
+        return isMotion
+
+    # 记录一帧检测与识别的耗时
+    def recordDetection(self, elapsed):
+        self.detectionTime = elapsed if not self.detectionTime else 0.9 * self.detectionTime + 0.1 * elapsed
+
+    # 记录一帧被跳过的检测
+    def recordSkipped(self):
+        self.savedTime += self.detectionTime
+
+    def isIdle(self):
+        return self.state == IDLE
+
+    def summary(self):
+        total = sum(self.frames.values())
+        return ('运动门控：检测{}帧，静止跳过{}帧，空闲跳过{}帧，门控耗时{:.2f}ms/帧，节省CPU约{:.1f}s'.format(
+            self.frames[ACTIVE], self.frames[QUIET], self.frames[IDLE],
+            self.gateTime / total * 1000 if total else 0.0, self.savedTime))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='运动门控测试：统计视频中被跳过检测的帧数及节省的时间')
+    parser.add_argument('source', help='摄像头编号或视频文件')
+    parser.add_argument('--frames', type=int, default=0, help='最多处理的帧数，默认处理到视频结束')
+    parser.add_argument('--quiet-seconds', type=float, default=QUIET_SECONDS)
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        print('无法打开视频源{}'.format(args.source))
+        sys.exit(1)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    faceDetector = loadDetector()
+    gate = MotionGate(quietSeconds=args.quiet_seconds)
+    count = 0
+    while not args.frames or count < args.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # 视频文件按帧号计算时间，与实际播放速度一致
+        if gate.update(gray, count / fps):
+            start = time.perf_counter()
+            faceDetector.detect(gray)
+            gate.recordDetection(time.perf_counter() - start)
+        else:
+            gate.recordSkipped()
+        count += 1
+    cap.release()
+    print(gate.summary())
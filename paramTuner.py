@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+import numpy as np
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import time
+
+from configparser import ConfigParser
+
+from faceDetector import createDetector
+from modelStore import LBPHModel
+from trainer import DEFAULT_CHUNK_SIZE, detectFace, listDatasets, listSources, loadLbphParams, loadSource
+
+# 参数调优：在录制的视频及人脸库的留出集上遍历人脸检测、LBPH特征及识别阈值参数，
+# 测量帧率、检测召回率、识别准确率及误报警率，输出满足CPU预算的帕累托最优配置，可直接作为 config 下的配置文件使用
+#   检测  级联分类器的scale_factor、min_neighbors及min_face（其它检测后端只遍历min_face）
+#   特征  LBPH的radius、neighbors、grid_x、grid_y
+#   阈值  confidence_threshold、auto_alarm_threshold，取各组合下置信度评分分布的分位数
+# 每位用户的样本按比例分为训练集与测试集，另取一部分用户整体留出作为陌生人
+# 帧率按 视频中每帧的检测耗时 + 每帧人脸数（至少1张）× 每张人脸的识别耗时 估算，只统计图像处理线程的CPU时间
+
+CONFIG_DIR = './config'
+SCALE_FACTORS = (1.1, 1.2, 1.3)
+MIN_NEIGHBORS = (3, 5, 7)
+MIN_FACES = (60, 90, 120)
+LBPH_VARIANTS = ('1:8:8x8', '2:8:8x8', '1:8:6x6', '1:8:10x10')  # radius:neighbors:grid_xxgrid_y
+TEST_RATIO = 0.3
+STRANGER_RATIO = 0.25
+THRESHOLD_STEPS = 12  # 每个组合下阈值的候选数
+FOOTAGE_FRAMES = 200  # 每个视频最多读取的帧数
+PREDICT_SAMPLES = 20  # 测量识别耗时的人脸数
+TOP = 10
+
+# 指标及其优化方向，True为越大越好
+OBJECTIVES = (('fps', True), ('recall', True), ('accuracy', True), ('falseAlarmRate', False),
+              ('alarmRate', True))
+
+# 工作进程内常驻的人脸检测器与各组LBPH参数的特征提取器
+workerDetector = None
+workerModels = None
+workerEqualizeHist = False
+
+
+# 解析 radius:neighbors:grid_xxgrid_y 格式的LBPH参数
+def parseLbph(text):
+    try:
+        radius, neighbors, grid = text.split(':')
+        gridX, gridY = grid.lower().split('x')
+        return {'radius': int(radius), 'neighbors': int(neighbors), 'gridX': int(gridX), 'gridY': int(gridY)}
+    except ValueError:
+        raise ValueError('LBPH参数格式应为 radius:neighbors:grid_xxgrid_y，如1:8:8x8：{}'.format(text))
+
+
+def formatLbph(params):
+    return '{radius}:{neighbors}:{gridX}x{gridY}'.format(**params)
+
+
+# 划分留出集：随机选取部分用户整体作为陌生人，其余用户的样本按testRatio分为训练集与测试集
+# 返回 (train, test, strangers)，均为 [(label, source)]，陌生人的label为-1
+def splitSamples(datasets, testRatio=TEST_RATIO, strangerRatio=STRANGER_RATIO, seed=0):
+    datasetPaths = listDatasets(datasets)
+    if len(datasetPaths) < 2:
+        raise ValueError('人脸库中至少需要2名用户')
+    rng = random.Random(seed)
+    stu_ids = list(datasetPaths)
+    strangerCount = min(max(int(round(len(stu_ids) * strangerRatio)), 1), len(stu_ids) - 1)
+    strangerIds = set(rng.sample(stu_ids, strangerCount))
+    train, test, strangers = [], [], []
+    for label, stu_id in enumerate(stu_ids, 1):
+        sources = listSources(datasetPaths[stu_id])
+        if stu_id in strangerIds:
+            strangers.extend((-1, source) for source in sources)
+            continue
+        rng.shuffle(sources)
+        testCount = int(len(sources) * testRatio)
+        test.extend((label, source) for source in sources[:testCount])
+        train.extend((label, source) for source in sources[testCount:])
+    return train, test, strangers
+
+
+# 读取录制视频的灰度帧，用于测量检测耗时
+def loadFootage(paths, frames=FOOTAGE_FRAMES):
+    footage = []
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError('无法打开视频{}'.format(path))
+        count = 0
+        while count < frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            footage.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            count += 1
+        cap.release()
+    if not footage:
+        raise IOError('视频中没有可读取的帧')
+    return footage
+
+
+# 按基础检测配置与各组参数创建检测器，返回 [(参数, 检测器)]；参数对当前后端无效的组合按describe()去重
+def detectorVariants(baseCfg, scaleFactors=SCALE_FACTORS, minNeighbors=MIN_NEIGHBORS, minFaces=MIN_FACES):
+    variants = []
+    seen = set()
+    for scaleFactor, neighbors, minFace in itertools.product(scaleFactors, minNeighbors, minFaces):
+        overrides = {'scale_factor': str(scaleFactor), 'min_neighbors': str(neighbors), 'min_face': str(minFace)}
+        cfg = ConfigParser()
+        cfg.read_dict(baseCfg)
+        cfg.read_dict({'detection': overrides})
+        detector = createDetector(cfg, allowTiled=False)
+        key = json.dumps(detector.describe(), sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            variants.append((overrides, detector))
+    return variants
+
+
+# 在视频上测量检测耗时，返回 (毫秒/帧, 人脸数/帧)
+def measureFootage(detector, footage):
+    detector.detect(footage[0])  # 预热，加载模型
+    faces = 0
+    start = time.perf_counter()
+    for gray in footage:
+        faces += len(detector.detect(gray))
+    return (time.perf_counter() - start) / len(footage) * 1000, faces / len(footage)
+
+
+# 工作进程初始化
+def initWorker(faceDetector, equalizeHist, lbphVariants):
+    global workerDetector, workerModels, workerEqualizeHist
+    workerDetector = faceDetector
+    workerModels = [LBPHModel(None, [], **params) for params in lbphVariants]
+    workerEqualizeHist = equalizeHist
+
+
+# 与训练时相同的读图、检测流程，返回 (人脸灰度图, [各组LBPH参数下的直方图])；未检测到人脸时为 (None, None)
+def processSample(source):
+    image = loadSource(source)
+    if image is None:
+        return None, None
+    face, rect = detectFace(image, workerDetector, workerEqualizeHist)
+    if face is None:
+        return None, None
+    return face, [model.computeHistogram(face) for model in workerModels]
+
+
+# 并行处理全部样本，结果与sources一一对应
+def extractSamples(sources, faceDetector, equalizeHist, lbphVariants, workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        initWorker(faceDetector, equalizeHist, lbphVariants)
+        return [processSample(source) for source in sources]
+    with multiprocessing.Pool(workers, initializer=initWorker,
+                              initargs=(faceDetector, equalizeHist, lbphVariants)) as pool:
+        return pool.map(processSample, sources, DEFAULT_CHUNK_SIZE)
+
+
+# 以训练集建立模型，对测试集、陌生人逐个预测
+# 返回 (每张人脸的识别耗时ms, 测试集 [(是否识别正确, 置信度评分)], 陌生人 [置信度评分])，只包含检测到人脸的样本
+def predictSamples(params, variantIndex, train, test, results):
+    histograms, labels = [], []
+    for (label, source), (face, sampleHistograms) in zip(train, results['train']):
+        if face is not None:
+            histograms.append(sampleHistograms[variantIndex])
+            labels.append(label)
+    if not histograms:
+        raise ValueError('训练集中未检测到人脸')
+    model = LBPHModel(np.vstack(histograms), labels, **params)
+
+    def nearest(histogram):
+        distances = model.distances(histogram)
+        index = int(np.argmin(distances))
+        return int(model.labels[index]), float(distances[index])
+
+    genuine = []
+    for (label, source), (face, sampleHistograms) in zip(test, results['test']):
+        if face is not None:
+            predicted, confidence = nearest(sampleHistograms[variantIndex])
+            genuine.append((predicted == label, confidence))
+    strangerConfidences = [nearest(sampleHistograms[variantIndex])[1]
+                           for face, sampleHistograms in results['strangers'] if face is not None]
+
+    faces = [face for face, sampleHistograms in results['test'] + results['strangers'] if face is not None]
+    faces = faces[:PREDICT_SAMPLES]
+    start = time.perf_counter()
+    for face in faces:
+        model.predict(face)
+    predictMs = (time.perf_counter() - start) / max(len(faces), 1) * 1000
+    return predictMs, genuine, strangerConfidences
+
+
+# 阈值候选：置信度评分分布的分位数，取整后去重（核心框架的阈值为整数）
+def thresholdCandidates(confidences, steps=THRESHOLD_STEPS):
+    if not confidences:
+        return []
+    quantiles = np.percentile(confidences, np.linspace(5, 95, steps))
+    return sorted(set(int(round(value)) for value in quantiles))
+
+
+# 各阈值组合下的识别指标
+#   accuracy        检测到的人脸中，已知用户被正确识别、陌生人被判定为陌生人的比例
+#   falseAlarmRate  检测到的已知用户中触发自动报警的比例
+#   alarmRate       检测到的陌生人中触发自动报警的比例
+#   far / frr       陌生人被误认为已知用户的比例 / 已知用户未被识别的比例
+def thresholdMetrics(genuine, strangerConfidences, steps=THRESHOLD_STEPS):
+    correct = np.array([isCorrect for isCorrect, confidence in genuine], dtype=bool)
+    genuineConfidences = np.array([confidence for isCorrect, confidence in genuine])
+    strangerConfidences = np.array(strangerConfidences)
+    candidates = thresholdCandidates(list(genuineConfidences) + list(strangerConfidences), steps)
+    total = len(genuineConfidences) + len(strangerConfidences)
+    rows = []
+    for confidenceThreshold in candidates:
+        accepted = correct & (genuineConfidences < confidenceThreshold)
+        rejected = strangerConfidences >= confidenceThreshold
+        for alarmThreshold in candidates:
+            if alarmThreshold < confidenceThreshold:
+                continue
+            rows.append({
+                'confidenceThreshold': confidenceThreshold,
+                'alarmThreshold': alarmThreshold,
+                'accuracy': (accepted.sum() + rejected.sum()) / total if total else 0.0,
+                'falseAlarmRate': float(np.mean(genuineConfidences > alarmThreshold)) if len(genuine) else 0.0,
+                'alarmRate': float(np.mean(strangerConfidences > alarmThreshold)) if len(strangerConfidences) else 0.0,
+                'far': float(np.mean(~rejected)) if len(strangerConfidences) else 0.0,
+                'frr': float(np.mean(~accepted)) if len(genuine) else 0.0,
+            })
+    return rows
+
+
+# 帕累托最优：返回不被其它点支配的点（各指标均不差，且至少一项更好），指标完全相同的点只保留一个
+def paretoFront(points, objectives=OBJECTIVES):
+    if not points:
+        return []
+    values = np.array([[point[name] if isMax else -point[name] for name, isMax in objectives] for point in points])
+    front = []
+    seen = set()
+    for index, value in enumerate(values):
+        isDominated = np.any(np.all(values >= value, axis=1) & np.any(values > value, axis=1))
+        key = tuple(value)
+        if not isDominated and key not in seen:
+            seen.add(key)
+            front.append(points[index])
+    return front
+
+
+# 遍历全部参数组合，返回各组合的指标；progress为进度输出回调
+def sweep(footage, datasets, baseDetectorCfg, lbphVariants, scaleFactors=SCALE_FACTORS, minNeighbors=MIN_NEIGHBORS,
+          minFaces=MIN_FACES, equalizeHist=False, testRatio=TEST_RATIO, strangerRatio=STRANGER_RATIO, seed=0,
+          workers=None, steps=THRESHOLD_STEPS, progress=print):
+    train, test, strangers = splitSamples(datasets, testRatio, strangerRatio, seed)
+    if not test:
+        raise ValueError('测试集为空，请增加样本数或test_ratio')
+    progress('训练集{}张，测试集{}张，陌生人{}张'.format(len(train), len(test), len(strangers)))
+    variants = detectorVariants(baseDetectorCfg, scaleFactors, minNeighbors, minFaces)
+    points = []
+    for number, (overrides, detector) in enumerate(variants, 1):
+        detectMs, facesPerFrame = measureFootage(detector, footage)
+        extracted = extractSamples([source for label, source in train + test + strangers], detector, equalizeHist,
+                                   lbphVariants, workers)
+        results = {'train': extracted[:len(train)], 'test': extracted[len(train):len(train) + len(test)],
+                   'strangers': extracted[len(train) + len(test):]}
+        heldOut = results['test'] + results['strangers']
+        recall = sum(face is not None for face, histograms in heldOut) / len(heldOut)
+        progress('[{}/{}] {}：检测{:.1f}ms/帧，{:.2f}张人脸/帧，召回率{:.1%}'.format(
+            number, len(variants), ' '.join('{}={}'.format(key, value) for key, value in overrides.items()),
+            detectMs, facesPerFrame, recall))
+        for variantIndex, params in enumerate(lbphVariants):
+            try:
+                predictMs, genuine, strangerConfidences = predictSamples(params, variantIndex, train, test, results)
+            except ValueError as e:
+                progress('  LBPH {}：{}，已跳过'.format(formatLbph(params), e))
+                continue
+            fps = 1000 / (detectMs + max(facesPerFrame, 1) * predictMs)
+            for row in thresholdMetrics(genuine, strangerConfidences, steps):
+                row.update(overrides)
+                row.update({'lbph': formatLbph(params), 'fps': fps, 'recall': recall, 'detectMs': detectMs,
+                            'predictMs': predictMs})
+                points.append(row)
+    return points
+
+
+# 修改配置文件中指定段的键值，保留原有注释与顺序；段或键不存在时追加
+def updateConfigFile(src, dst, section, values):
+    lines = []
+    if os.path.isfile(src):
+        with open(src, encoding='utf-8-sig') as f:
+            lines = f.read().splitlines()
+    pending = dict(values)
+    output = []
+    current = None
+
+    def flush():
+        if current == section:
+            output.extend('{} = {}'.format(key, value) for key, value in pending.items())
+            pending.clear()
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('[') and stripped.endswith(']'):
+            # 在段末尾的空行之前追加
+            trailing = []
+            while output and not output[-1].strip():
+                trailing.append(output.pop())
+            flush()
+            output.extend(trailing)
+            current = stripped[1:-1]
+        elif current == section and '=' in stripped and not stripped.startswith((';', '#')):
+            key = stripped.split('=', 1)[0].strip()
+            if key in pending:
+                line = '{} = {}'.format(key, pending.pop(key))
+        output.append(line)
+    flush()
+    if pending:
+        if output and output[-1].strip():
+            output.append('')
+        output.append('[{}]'.format(section))
+        output.extend('{} = {}'.format(key, value) for key, value in pending.items())
+    with open(dst, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(output) + '\n')
+
+
+# 将一组参数写成完整的配置文件（detector.cfg、core.cfg、trainer.cfg），未调优的设置沿用configDir中的配置
+def writeConfigs(point, outputDir, configDir=CONFIG_DIR):
+    os.makedirs(outputDir, exist_ok=True)
+    lbph = parseLbph(point['lbph'])
+    updateConfigFile(os.path.join(configDir, 'detector.cfg'), os.path.join(outputDir, 'detector.cfg'), 'detection',
+                     {key: point[key] for key in ('scale_factor', 'min_neighbors', 'min_face')})
+    updateConfigFile(os.path.join(configDir, 'core.cfg'), os.path.join(outputDir, 'core.cfg'), 'recognition',
+                     {'confidence_threshold': point['confidenceThreshold'],
+                      'auto_alarm_threshold': point['alarmThreshold']})
+    updateConfigFile(os.path.join(configDir, 'trainer.cfg'), os.path.join(outputDir, 'trainer.cfg'), 'lbph',
+                     {'radius': lbph['radius'], 'neighbors': lbph['neighbors'], 'grid_x': lbph['gridX'],
+                      'grid_y': lbph['gridY']})
+
+
+CSV_FIELDS = ['rank', 'fps', 'recall', 'accuracy', 'falseAlarmRate', 'alarmRate', 'far', 'frr', 'detectMs',
+              'predictMs', 'scale_factor', 'min_neighbors', 'min_face', 'lbph', 'confidenceThreshold',
+              'alarmThreshold']
+
+
+# 输出帕累托最优配置：全部写入pareto.csv，按准确率、帧率排序的前top个另写为配置文件目录 {output}/{名次}
+def writeResults(front, output, top=TOP, configDir=CONFIG_DIR):
+    os.makedirs(output, exist_ok=True)
+    front = sorted(front, key=lambda point: (-point['accuracy'], -point['fps'], point['falseAlarmRate']))
+    with open(os.path.join(output, 'pareto.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for rank, point in enumerate(front, 1):
+            point['rank'] = rank
+            writer.writerow({key: round(value, 4) if isinstance(value, float) else value
+                             for key, value in point.items()})
+    for point in front[:top]:
+        writeConfigs(point, os.path.join(output, str(point['rank'])), configDir)
+    return front
+
+
+# 应用一组调优后的配置，原配置备份为 *.cfg.old；LBPH参数变动时须重新训练
+def applyConfigs(sourceDir, configDir=CONFIG_DIR):
+    isLbphChanged = False
+    for name in ('detector.cfg', 'core.cfg', 'trainer.cfg'):
+        src = os.path.join(sourceDir, name)
+        if not os.path.isfile(src):
+            raise FileNotFoundError(src)
+        dst = os.path.join(configDir, name)
+        if name == 'trainer.cfg':
+            isLbphChanged = loadLbphParams(src) != loadLbphParams(dst)
+        if os.path.isfile(dst):
+            shutil.copyfile(dst, dst + '.old')
+        shutil.copyfile(src, dst)
+    return isLbphChanged
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='人脸检测与识别参数调优')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    sweepParser = subparsers.add_parser('sweep', help='遍历参数组合，输出帕累托最优配置')
+    sweepParser.add_argument('footage', nargs='+', help='录制的视频，用于测量检测耗时')
+    sweepParser.add_argument('--datasets', default='./datasets')
+    sweepParser.add_argument('--config-dir', default=CONFIG_DIR, help='基础配置目录，未调优的设置沿用其中的配置')
+    sweepParser.add_argument('--output', default='./tuning')
+    sweepParser.add_argument('--budget-ms', type=float, default=0,
+                             help='CPU预算：每帧检测与识别的耗时上限（毫秒），默认不限')
+    sweepParser.add_argument('--scale-factors', type=float, nargs='+', default=list(SCALE_FACTORS))
+    sweepParser.add_argument('--min-neighbors', type=int, nargs='+', default=list(MIN_NEIGHBORS))
+    sweepParser.add_argument('--min-faces', type=int, nargs='+', default=list(MIN_FACES))
+    sweepParser.add_argument('--lbph', nargs='+', default=list(LBPH_VARIANTS),
+                             help='LBPH参数组合，格式 radius:neighbors:grid_xxgrid_y')
+    sweepParser.add_argument('--equalize-hist', action='store_true', help='执行直方图均衡化')
+    sweepParser.add_argument('--test-ratio', type=float, default=TEST_RATIO)
+    sweepParser.add_argument('--stranger-ratio', type=float, default=STRANGER_RATIO, help='作为陌生人留出的用户比例')
+    sweepParser.add_argument('--frames', type=int, default=FOOTAGE_FRAMES, help='每个视频最多读取的帧数')
+    sweepParser.add_argument('--thresholds', type=int, default=THRESHOLD_STEPS, help='每个组合下阈值的候选数')
+    sweepParser.add_argument('--workers', type=int, default=None, help='并行进程数，默认为CPU核心数')
+    sweepParser.add_argument('--top', type=int, default=TOP, help='写出配置文件的组数')
+    sweepParser.add_argument('--seed', type=int, default=0)
+
+    applyParser = subparsers.add_parser('apply', help='应用一组调优后的配置')
+    applyParser.add_argument('source', help='sweep输出的配置目录，如 ./tuning/1')
+    applyParser.add_argument('--config-dir', default=CONFIG_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'sweep':
+        try:
+            lbphVariants = [parseLbph(text) for text in args.lbph]
+            footage = loadFootage(args.footage, args.frames)
+            baseCfg = ConfigParser()
+            baseCfg.read(os.path.join(args.config_dir, 'detector.cfg'), encoding='utf-8-sig')
+            points = sweep(footage, args.datasets, baseCfg, lbphVariants, args.scale_factors, args.min_neighbors,
+                           args.min_faces, args.equalize_hist, args.test_ratio, args.stranger_ratio, args.seed,
+                           args.workers, args.thresholds)
+        except (IOError, ValueError) as e:
+            print('调优失败：{}'.format(e))
+            sys.exit(1)
+        if args.budget_ms:
+            points = [point for point in points if 1000 / point['fps'] <= args.budget_ms]
+            if not points:
+                print('没有满足CPU预算{}ms/帧的配置'.format(args.budget_ms))
+                sys.exit(1)
+        front = writeResults(paretoFront(points), args.output, args.top, args.config_dir)
+        print('帕累托最优配置{}组（共{}个组合），已写入{}：'.format(len(front), len(points), args.output))
+        for point in front[:args.top]:
+            print('{:>3}. {:5.1f}fps 召回率{:6.1%} 准确率{:6.1%} 误报警{:6.1%} 陌生人报警{:6.1%}  '
+                  'scale_factor={} min_neighbors={} min_face={} lbph={} 阈值{}/{}'.format(
+                      point['rank'], point['fps'], point['recall'], point['accuracy'], point['falseAlarmRate'],
+                      point['alarmRate'], point['scale_factor'], point['min_neighbors'], point['min_face'],
+                      point['lbph'], point['confidenceThreshold'], point['alarmThreshold']))
+        print('应用某组配置：python paramTuner.py apply {}'.format(os.path.join(args.output, '1')))
+
+    elif args.command == 'apply':
+        try:
+            isLbphChanged = applyConfigs(args.source, args.config_dir)
+        except OSError as e:
+            print('应用配置失败：{}'.format(e))
+            sys.exit(1)
+        print('已应用{}中的配置，原配置备份为 *.cfg.old'.format(args.source))
+        if isLbphChanged:
+            print('LBPH参数已变动，请重新训练人脸数据：python trainer.py --full')
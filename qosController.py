@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import time
+
+from collections import deque
+
+# 自适应服务质量控制：测量每帧从读取到显示的处理延迟，超出目标时逐级降低处理强度，恢复后逐级还原
+# 各级别依次调整以下参数：
+#   detectionInterval  每隔几帧执行一次人脸检测，其余帧沿用上一帧的人脸位置
+#   detectionScale     检测前将灰度图缩小的比例
+#   recheckInterval    已跟踪的人脸每隔几帧重新识别一次，其余帧沿用上次的识别结果
+#   maxTracks          每帧最多处理的人脸数（按人脸面积从大到小）
+#   frameSkip          每处理一帧前丢弃的帧数（只抓取不解码）
+
+KNOBS = ('detectionInterval', 'detectionScale', 'recheckInterval', 'maxTracks', 'frameSkip')
+LEVELS = [
+    (1, 1.0, 1, 10, 0),
+    (2, 1.0, 3, 10, 0),
+    (2, 0.75, 5, 8, 0),
+    (3, 0.75, 10, 6, 1),
+    (4, 0.5, 15, 4, 1),
+    (5, 0.5, 30, 3, 2),
+]
+
+TARGET_LATENCY = 0.08  # 目标延迟（秒）
+WINDOW = 30  # 按最近多少帧的延迟判断
+RECOVER_RATIO = 0.6  # 延迟低于目标的该比例时恢复一级
+COOLDOWN = 1.0  # 两次调整的最短间隔（秒），等待调整生效
+
+
+class QosController:
+    def __init__(self, targetLatency=TARGET_LATENCY, window=WINDOW, cooldown=COOLDOWN, levels=LEVELS):
+        self.targetLatency = targetLatency
+        self.cooldown = cooldown
+        self.levels = levels
+        self.latencies = deque(maxlen=window)
+        self.level = 0
+        self.lastAdjustTime = 0
+        self.adjustments = 0
+        self.apply(0)
+
+    @staticmethod
+    def fromConfig(cfg, section='qos'):
+        return QosController(cfg.getfloat(section, 'target_latency_ms', fallback=TARGET_LATENCY * 1000) / 1000,
+                             cfg.getint(section, 'window', fallback=WINDOW),
+                             cfg.getfloat(section, 'cooldown', fallback=COOLDOWN))
+
+    def apply(self, level):
+        self.level = level
+        for knob, value in zip(KNOBS, self.levels[level]):
+            setattr(self, knob, value)
+
+    # 记录一帧的处理延迟（秒）
+    def record(self, latency):
+        self.latencies.append(latency)
+
+    # 窗口内延迟的90分位数
+    def recentLatency(self):
+        latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * 0.9)] if latencies else 0.0
+
+    # 根据最近的延迟调整级别，有调整时返回说明文字，否则返回None
+    def adjust(self, now=None):
+        now = time.time() if now is None else now
+        if len(self.latencies) < self.latencies.maxlen or now - self.lastAdjustTime < self.cooldown:
+            return None
+        latency = self.recentLatency()
+        if latency > self.targetLatency and self.level < len(self.levels) - 1:
+            level = self.level + 1
+        elif latency < self.targetLatency * RECOVER_RATIO and self.level > 0:
+            level = self.level - 1
+        else:
+            return None
+
+        previous = self.levels[self.level]
+        action = '降级' if level > self.level else '恢复'
+        self.apply(level)
+        self.lastAdjustTime = now
+        self.adjustments += 1
+        self.latencies.clear()  # 调整后重新采样
+        changes = ['{} {} -> {}'.format(knob, old, new)
+                   for knob, old, new in zip(KNOBS, previous, self.levels[level]) if old != new]
+        return '处理延迟{:.0f}ms（目标{:.0f}ms），{}至级别{}：{}'.format(
+            latency * 1000, self.targetLatency * 1000, action, level, '，'.join(changes))
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+
+import argparse
+import logging
+import logging.config
+import queue
+import sys
+import threading
+import time
+
+from collections import deque
+
+from attendance import aggregate, applyRollups
+from faceBase import getFaceBase
+
+# 识别事件：同一张人脸从出现到离开画面记为一条事件，记录识别到的身份、最佳置信度、首次/最后出现时间
+# 图像处理线程只在内存中聚合轨迹，结束的事件交给后台写入线程批量写入 recognition_events 表
+# 每条轨迹保留画质最好的几张人脸，报警、陌生人脸存档及识别事件只使用其中最好的一张
+
+TRACK_TIMEOUT = 2.0  # 轨迹超过该时间（秒）未再出现即视为结束
+BUFFER_SIZE = 1024  # 写入线程的缓冲区大小
+PENDING_LIMIT = 4096  # 缓冲区满时，图像处理线程最多暂存的事件数，超出后丢弃最早的事件
+BATCH_SIZE = 256  # 每个事务最多写入的事件数
+FLUSH_INTERVAL = 1.0  # 缓冲区不满一批时，最长等待时间（秒）
+
+# 保留策略：事件保留天数、事件表最大行数，每隔PRUNE_INTERVAL秒清理一次
+RETENTION_DAYS = 90
+MAX_EVENTS = 5000000
+PRUNE_INTERVAL = 3600
+PRUNE_BATCH_SIZE = 10000  # 每个事务最多删除的行数，避免长时间占用写锁
+
+# 人脸评分：清晰度（拉普拉斯方差）、尺寸、正脸程度（左右对称性）
+BEST_SHOTS = 3  # 每条轨迹保留的人脸数
+SHOT_SIZE = 64  # 评分前将人脸缩放到的边长，评分开销与人脸尺寸无关
+SHARPNESS_SCALE = 500.0  # 清晰度达到该值记满分
+FULL_SIZE = 160  # 人脸边长达到该值记满分
+ASYMMETRY_SCALE = 40.0  # 左右镜像的平均灰度差达到该值记零分
+SHOT_MARGIN = 20  # 裁剪时四周留出的像素
+
+SQL_INSERT_EVENT = '''INSERT INTO recognition_events
+                      (camera, track_id, face_id, stu_id, confidence, first_seen, last_seen, frames, snapshot)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+
+# 人脸评分，取值0~1，gray为人脸区域的灰度图
+def scoreShot(gray):
+    small = cv2.resize(gray, (SHOT_SIZE, SHOT_SIZE), interpolation=cv2.INTER_AREA)
+    sharpness = min(cv2.Laplacian(small, cv2.CV_64F).var() / SHARPNESS_SCALE, 1.0)
+    size = min(min(gray.shape[:2]) / FULL_SIZE, 1.0)
+    frontalness = max(1.0 - cv2.absdiff(small, cv2.flip(small, 1)).mean() / ASYMMETRY_SCALE, 0.0)
+    return 0.4 * sharpness + 0.3 * size + 0.3 * frontalness
+
+
+# 轨迹的最佳人脸缓冲区：每帧只对人脸评分，评分进入前几名时才从原始图像中裁剪并保存
+class BestShotBuffer:
+    def __init__(self, size=BEST_SHOTS):
+        self.size = size
+        self.shots = []  # [(score, face)]，按评分降序
+
+    # frame为未标注的原始图像，gray为其灰度图
+    def offer(self, frame, gray, rect):
+        x, y, w, h = rect
+        score = scoreShot(gray[y:y + h, x:x + w])
+        if len(self.shots) == self.size and score <= self.shots[-1][0]:
+            return False
+        face = frame[max(y - SHOT_MARGIN, 0):y + h + SHOT_MARGIN, max(x - SHOT_MARGIN, 0):x + w + SHOT_MARGIN].copy()
+        self.shots.append((score, face))
+        self.shots.sort(key=lambda shot: shot[0], reverse=True)
+        del self.shots[self.size:]
+        return True
+
+    # 评分最高的人脸，没有时返回None
+    def best(self):
+        return self.shots[0][1] if self.shots else None
+
+
+# 识别轨迹：按人脸中心点匹配前后帧的检测结果，置信度（LBPH距离）越小越好
+class RecognitionTrack:
+    def __init__(self, track_id, rect, now):
+        self.track_id = track_id
+        self.rect = rect
+        self.face_id = None
+        self.stu_id = None
+        self.confidence = float('inf')
+        self.firstSeen = now
+        self.lastSeen = now
+        self.frames = 0
+        self.bestShots = BestShotBuffer()
+        self.isAlarmed = False  # 置信度曾超出自动报警阈值，只有这类轨迹的人脸存入陌生人脸存档
+        self.prediction = None  # 最近一次识别器的预测结果 (face_id, confidence)，降级时用于跳过重复识别
+
+    # 当前检测到的人脸与轨迹互相包含中心点时，认为是同一张人脸（与人脸跟踪器的匹配规则一致）
+    def matches(self, rect):
+        x, y, w, h = rect
+        t_x, t_y, t_w, t_h = self.rect
+        return (t_x <= x + 0.5 * w <= t_x + t_w and t_y <= y + 0.5 * h <= t_y + t_h and
+                x <= t_x + 0.5 * t_w <= x + w and y <= t_y + 0.5 * t_h <= y + h)
+
+    def update(self, rect, face_id, stu_id, confidence, now, frame=None, gray=None):
+        self.rect = rect
+        if frame is not None:
+            self.bestShots.offer(frame, gray, rect)
+        self.lastSeen = now
+        self.frames += 1
+        # 轨迹的身份取置信度最好的一次识别结果，陌生人脸face_id为None
+        if confidence < self.confidence:
+            self.confidence = confidence
+            self.face_id = face_id
+            self.stu_id = stu_id
+
+    # 触发过报警的陌生人脸事件附带轨迹的最佳人脸，由写入线程存入陌生人脸存档
+    def toEvent(self, camera):
+        snapshot = self.bestShots.best() if self.isAlarmed and self.stu_id is None else None
+        return (camera, self.track_id, self.face_id, self.stu_id, self.confidence, self.firstSeen, self.lastSeen,
+                self.frames, snapshot)
+
+
+# 在图像处理线程中聚合每帧的识别结果，不访问磁盘
+class RecognitionTracker:
+    def __init__(self, camera, timeout=TRACK_TIMEOUT, pendingLimit=PENDING_LIMIT):
+        self.camera = camera
+        self.timeout = timeout
+        self.tracks = []
+        self.nextTrackId = int(time.time() * 1000)  # 以启动时间为起点，重启后轨迹编号不重复
+        self.pending = deque(maxlen=pendingLimit)  # 已结束、尚未交给写入线程的事件
+        self.dropped = 0
+
+    # 更新一帧的识别结果，recognitions为 [(rect, face_id, stu_id, confidence)]，返回各人脸所属的轨迹
+    # 传入未标注的原始图像frame及其灰度图gray时，同时更新各轨迹的最佳人脸
+    def update(self, recognitions, now=None, frame=None, gray=None):
+        now = time.time() if now is None else now
+        matched = []
+        for rect, face_id, stu_id, confidence in recognitions:
+            track = next((track for track in self.tracks if track not in matched and track.matches(rect)), None)
+            if track is None:
+                track = RecognitionTrack(self.nextTrackId, rect, now)
+                self.nextTrackId += 1
+                self.tracks.append(track)
+            track.update(rect, face_id, stu_id, confidence, now, frame, gray)
+            matched.append(track)
+
+        for track in [track for track in self.tracks if now - track.lastSeen > self.timeout]:
+            self.close(track)
+        return matched
+
+    # 与rect匹配的轨迹，不更新轨迹状态，没有时返回None
+    def match(self, rect):
+        return next((track for track in self.tracks if track.matches(rect)), None)
+
+    # 结束轨迹，生成事件
+    def close(self, track):
+        self.tracks.remove(track)
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append(track.toEvent(self.camera))
+
+    # 结束全部轨迹（关闭摄像头时）
+    def closeAll(self):
+        for track in list(self.tracks):
+            self.close(track)
+
+    # 将暂存的事件交给写入线程；写入线程缓冲区已满时保留在本地，下一帧再试
+    def flush(self, writer):
+        while self.pending and writer.offer(self.pending[0]):
+            self.pending.popleft()
+
+
+# 识别事件写入线程：批量写入，定期按保留策略清理
+# archive为与报警线程共享的陌生人脸存档，不为None时事件附带的人脸存入存档，事件只记录人脸图像路径
+class RecognitionEventWriter(threading.Thread):
+    def __init__(self, faceBase, bufferSize=BUFFER_SIZE, retentionDays=RETENTION_DAYS, maxEvents=MAX_EVENTS,
+                 archive=None):
+        super(RecognitionEventWriter, self).__init__(daemon=True)
+        self.faceBase = faceBase
+        self.archive = archive
+        self.buffer = queue.Queue(maxsize=bufferSize)
+        self.retentionDays = retentionDays
+        self.maxEvents = maxEvents
+        self.isRunning = True
+        self.written = 0
+        self.lastPruneTime = 0
+
+    # 非阻塞提交一条事件，缓冲区已满时返回False，由调用方暂存后重试
+    def offer(self, event):
+        try:
+            self.buffer.put_nowait(event)
+        except queue.Full:
+            return False
+        return True
+
+    def run(self):
+        while self.isRunning or not self.buffer.empty():
+            batch = []
+            try:
+                batch.append(self.buffer.get(timeout=FLUSH_INTERVAL))
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self.buffer.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self.write([self.archiveSnapshot(event) for event in batch])
+            if time.time() - self.lastPruneTime > PRUNE_INTERVAL:
+                self.lastPruneTime = time.time()
+                try:
+                    prune(self.faceBase, self.retentionDays, self.maxEvents)
+                except Exception as e:
+                    logging.error('清理识别事件失败：{}'.format(e))
+
+    # 将事件附带的人脸图像存入陌生人脸存档，替换为存档中的图像路径；报警线程已存档该轨迹时沿用其路径
+    def archiveSnapshot(self, event):
+        snapshot = event[8]
+        if snapshot is None or isinstance(snapshot, str):
+            return event
+        path = None
+        if self.archive is not None:
+            try:
+                cluster_id, path = self.archive.add(snapshot, event[6], key=(event[0], event[1]))
+            except Exception as e:
+                logging.error('陌生人脸存档失败：{}'.format(e))
+        return event[:8] + (path,)
+
+    # 写入一批事件，并在同一事务中更新考勤汇总
+    def write(self, batch):
+        try:
+            with self.faceBase.transaction() as conn:
+                conn.executemany(SQL_INSERT_EVENT, batch)
+                applyRollups(conn, aggregate(batch))
+        except Exception as e:
+            logging.error('写入{}条识别事件失败：{}'.format(len(batch), e))
+        else:
+            self.written += len(batch)
+
+    # 停止写入线程，缓冲区中的事件全部写入后返回
+    def stop(self):
+        self.isRunning = False
+        self.join()
+
+
+# 按保留策略清理识别事件：删除超过retentionDays天的事件，以及超出maxEvents行的最早事件，返回删除的行数
+def prune(faceBase, retentionDays=RETENTION_DAYS, maxEvents=MAX_EVENTS):
+    deleted = 0
+    if retentionDays:
+        cutoff = time.time() - retentionDays * 86400
+        while True:
+            count = faceBase.execute('''DELETE FROM recognition_events WHERE id IN
+                                        (SELECT id FROM recognition_events WHERE first_seen < ? LIMIT ?)''',
+                                     (cutoff, PRUNE_BATCH_SIZE))
+            deleted += count
+            if count < PRUNE_BATCH_SIZE:
+                break
+    if maxEvents:
+        # id单调递增，超出行数时按id删除最早的事件
+        excess = faceBase.queryOne('SELECT Count(*) FROM recognition_events')[0] - maxEvents
+        while excess > 0:
+            count = faceBase.execute('''DELETE FROM recognition_events WHERE id IN
+                                        (SELECT id FROM recognition_events ORDER BY id LIMIT ?)''',
+                                     (min(excess, PRUNE_BATCH_SIZE),))
+            deleted += count
+            excess -= count
+            if not count:
+                break
+    return deleted
+
+
+# 查询时间范围内的识别事件，stu_id不为None时只查询该用户
+def queryEvents(faceBase, start, end, stu_id=None, limit=1000):
+    if stu_id is None:
+        return faceBase.query('''SELECT camera, track_id, face_id, stu_id, confidence, first_seen, last_seen, frames,
+                                 snapshot FROM recognition_events WHERE first_seen >= ? AND first_seen < ?
+                                 ORDER BY first_seen LIMIT ?''', (start, end, limit))
+    return faceBase.query('''SELECT camera, track_id, face_id, stu_id, confidence, first_seen, last_seen, frames,
+                             snapshot FROM recognition_events WHERE stu_id = ? AND first_seen >= ? AND first_seen < ?
+                             ORDER BY first_seen LIMIT ?''', (stu_id, start, end, limit))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='识别事件维护')
+    parser.add_argument('--database', default='./FaceBase.db')
+    subparsers = parser.add_subparsers(dest='command')
+
+    pruneParser = subparsers.add_parser('prune', help='按保留策略清理识别事件')
+    pruneParser.add_argument('--days', type=int, default=RETENTION_DAYS, help='事件保留天数，0表示不限')
+    pruneParser.add_argument('--max-events', type=int, default=MAX_EVENTS, help='事件表最大行数，0表示不限')
+
+    args = parser.parse_args()
+    logging.config.fileConfig('./config/logging.cfg')
+
+    if args.command == 'prune':
+        print('已删除{}条识别事件'.format(prune(getFaceBase(args.database), args.days, args.max_events)))
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+import numpy as np
+
+import argparse
+import logging
+import logging.config
+import multiprocessing
+import os
+import sys
+import time
+
+from collections import OrderedDict, namedtuple
+from configparser import ConfigParser
+from contextlib import contextmanager
+
+from datasetStore import PACK_SUFFIX, PackReader, parseStuId
+from faceBase import getFaceBase
+from faceDetector import DETECTOR_CONFIG, loadDetector
+from featureCache import FeatureCache
+from modelStore import LBPHModel, ModelBuilder, resolveModelPath, updateModelFile
+
+# 训练数据准备：图片路径（或打包数据集中的记录）以流的方式分发到进程池，每个工作进程只加载一次人脸检测器，
+# 在工作进程内完成读图、人脸检测与LBPH特征提取，主进程只接收直方图
+# 人脸检测器与核心框架共用 config/detector.cfg 的设置（不使用分块检测）
+
+# LBPH参数，默认值与cv2.face.LBPHFaceRecognizer_create()一致，可在 config/trainer.cfg 中修改
+TRAINER_CONFIG = './config/trainer.cfg'
+LBPH_PARAMS = {'radius': 1, 'neighbors': 8, 'gridX': 8, 'gridY': 8}
+
+# 每次分发给工作进程的图片数
+DEFAULT_CHUNK_SIZE = 16
+
+# 工作进程内常驻的人脸检测器与特征提取器
+workerDetector = None
+workerModel = None
+workerEqualizeHist = False
+
+# 已打开的打包数据集，{路径: (文件大小, PackReader)}
+packReaders = {}
+
+# 打包数据集记录的状态，字段与os.stat_result一致，供特征缓存校验
+SourceStat = namedtuple('SourceStat', ['st_size', 'st_mtime_ns'])
+
+
+# 读取LBPH参数，配置文件不存在时使用默认值
+def loadLbphParams(path=TRAINER_CONFIG):
+    cfg = ConfigParser()
+    cfg.read(path, encoding='utf-8-sig')
+    return {'radius': cfg.getint('lbph', 'radius', fallback=LBPH_PARAMS['radius']),
+            'neighbors': cfg.getint('lbph', 'neighbors', fallback=LBPH_PARAMS['neighbors']),
+            'gridX': cfg.getint('lbph', 'grid_x', fallback=LBPH_PARAMS['gridX']),
+            'gridY': cfg.getint('lbph', 'grid_y', fallback=LBPH_PARAMS['gridY'])}
+
+
+# 检测人脸，返回第一张人脸的灰度图及其位置
+def detectFace(img, faceDetector, equalizeHist=False):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    if equalizeHist:
+        gray = cv2.equalizeHist(gray)
+    faces = faceDetector.detect(gray)
+
+    if len(faces) == 0:
+        return None, None
+    (x, y, w, h) = faces[0]
+    return gray[y:y + h, x:x + w], faces[0]
+
+
+# 工作进程初始化，检测器随参数传入，模型在首次检测时加载
+def initWorker(faceDetector, equalizeHist, params):
+    global workerDetector, workerModel, workerEqualizeHist
+    workerDetector = faceDetector
+    workerModel = LBPHModel(None, [], **params)
+    workerEqualizeHist = equalizeHist
+
+
+# 打包数据集中的记录以 {打包文件路径}#{序号} 表示
+def isPackRecord(source):
+    return '#' in source and source.rsplit('#', 1)[0].endswith(PACK_SUFFIX)
+
+
+def splitPackRecord(source):
+    path, index = source.rsplit('#', 1)
+    return path, int(index)
+
+
+# 获取打包数据集读取器，文件有追加时重新映射
+def getPackReader(path):
+    size = os.path.getsize(path)
+    cached = packReaders.get(path)
+    if cached is None or cached[0] != size:
+        cached = (size, PackReader(path))
+        packReaders[path] = cached
+    return cached[1]
+
+
+# 读取图片或打包数据集中的记录
+def loadSource(source):
+    if isPackRecord(source):
+        path, index = splitPackRecord(source)
+        return np.asarray(getPackReader(path)[index])
+    return cv2.imread(source)
+
+
+# 图片或打包记录的状态；打包记录只追加不修改，以CRC32与采集时间作为其状态
+def sourceStat(source):
+    if isPackRecord(source):
+        path, index = splitPackRecord(source)
+        timestamp, checksum = getPackReader(path).meta(index)
+        return SourceStat(checksum, int(timestamp * 1e9))
+    return os.stat(source)
+
+
+# 图片或打包记录所属的人脸数据（用户目录或打包文件）
+def sourceDataset(source):
+    if isPackRecord(source):
+        return splitPackRecord(source)[0]
+    return os.path.dirname(source)
+
+
+# 处理单张图片，返回 (face_id, source, histogram, error)
+# 未检测到人脸时histogram与error均为None
+def processImage(task):
+    face_id, source = task
+    try:
+        image = loadSource(source)
+        if image is None:
+            return face_id, source, None, '无法读取图片'
+        face, rect = detectFace(image, workerDetector, workerEqualizeHist)
+        if face is None:
+            return face_id, source, None, None
+        return face_id, source, workerModel.computeHistogram(face), None
+    except Exception as e:
+        return face_id, source, None, str(e)
+
+
+# 列出用户人脸数据目录下的图片
+def listImages(subject_dir_path):
+    return sorted(entry.path for entry in os.scandir(subject_dir_path)
+                  if entry.is_file() and not entry.name.startswith('.'))
+
+
+# 列出用户的全部人脸样本：打包文件中的记录，或JPEG目录下的图片
+def listSources(path):
+    if path.endswith(PACK_SUFFIX):
+        return ['{}#{}'.format(path, index) for index in range(len(getPackReader(path)))]
+    return listImages(path)
+
+
+# 列出人脸库中各用户的人脸数据，返回 {学号: 路径}；同时存在打包文件与JPEG目录时以打包文件为准
+def listDatasets(datasets):
+    datasetPaths = OrderedDict()
+    for name in sorted(os.listdir(datasets)):
+        path = datasets + '/' + name
+        stu_id = parseStuId(name)
+        if stu_id is not None:
+            datasetPaths[stu_id] = path
+        elif name.startswith('stu_') and os.path.isdir(path):
+            datasetPaths.setdefault(name.replace('stu_', '', 1), path)
+    return datasetPaths
+
+
+# 并行提取人脸特征，按任务顺序逐个产出 (face_id, source, histogram, error)
+# tasks 为 (face_id, source) 序列，source为图片路径或打包记录；faceDetector省略时按配置文件创建
+def extractHistograms(tasks, equalizeHist=False, workers=None, chunkSize=DEFAULT_CHUNK_SIZE,
+                      faceDetector=None, params=None):
+    params = params or loadLbphParams()
+    faceDetector = faceDetector or loadDetector(allowTiled=False)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        initWorker(faceDetector, equalizeHist, params)
+        for task in tasks:
+            yield processImage(task)
+        return
+
+    pool = multiprocessing.Pool(workers, initializer=initWorker, initargs=(faceDetector, equalizeHist, params))
+    try:
+        for result in pool.imap(processImage, tasks, chunkSize):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+# 影响特征提取结果的全部参数，作为特征缓存键的一部分
+def featureParams(equalizeHist=False, faceDetector=None, params=None):
+    faceDetector = faceDetector or loadDetector(allowTiled=False)
+    return dict(faceDetector.describe(), equalize_hist=bool(equalizeHist), lbph=params or loadLbphParams())
+
+
+# 带缓存的特征提取：命中缓存的图片直接产出，其余图片交由进程池处理并写回缓存
+def extractHistogramsCached(tasks, cache, equalizeHist=False, workers=None, chunkSize=DEFAULT_CHUNK_SIZE,
+                            faceDetector=None, params=None):
+    misses = []
+    stats = {}
+    for face_id, source in tasks:
+        try:
+            isHit, histogram, stat = cache.get(source, sourceStat(source))
+        except (OSError, IndexError) as e:
+            yield face_id, source, None, str(e)
+            continue
+        if isHit:
+            yield face_id, source, histogram, None
+        else:
+            misses.append((face_id, source))
+            stats[source] = stat
+
+    for face_id, source, histogram, error in extractHistograms(misses, equalizeHist, workers, chunkSize,
+                                                               faceDetector, params):
+        if not error:
+            cache.put(source, stats.pop(source), histogram)
+        yield face_id, source, histogram, error
+    cache.flush()
+
+
+# 训练任务被取消
+class TrainingCancelled(Exception):
+    pass
+
+
+# 训练任务：扫描人脸库、提取特征并生成/更新模型，不依赖GUI，可在后台进程或命令行中运行
+# 训练过程中通过emit回调输出事件（dict），事件类型：
+#   log       日志信息 message
+#   stage     阶段开始 stage
+#   progress  处理进度 users/processed/total/faces
+#   finished  训练完成 report
+class TrainingJob:
+    def __init__(self, database='./FaceBase.db', datasets='./datasets',
+                 trainingData='./recognizer/trainingData.lbph', featureCache='./recognizer/featureCache.db',
+                 equalizeHist=False, fullRetrain=False, workers=None, emit=None, cancelEvent=None,
+                 detectorConfig=DETECTOR_CONFIG, trainerConfig=TRAINER_CONFIG):
+        self.database = database
+        self.datasets = datasets
+        self.trainingData = trainingData
+        self.featureCache = featureCache
+        self.isEqualizeHistEnabled = equalizeHist
+        self.isFullRetrainEnabled = fullRetrain
+        self.workers = workers
+        self.emitCallback = emit
+        self.cancelEvent = cancelEvent
+        self.faceDetector = loadDetector(detectorConfig, allowTiled=False)
+        self.lbphParams = loadLbphParams(trainerConfig)
+
+        self.timings = OrderedDict()
+        self.report = {}
+
+    # 输出事件
+    def emit(self, eventType, **kwargs):
+        kwargs['type'] = eventType
+        if self.emitCallback:
+            self.emitCallback(kwargs)
+
+    def log(self, message):
+        self.emit('log', message=message)
+
+    # 检查是否已请求取消
+    def checkCancelled(self):
+        if self.cancelEvent is not None and self.cancelEvent.is_set():
+            raise TrainingCancelled
+
+    # 阶段计时
+    @contextmanager
+    def stage(self, name):
+        self.checkCancelled()
+        self.emit('stage', stage=name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - start
+
+    # 人脸数据签名（样本数、最近修改时间），用于判断用户的人脸数据是否有变动
+    @staticmethod
+    def getDatasetSignature(path):
+        if path.endswith(PACK_SUFFIX):
+            return '{}:{}'.format(len(getPackReader(path)), os.stat(path).st_mtime_ns)
+        count = 0
+        latest = 0
+        for entry in os.scandir(path):
+            if entry.name.startswith('.'):
+                continue
+            count += 1
+            latest = max(latest, entry.stat().st_mtime_ns)
+        return '{}:{}'.format(count, latest)
+
+    # 扫描人脸库，返回待处理的 (face_id, source) 列表及各用户人脸数据签名
+    # 用户同时存在打包文件与JPEG目录时以打包文件为准；传入已有模型时，跳过人脸数据签名未变动的用户
+    def scan(self, model=None):
+        datasetPaths = listDatasets(self.datasets)
+        tasks = []
+        sources = {}
+
+        trainedSources = model.meta.get('sources', {}) if model is not None else {}
+        # 一次查询全部用户的face_id，尚未分配face_id的用户在同一事务中批量分配
+        faceBase = getFaceBase(self.database)
+        faceIds = {row[0]: row[1] for row in faceBase.query('SELECT stu_id, face_id FROM users')}
+        for stu_id in list(datasetPaths):
+            if stu_id not in faceIds:
+                logging.warning('数据库中找不到学号为{}的用户记录'.format(stu_id))
+                self.log('发现学号为{}的人脸数据，但数据库中找不到相应记录，已忽略'.format(stu_id))
+                del datasetPaths[stu_id]
+        faceIds.update(faceBase.allocateFaceIds(
+            [stu_id for stu_id in datasetPaths if faceIds[stu_id] is None or faceIds[stu_id] < 1]))
+
+        # 遍历人脸库
+        for stu_id, path in datasetPaths.items():
+            self.checkCancelled()
+            face_id = faceIds[stu_id]
+            signature = TrainingJob.getDatasetSignature(path)
+            sources[str(face_id)] = signature
+            if trainedSources.get(str(face_id)) == signature:
+                continue
+            for source in listSources(path):
+                tasks.append((face_id, source))
+
+        self.report['users'] = len(sources)
+        self.report['images'] = len(tasks)
+        self.emit('progress', users=len(sources), processed=0, total=len(tasks), faces=0)
+        return tasks, sources
+
+    # 并行提取人脸特征（已缓存的图片直接复用），实时输出进度及失败信息，逐个产出 (face_id, histogram)
+    # retainDatasets不为None时，清除其它人脸数据目录的缓存
+    def extract(self, tasks, retainDatasets=None):
+        total = len(tasks)
+        faceCount = 0
+        lastEmit = 0
+        cache = FeatureCache(self.featureCache,
+                             featureParams(self.isEqualizeHistEnabled, self.faceDetector, self.lbphParams))
+        try:
+            if retainDatasets is not None:
+                cache.retainDatasets(retainDatasets)
+            for processed, (face_id, source, histogram, error) in enumerate(
+                    extractHistogramsCached(tasks, cache, self.isEqualizeHistEnabled, self.workers,
+                                            faceDetector=self.faceDetector, params=self.lbphParams), 1):
+                self.checkCancelled()
+                if error:
+                    logging.warning('处理图片{}失败：{}'.format(source, error))
+                    self.log('Warning：处理图片{}失败，已忽略'.format(source))
+                if histogram is not None:
+                    faceCount += 1
+                    yield face_id, histogram
+                # 进度事件限流，避免淹没事件队列
+                now = time.perf_counter()
+                if now - lastEmit >= 0.2 or processed == total:
+                    lastEmit = now
+                    self.emit('progress', users=self.report.get('users', 0), processed=processed, total=total,
+                              faces=faceCount)
+        finally:
+            self.report['faces'] = faceCount
+            self.report['cacheHits'] = cache.hits
+            self.report['cacheMisses'] = cache.misses
+            cache.close()
+
+    # 完全重新训练
+    def fullTrain(self):
+        self.report['mode'] = 'full'
+        with self.stage('scan'):
+            tasks, sources = self.scan()
+        # 直方图流式写入，保存为可内存映射的二进制模型，YAML格式可通过modelStore.py导入/导出
+        builder = ModelBuilder(self.trainingData, **self.lbphParams)
+        try:
+            with self.stage('extract'):
+                retainDatasets = {sourceDataset(source) for face_id, source in tasks}
+                for face_id, histogram in self.extract(tasks, retainDatasets):
+                    builder.append(histogram, face_id)
+            if not len(builder):
+                raise ValueError('未检测到可用于训练的人脸')
+            with self.stage('write'):
+                builder.commit({'sources': sources, 'equalize_hist': self.isEqualizeHistEnabled})
+        except BaseException:
+            builder.discard()
+            raise
+        self.log('Info：完全重新训练，用户数：{}，人脸数：{}'.format(len(sources), len(builder)))
+
+    # 增量训练：仅对新增及人脸数据有变动的用户提取特征，并剔除已删除用户的人脸数据
+    def incrementalTrain(self):
+        model = LBPHModel.load(self.trainingData)
+        if model.meta.get('equalize_hist') != self.isEqualizeHistEnabled:
+            del model
+            self.log('Info：图像预处理参数与已训练的人脸数据不一致，将完全重新训练')
+            self.fullTrain()
+            return
+        if {'radius': model.radius, 'neighbors': model.neighbors, 'gridX': model.gridX,
+                'gridY': model.gridY} != self.lbphParams:
+            del model
+            self.log('Info：LBPH参数与已训练的人脸数据不一致，将完全重新训练')
+            self.fullTrain()
+            return
+
+        self.report['mode'] = 'incremental'
+        with self.stage('scan'):
+            tasks, sources = self.scan(model)
+            trainedSources = model.meta.get('sources', {})
+            unchanged = {int(face_id) for face_id, signature in sources.items()
+                         if trainedSources.get(face_id) == signature}
+            removeLabels = set(int(label) for label in np.unique(model.labels)) - unchanged
+            del model
+
+        labels = []
+        histograms = []
+        with self.stage('extract'):
+            for face_id, histogram in self.extract(tasks):
+                labels.append(face_id)
+                histograms.append(histogram)
+
+        with self.stage('write'):
+            self.checkCancelled()
+            updateModelFile(self.trainingData, removeLabels, histograms, labels,
+                            {'sources': sources, 'equalize_hist': self.isEqualizeHistEnabled})
+        self.log('Info：增量训练，更新用户数：{}，新增人脸数：{}，移除用户数：{}'.format(
+            len(sources) - len(unchanged), len(labels), len(removeLabels - set(int(f) for f in sources))))
+
+    # 执行训练，返回耗时报告
+    def run(self):
+        start = time.perf_counter()
+        if not os.path.isdir(self.datasets):
+            raise FileNotFoundError(self.datasets)
+        if os.path.dirname(self.trainingData) and not os.path.exists(os.path.dirname(self.trainingData)):
+            os.makedirs(os.path.dirname(self.trainingData))
+        if self.isFullRetrainEnabled or resolveModelPath(self.trainingData) is None:
+            self.fullTrain()
+        else:
+            self.incrementalTrain()
+        self.report['timings'] = dict(self.timings)
+        self.report['total'] = time.perf_counter() - start
+        self.emit('finished', report=self.report)
+        return self.report
+
+
+# 格式化耗时报告
+def formatReport(report):
+    lines = ['训练模式：{}'.format('完全重新训练' if report.get('mode') == 'full' else '增量训练'),
+             '用户数：{}，待处理图片：{}，检测到人脸：{}'.format(
+                 report.get('users', 0), report.get('images', 0), report.get('faces', 0)),
+             '特征缓存命中：{}，未命中：{}'.format(report.get('cacheHits', 0), report.get('cacheMisses', 0))]
+    for name, seconds in report.get('timings', {}).items():
+        lines.append('阶段 {}：{:.2f}s'.format(name, seconds))
+    total = report.get('total', 0)
+    lines.append('总耗时：{:.2f}s'.format(total))
+    if total > 0 and report.get('images'):
+        lines.append('吞吐量：{:.1f} 张/s'.format(report['images'] / total))
+    return '\n'.join(lines)
+
+
+# 后台训练进程入口，事件经eventQueue回传，训练结束后以 finished/cancelled/failed 事件收尾
+def runTrainingProcess(options, eventQueue, cancelEvent):
+    job = TrainingJob(emit=eventQueue.put, cancelEvent=cancelEvent, **options)
+    try:
+        job.run()
+    except TrainingCancelled:
+        eventQueue.put({'type': 'cancelled'})
+    except FileNotFoundError as e:
+        eventQueue.put({'type': 'failed', 'reason': 'datasets', 'message': str(e)})
+    except Exception as e:
+        eventQueue.put({'type': 'failed', 'reason': 'error', 'message': '{}: {}'.format(type(e).__name__, e)})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='训练人脸数据（可用于计划任务定时重新训练）')
+    parser.add_argument('--full', action='store_true', help='完全重新训练，默认仅增量更新')
+    parser.add_argument('--equalize-hist', action='store_true', help='执行直方图均衡化')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数，默认为CPU核心数')
+    parser.add_argument('--database', default='./FaceBase.db')
+    parser.add_argument('--datasets', default='./datasets')
+    parser.add_argument('--model', default='./recognizer/trainingData.lbph')
+    parser.add_argument('--cache', default='./recognizer/featureCache.db')
+    args = parser.parse_args()
+
+    logging.config.fileConfig('./config/logging.cfg')
+
+    def printEvent(event):
+        if event['type'] == 'log':
+            print(event['message'])
+        elif event['type'] == 'stage':
+            print('Stage：{}'.format(event['stage']))
+        elif event['type'] == 'progress':
+            print('已处理图片 {}/{}，检测到人脸 {}'.format(event['processed'], event['total'], event['faces']),
+                  flush=True)
+
+    job = TrainingJob(args.database, args.datasets, args.model, args.cache, args.equalize_hist, args.full,
+                      args.workers, emit=printEvent)
+    try:
+        print(formatReport(job.run()))
+    except (KeyboardInterrupt, TrainingCancelled):
+        print('训练已取消，模型文件未改动')
+        sys.exit(130)
+    except Exception as e:
+        logging.error('训练人脸数据失败：{}'.format(e))
+        print('训练失败：{}'.format(e))
+        sys.exit(1)
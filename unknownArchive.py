@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+
+import argparse
+import logging
+import logging.config
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import datetime
+
+from datasetStore import PackWriter, packPath
+
+# 陌生人脸存档：报警时只保存裁剪出的人脸及缩略图，按感知哈希把同一陌生人的多次出现归为一组
+#   ./unknown/faces/{id}.jpg    人脸图像
+#   ./unknown/thumbs/{id}.jpg   缩略图，浏览时只读取缩略图
+#   ./unknown/index.db          索引：分组、人脸、感知哈希、文件大小及最后访问时间
+# 总大小超出上限时先删除过期的人脸，再按最后访问时间删除最久未访问的人脸
+# 核心程序只创建一个存档实例，由报警线程与识别事件写入线程共享，所有访问都持有同一把锁
+
+THUMBNAIL_SIZE = (64, 64)
+JPEG_QUALITY = 90
+
+CLUSTER_DISTANCE = 12  # 与分组中最近人脸的感知哈希距离不超过该值时归入同一分组（64位哈希）
+DUPLICATE_DISTANCE = 4  # 与分组最后一张人脸几乎相同时不再保存图像，只更新出现次数
+CLUSTER_HASHES = 8  # 每个分组参与比较的最近人脸数
+VISIT_GAP = 60  # 距分组最后出现时间超过该值（秒）才记为一次新的出现
+RECENT_KEYS = 1024  # 记住最近存档的轨迹数，同一轨迹的人脸只保存一次
+
+MAX_BYTES = 500 * 1024 * 1024
+MAX_AGE_DAYS = 30
+
+
+# 差值哈希：缩小为9x8灰度图后比较相邻像素，得到64位整数
+def dHash(face):
+    if face.ndim == 3:
+        face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(face, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    # SQLite只支持有符号64位整数
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def hammingDistance(a, b):
+    return bin((a ^ b) & 0xffffffffffffffff).count('1')
+
+
+class UnknownArchive:
+    def __init__(self, root='./unknown', maxBytes=MAX_BYTES, maxAgeDays=MAX_AGE_DAYS):
+        self.root = root
+        self.maxBytes = maxBytes
+        self.maxAgeDays = maxAgeDays
+        for name in ('faces', 'thumbs'):
+            if not os.path.isdir(os.path.join(root, name)):
+                os.makedirs(os.path.join(root, name))
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS clusters (
+                id INTEGER PRIMARY KEY,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                visits INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS faces (
+                id INTEGER PRIMARY KEY,
+                cluster_id INTEGER NOT NULL,
+                timestamp REAL NOT NULL,
+                hash INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS faces_cluster_id ON faces (cluster_id, id);
+            CREATE INDEX IF NOT EXISTS faces_last_access ON faces (last_access);
+            CREATE INDEX IF NOT EXISTS faces_timestamp ON faces (timestamp);
+            CREATE INDEX IF NOT EXISTS clusters_last_seen ON clusters (last_seen);
+        ''')
+        self.conn.commit()
+        self.totalBytes = self.conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM faces').fetchone()[0]
+
+        # 内存中保留每个分组最近几张人脸的哈希，归组时不必查询数据库
+        self.clusterHashes = {}
+        for cluster_id, face_hash in self.conn.execute('SELECT cluster_id, hash FROM faces ORDER BY id'):
+            hashes = self.clusterHashes.setdefault(cluster_id, [])
+            hashes.append(face_hash)
+            del hashes[:-CLUSTER_HASHES]
+
+        self.recentKeys = OrderedDict()  # 轨迹 -> (cluster_id, 人脸图像路径)
+
+    def facePath(self, face_id):
+        return os.path.join(self.root, 'faces', '{}.jpg'.format(face_id))
+
+    def thumbnailPath(self, face_id):
+        return os.path.join(self.root, 'thumbs', '{}.jpg'.format(face_id))
+
+    # 查找哈希最接近的分组，返回 (cluster_id, 距离)，没有分组时返回 (None, None)
+    def nearestCluster(self, face_hash):
+        best = (None, None)
+        for cluster_id, hashes in self.clusterHashes.items():
+            distance = min(hammingDistance(face_hash, h) for h in hashes)
+            if best[1] is None or distance < best[1]:
+                best = (cluster_id, distance)
+        return best
+
+    # 存档一张陌生人脸，返回 (cluster_id, 人脸图像路径)；与分组最后一张人脸几乎相同时不保存图像，路径为该人脸的图像
+    # key标识人脸所属的轨迹，同一轨迹已存档时直接返回上次的结果（报警与识别事件可能先后提交同一轨迹）
+    def add(self, face, timestamp=None, key=None):
+        with self.lock:
+            if key is not None and key in self.recentKeys:
+                return self.recentKeys[key]
+            result = self.addFace(face, timestamp)
+            if key is not None:
+                self.recentKeys[key] = result
+                if len(self.recentKeys) > RECENT_KEYS:
+                    self.recentKeys.popitem(last=False)
+            return result
+
+    def addFace(self, face, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        face_hash = dHash(face)
+        cluster_id, distance = self.nearestCluster(face_hash)
+
+        with self.conn:
+            if cluster_id is None or distance > CLUSTER_DISTANCE:
+                cluster_id = self.conn.execute('INSERT INTO clusters (first_seen, last_seen, visits) VALUES (?, ?, 1)',
+                                               (timestamp, timestamp)).lastrowid
+                self.clusterHashes[cluster_id] = []
+            else:
+                self.conn.execute('''UPDATE clusters SET visits=visits+(? - last_seen > ?),
+                                     last_seen=MAX(last_seen, ?) WHERE id=?''',
+                                  (timestamp, VISIT_GAP, timestamp, cluster_id))
+                hashes = self.clusterHashes[cluster_id]
+                if hashes and hammingDistance(face_hash, hashes[-1]) <= DUPLICATE_DISTANCE:
+                    last = self.conn.execute('SELECT MAX(id) FROM faces WHERE cluster_id=?', (cluster_id,)).fetchone()
+                    return cluster_id, self.facePath(last[0])
+
+            ret, faceData = cv2.imencode('.jpg', face, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            ret, thumbData = cv2.imencode('.jpg', cv2.resize(face, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA))
+            size = len(faceData) + len(thumbData)
+            face_id = self.conn.execute('''INSERT INTO faces (cluster_id, timestamp, hash, bytes, last_access)
+                                           VALUES (?, ?, ?, ?, ?)''',
+                                        (cluster_id, timestamp, face_hash, size, timestamp)).lastrowid
+            faceData.tofile(self.facePath(face_id))
+            thumbData.tofile(self.thumbnailPath(face_id))
+
+        self.totalBytes += size
+        hashes = self.clusterHashes[cluster_id]
+        hashes.append(face_hash)
+        del hashes[:-CLUSTER_HASHES]
+        if self.totalBytes > self.maxBytes:
+            self.evict()
+        return cluster_id, self.facePath(face_id)
+
+    # 删除人脸记录及图像文件，不再有人脸的分组一并删除
+    def removeFaces(self, rows):
+        with self.lock:
+            if not rows:
+                return
+            with self.conn:
+                self.conn.executemany('DELETE FROM faces WHERE id=?',
+                                      [(face_id,) for face_id, cluster_id, size in rows])
+                for cluster_id in set(cluster_id for face_id, cluster_id, size in rows):
+                    remaining = [h for (h,) in self.conn.execute(
+                        'SELECT hash FROM faces WHERE cluster_id=? ORDER BY id DESC LIMIT ?',
+                        (cluster_id, CLUSTER_HASHES))]
+                    if remaining:
+                        self.clusterHashes[cluster_id] = remaining[::-1]
+                    else:
+                        self.conn.execute('DELETE FROM clusters WHERE id=?', (cluster_id,))
+                        self.clusterHashes.pop(cluster_id, None)
+            for face_id, cluster_id, size in rows:
+                self.totalBytes -= size
+                for path in (self.facePath(face_id), self.thumbnailPath(face_id)):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    # 按保留策略清理：先删除过期的人脸，再按最后访问时间删除，直到总大小降到上限的90%以下
+    def evict(self):
+        with self.lock:
+            removed = 0
+            if self.maxAgeDays:
+                rows = self.conn.execute('SELECT id, cluster_id, bytes FROM faces WHERE timestamp < ?',
+                                         (time.time() - self.maxAgeDays * 86400,)).fetchall()
+                self.removeFaces(rows)
+                removed += len(rows)
+            while self.totalBytes > self.maxBytes * 0.9:
+                rows = self.conn.execute(
+                    'SELECT id, cluster_id, bytes FROM faces ORDER BY last_access LIMIT 100').fetchall()
+                if not rows:
+                    break
+                excess = self.totalBytes - self.maxBytes * 0.9
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    excess -= row[2]
+                    if excess <= 0:
+                        break
+                self.removeFaces(batch)
+                removed += len(batch)
+            return removed
+
+    # 分组列表，按最后出现时间倒序，返回 [(cluster_id, first_seen, last_seen, visits, 人脸数, 缩略图路径)]
+    def listClusters(self, limit=50, offset=0):
+        with self.lock:
+            rows = self.conn.execute('''SELECT c.id, c.first_seen, c.last_seen, c.visits, Count(f.id), MAX(f.id)
+                                        FROM clusters c JOIN faces f ON f.cluster_id = c.id
+                                        GROUP BY c.id ORDER BY c.last_seen DESC LIMIT ? OFFSET ?''',
+                                     (limit, offset)).fetchall()
+            return [row[:5] + (self.thumbnailPath(row[5]),) for row in rows]
+
+    # 分组中的全部人脸图像路径，并更新最后访问时间
+    def clusterFaces(self, cluster_id):
+        with self.lock:
+            ids = [face_id for (face_id,) in self.conn.execute('SELECT id FROM faces WHERE cluster_id=? ORDER BY id',
+                                                               (cluster_id,))]
+            with self.conn:
+                self.conn.execute('UPDATE faces SET last_access=? WHERE cluster_id=?', (time.time(), cluster_id))
+            return [self.facePath(face_id) for face_id in ids]
+
+    # 将分组注册为新用户：人脸图像写入该用户的人脸数据集，用户信息写入数据库，随后从存档中删除该分组
+    # 返回写入的人脸图像数，下次训练时自动加入模型
+    def promote(self, cluster_id, faceBase, datasets, stu_id, cn_name, en_name):
+        with self.lock:
+            paths = self.clusterFaces(cluster_id)
+            if not paths:
+                raise KeyError('分组{}不存在'.format(cluster_id))
+            if faceBase.getUser(stu_id):
+                raise ValueError('学号{}已存在'.format(stu_id))
+            if not os.path.isdir(datasets):
+                os.makedirs(datasets)
+            count = 0
+            with PackWriter(packPath(datasets, stu_id)) as writer:
+                for path in paths:
+                    face = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+                    if face is not None:
+                        writer.append(face)
+                        count += 1
+            faceBase.insertUser(stu_id, cn_name, en_name)
+            self.removeFaces(self.conn.execute('SELECT id, cluster_id, bytes FROM faces WHERE cluster_id=?',
+                                               (cluster_id,)).fetchall())
+            return count
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='陌生人脸存档')
+    parser.add_argument('--root', default='./unknown')
+    subparsers = parser.add_subparsers(dest='command')
+
+    listParser = subparsers.add_parser('list', help='按最后出现时间列出陌生人脸分组')
+    listParser.add_argument('--limit', type=int, default=50)
+
+    promoteParser = subparsers.add_parser('promote', help='将分组注册为新用户')
+    promoteParser.add_argument('cluster_id', type=int)
+    promoteParser.add_argument('stu_id')
+    promoteParser.add_argument('cn_name')
+    promoteParser.add_argument('en_name')
+    promoteParser.add_argument('--database', default='./FaceBase.db')
+    promoteParser.add_argument('--datasets', default='./datasets')
+
+    pruneParser = subparsers.add_parser('prune', help='按保留策略清理存档')
+    pruneParser.add_argument('--max-mb', type=int, default=MAX_BYTES // 1024 // 1024)
+    pruneParser.add_argument('--days', type=int, default=MAX_AGE_DAYS)
+
+    args = parser.parse_args()
+    logging.config.fileConfig('./config/logging.cfg')
+
+    if args.command == 'list':
+        archive = UnknownArchive(args.root)
+        for cluster_id, first_seen, last_seen, visits, faces, thumbnail in archive.listClusters(args.limit):
+            print('{}\t{} ~ {}\t出现{}次\t{}张\t{}'.format(
+                cluster_id, datetime.fromtimestamp(first_seen).strftime('%Y-%m-%d %H:%M:%S'),
+                datetime.fromtimestamp(last_seen).strftime('%Y-%m-%d %H:%M:%S'), visits, faces, thumbnail))
+    elif args.command == 'promote':
+        from faceBase import getFaceBase
+        archive = UnknownArchive(args.root)
+        count = archive.promote(args.cluster_id, getFaceBase(args.database), args.datasets, args.stu_id,
+                                args.cn_name, args.en_name)
+        print('已将分组{}的{}张人脸注册为{}，请重新训练'.format(args.cluster_id, count, args.stu_id))
+    elif args.command == 'prune':
+        archive = UnknownArchive(args.root, args.max_mb * 1024 * 1024, args.days)
+        print('已删除{}张人脸，存档大小{:.1f}MB'.format(archive.evict(), archive.totalBytes / 1024 / 1024))
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from faceBase import USER_COLUMNS
+
+# 每次从数据库读取的行数
+PAGE_SIZE = 200
+
+
+# 用户表的数据模型：按需分页读取，排序与过滤都在数据库中完成，界面只持有已滚动到的行
+class UserTableModel(QAbstractTableModel):
+    HEADERS = ('学号', 'Face ID', '姓名', '汉语拼音', '注册时间')
+
+    def __init__(self, parent=None):
+        super(UserTableModel, self).__init__(parent)
+        self.faceBase = None
+        self.rows = []
+        self.totalCount = 0
+        self.prefix = ''
+        self.sortColumn = 0
+        self.sortOrder = Qt.AscendingOrder
+
+    def setFaceBase(self, faceBase):
+        self.faceBase = faceBase
+        self.refresh()
+
+    # 按学号、姓名或汉语拼音前缀过滤
+    def setFilter(self, prefix):
+        self.prefix = prefix
+        self.refresh()
+
+    # 重新统计匹配的用户数，并读取第一页
+    def refresh(self):
+        self.beginResetModel()
+        self.rows = []
+        self.totalCount = self.faceBase.countMatchedUsers(self.prefix) if self.faceBase is not None else 0
+        self.endResetModel()
+        if self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(USER_COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return str(self.rows[index.row()][index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return UserTableModel.HEADERS[section]
+        return super(UserTableModel, self).headerData(section, orientation, role)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and len(self.rows) < self.totalCount
+
+    # 视图滚动到底部时读取下一页
+    def fetchMore(self, parent):
+        if parent.isValid() or self.faceBase is None:
+            return
+        page = self.faceBase.searchUsers(self.prefix, USER_COLUMNS[self.sortColumn],
+                                         self.sortOrder == Qt.DescendingOrder, PAGE_SIZE, len(self.rows))
+        if not page:
+            self.totalCount = len(self.rows)
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    # 点击表头排序，由数据库按相应列排序后重新分页读取
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sortColumn = column
+        self.sortOrder = order
+        self.refresh()
+
+    # 第row行的用户记录
+    def user(self, row):
+        return self.rows[row]
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# Author: winterssy <winterssy@foxmail.com>
+
+import cv2
+import numpy as np
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import logging.config
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import zipfile
+
+from datasetStore import PACK_SUFFIX, PackReader, PackWriter, importDirectory, packPath, readHeader
+from faceBase import getFaceBase
+
+# 用户批量导入、导出
+# 导出目录结构：
+#   users.csv 或 users.json    用户记录，列见FIELDS
+#   faces/stu_{stu_id}.pack    人脸数据集
+# 导入时faces列为人脸数据相对于清单文件的路径，可以是打包文件、JPEG图片的zip压缩包或JPEG目录；
+# 为空时依次查找 faces/stu_{stu_id}.pack、faces/stu_{stu_id}.zip、faces/stu_{stu_id}/
+# 导入进度记录在 {清单文件}.progress 中，中断后重新执行同一命令会跳过已完成的用户
+
+FIELDS = ('stu_id', 'cn_name', 'en_name', 'face_id', 'created_time', 'faces')
+
+# 与人脸采集系统的用户信息校验规则一致
+STU_ID_PATTERN = re.compile(r'^[0-9]{12}$')
+CN_NAME_PATTERN = re.compile('^[\u4e00-\u9fa5]{1,10}$')
+EN_NAME_PATTERN = re.compile(r'^[ A-Za-z]{1,16}$')
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# 每批写入数据库的用户数
+BATCH_SIZE = 200
+
+
+# 读取用户清单，返回 [(行号, 记录)]，JSON清单的“行号”为记录序号
+def readRecords(path):
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+        if isinstance(data, dict):
+            data = data.get('users', [])
+        return [(index + 1, record) for index, record in enumerate(data)]
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        # 第1行为表头
+        return [(index + 2, record) for index, record in enumerate(csv.DictReader(file))]
+
+
+# 查找用户的人脸数据，找不到时返回None
+def findArchive(record, baseDir):
+    if record.get('faces'):
+        candidates = [os.path.join(baseDir, record['faces'])]
+    else:
+        name = 'stu_{}'.format(record['stu_id'])
+        candidates = [os.path.join(baseDir, 'faces', name + suffix) for suffix in (PACK_SUFFIX, '.zip', '')]
+    return next((path for path in candidates if os.path.exists(path)), None)
+
+
+# 检查人脸数据格式，返回错误原因，格式正确时返回None
+def checkArchive(path):
+    try:
+        if path.endswith(PACK_SUFFIX):
+            with open(path, 'rb') as file:
+                readHeader(file)
+        elif path.lower().endswith('.zip'):
+            if not zipfile.is_zipfile(path):
+                return '不是有效的zip压缩包'
+        elif not os.path.isdir(path):
+            return '不支持的人脸数据格式'
+    except Exception as e:
+        return str(e)
+    return None
+
+
+# 校验用户清单，返回 (users, errors, warnings)
+# users为通过校验的用户 {stu_id, cn_name, en_name, archive}；errors、warnings为 (行号, 学号, 原因)
+def validateRecords(records, baseDir):
+    users = []
+    errors = []
+    warnings = []
+    seen = set()
+    for line, record in records:
+        record = {key: str(value).strip() for key, value in record.items() if key and value is not None}
+        stu_id = record.get('stu_id', '')
+        if not STU_ID_PATTERN.match(stu_id):
+            errors.append((line, stu_id, '学号必须为12位数字'))
+            continue
+        if stu_id in seen:
+            errors.append((line, stu_id, '学号重复'))
+            continue
+        if not CN_NAME_PATTERN.match(record.get('cn_name', '')):
+            errors.append((line, stu_id, '姓名必须为1~10个汉字'))
+            continue
+        if not EN_NAME_PATTERN.match(record.get('en_name', '')):
+            errors.append((line, stu_id, '汉语拼音必须为1~16个英文字母或空格'))
+            continue
+        archive = findArchive(record, baseDir)
+        if archive is None:
+            if record.get('faces'):
+                errors.append((line, stu_id, '找不到人脸数据{}'.format(record['faces'])))
+                continue
+            warnings.append((line, stu_id, '没有人脸数据，仅导入用户信息'))
+        else:
+            reason = checkArchive(archive)
+            if reason:
+                errors.append((line, stu_id, '人脸数据{}无效：{}'.format(archive, reason)))
+                continue
+        seen.add(stu_id)
+        users.append({'stu_id': stu_id, 'cn_name': record['cn_name'], 'en_name': record['en_name'],
+                      'archive': archive})
+    return users, errors, warnings
+
+
+# 将一个用户的人脸数据解包为 ./datasets/stu_{stu_id}.pack，在进程池中执行
+# 先写入临时文件再替换，中断时不会留下不完整的数据集；返回 (stu_id, 图片数, 错误信息)
+def unpackArchive(task):
+    stu_id, archive, target = task
+    if archive is None:
+        return stu_id, 0, None
+    tmpPath = target + '.importing'
+    try:
+        if archive.endswith(PACK_SUFFIX):
+            shutil.copyfile(archive, tmpPath)
+            count = len(PackReader(tmpPath))
+        elif archive.lower().endswith('.zip'):
+            count = 0
+            with zipfile.ZipFile(archive) as zf, PackWriter(tmpPath) as writer:
+                for name in sorted(zf.namelist()):
+                    if not name.lower().endswith(IMAGE_SUFFIXES):
+                        continue
+                    image = cv2.imdecode(np.frombuffer(zf.read(name), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+                    if image is not None:
+                        writer.append(image)
+                        count += 1
+        else:
+            count = importDirectory(archive, tmpPath)
+        os.replace(tmpPath, target)
+    except Exception as e:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        return stu_id, 0, str(e)
+    return stu_id, count, None
+
+
+# 导入进度记录：首行为清单文件的摘要，之后每行一个已完成导入的学号
+class ImportJournal:
+    def __init__(self, manifest):
+        self.path = manifest + '.progress'
+        with open(manifest, 'rb') as file:
+            self.digest = hashlib.sha1(file.read()).hexdigest()
+        self.done = set()
+        if os.path.isfile(self.path):
+            with open(self.path, encoding='utf-8') as file:
+                lines = file.read().splitlines()
+            # 清单文件已改动时，之前的进度作废
+            if lines and lines[0] == self.digest:
+                self.done = set(line for line in lines[1:] if line)
+        self.file = None
+
+    # 记录一批已完成的学号，落盘后才返回
+    def append(self, stu_ids):
+        if self.file is None:
+            self.file = open(self.path, 'w' if not self.done else 'a', encoding='utf-8')
+            if not self.done:
+                self.file.write(self.digest + '\n')
+        self.file.write(''.join(stu_id + '\n' for stu_id in stu_ids))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.done.update(stu_ids)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # 导入全部完成后删除进度记录
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# 批量导入用户及人脸数据，返回导入报告
+# overwrite为False时跳过数据库中已存在的用户；dryRun为True时只校验，不写入任何数据
+def importUsers(manifest, database='./FaceBase.db', datasets='./datasets', workers=None, overwrite=False,
+                dryRun=False, emit=print):
+    users, errors, warnings = validateRecords(readRecords(manifest), os.path.dirname(os.path.abspath(manifest)))
+    report = {'total': len(users) + len(errors), 'invalid': len(errors), 'errors': errors, 'warnings': warnings,
+              'existing': 0, 'skipped': 0, 'resumed': 0, 'imported': 0, 'images': 0, 'failed': []}
+
+    # 先排除上次中断前已导入的用户，这些用户此时已在数据库中，不应计为已存在
+    journal = ImportJournal(manifest)
+    pending = [user for user in users if user['stu_id'] not in journal.done]
+    report['resumed'] = len(users) - len(pending)
+
+    # 校验时数据库不存在则不创建
+    faceBase = getFaceBase(database) if not dryRun or os.path.isfile(database) else None
+    existing = faceBase.existingStuIds(user['stu_id'] for user in pending) if faceBase is not None else set()
+    report['existing'] = len(existing)
+    if not overwrite:
+        report['skipped'] = len(existing)
+        pending = [user for user in pending if user['stu_id'] not in existing]
+    if dryRun:
+        report['imported'] = len(pending)
+        return report
+
+    if not os.path.isdir(datasets):
+        os.makedirs(datasets)
+    usersById = {user['stu_id']: user for user in pending}
+    tasks = [(user['stu_id'], user['archive'], packPath(datasets, user['stu_id'])) for user in pending]
+    batch = []
+
+    # 每凑满一批，在同一事务中写入数据库，再记录进度
+    def flush():
+        faceBase.upsertUsers([(user['stu_id'], user['cn_name'], user['en_name']) for user in batch])
+        journal.append([user['stu_id'] for user in batch])
+        report['imported'] += len(batch)
+        emit('已导入 {}/{} 个用户'.format(report['imported'], len(pending)))
+        del batch[:]
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        for stu_id, count, error in pool.imap_unordered(unpackArchive, tasks, chunksize=4):
+            if error:
+                logging.error('导入{}的人脸数据失败：{}'.format(stu_id, error))
+                report['failed'].append((stu_id, error))
+                continue
+            report['images'] += count
+            batch.append(usersById[stu_id])
+            if len(batch) >= BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        journal.close()
+
+    if not report['failed']:
+        journal.remove()
+    return report
+
+
+# 导出全部用户及人脸数据到outDir，返回导出的用户数
+# 只有旧版JPEG目录的用户，导出时转换为打包文件
+def exportUsers(outDir, database='./FaceBase.db', datasets='./datasets', fmt='csv', emit=print):
+    facesDir = os.path.join(outDir, 'faces')
+    if not os.path.isdir(facesDir):
+        os.makedirs(facesDir)
+    records = []
+    for stu_id, face_id, cn_name, en_name, created_time in getFaceBase(database).listUsers():
+        faces = 'faces/stu_{}{}'.format(stu_id, PACK_SUFFIX)
+        legacyDir = '{}/stu_{}'.format(datasets, stu_id)
+        if os.path.isfile(packPath(datasets, stu_id)):
+            shutil.copyfile(packPath(datasets, stu_id), os.path.join(outDir, faces))
+        elif os.path.isdir(legacyDir):
+            importDirectory(legacyDir, os.path.join(outDir, faces))
+        else:
+            faces = ''
+        records.append(dict(zip(FIELDS, (stu_id, cn_name, en_name, face_id, created_time, faces))))
+        if len(records) % BATCH_SIZE == 0:
+            emit('已导出 {} 个用户'.format(len(records)))
+
+    if fmt == 'json':
+        with open(os.path.join(outDir, 'users.json'), 'w', encoding='utf-8') as file:
+            json.dump(records, file, ensure_ascii=False, indent=2)
+    else:
+        with open(os.path.join(outDir, 'users.csv'), 'w', encoding='utf-8-sig', newline='') as file:
+            writer = csv.DictWriter(file, FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    return len(records)
+
+
+# 格式化导入报告
+def formatImportReport(report, dryRun=False):
+    lines = ['清单中的用户：{}，校验失败：{}，数据库中已存在：{}'.format(
+        report['total'], report['invalid'], report['existing'])]
+    for line, stu_id, reason in report['errors']:
+        lines.append('  Error：第{}行 {}：{}'.format(line, stu_id, reason))
+    for line, stu_id, reason in report['warnings']:
+        lines.append('  Warning：第{}行 {}：{}'.format(line, stu_id, reason))
+    if report['skipped']:
+        lines.append('跳过已存在的用户：{}（使用 --overwrite 覆盖）'.format(report['skipped']))
+    if report['resumed']:
+        lines.append('上次中断前已导入：{}'.format(report['resumed']))
+    if dryRun:
+        lines.append('校验完成，将导入 {} 个用户，未写入任何数据'.format(report['imported']))
+    else:
+        lines.append('已导入用户：{}，人脸图像：{}'.format(report['imported'], report['images']))
+        for stu_id, error in report['failed']:
+            lines.append('  Error：{} 的人脸数据导入失败：{}'.format(stu_id, error))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='用户及人脸数据批量导入、导出')
+    parser.add_argument('--database', default='./FaceBase.db')
+    parser.add_argument('--datasets', default='./datasets')
+    subparsers = parser.add_subparsers(dest='command')
+
+    importParser = subparsers.add_parser('import', help='从CSV/JSON清单导入用户及人脸数据')
+    importParser.add_argument('manifest')
+    importParser.add_argument('--dry-run', action='store_true', help='只校验清单及人脸数据，不写入')
+    importParser.add_argument('--overwrite', action='store_true', help='覆盖数据库中已存在的用户')
+    importParser.add_argument('--workers', type=int, default=None, help='解包人脸数据的并行进程数，默认为CPU核心数')
+    importParser.add_argument('--train', action='store_true', help='导入完成后增量训练一次')
+    importParser.add_argument('--equalize-hist', action='store_true', help='训练时执行直方图均衡化')
+
+    exportParser = subparsers.add_parser('export', help='导出用户及人脸数据')
+    exportParser.add_argument('outDir')
+    exportParser.add_argument('--format', choices=('csv', 'json'), default='csv')
+
+    args = parser.parse_args()
+    logging.config.fileConfig('./config/logging.cfg')
+
+    if args.command == 'import':
+        report = importUsers(args.manifest, args.database, args.datasets, args.workers, args.overwrite,
+                             args.dry_run)
+        print(formatImportReport(report, args.dry_run))
+        if args.dry_run:
+            sys.exit(1 if report['errors'] else 0)
+        if args.train and report['imported']:
+            from trainer import TrainingJob, formatReport
+
+            def printEvent(event):
+                if event['type'] == 'log':
+                    print(event['message'])
+
+            job = TrainingJob(args.database, args.datasets, equalizeHist=args.equalize_hist, emit=printEvent)
+            print(formatReport(job.run()))
+        sys.exit(1 if report['failed'] else 0)
+    elif args.command == 'export':
+        count = exportUsers(args.outDir, args.database, args.datasets, args.format)
+        print('已导出 {} 个用户到 {}'.format(count, args.outDir))
+    else:
+        parser.print_help()
+        sys.exit(1)